@@ -0,0 +1,7 @@
+"""
+Shared building blocks for the Gemini-backed FastAPI services
+(rag-server, question-generator and lecture-planner).
+
+Each service puts the repository root on ``sys.path`` and imports the
+modules it needs, e.g. ``from ai_common.health import UpstreamHealthMonitor``.
+"""
@@ -0,0 +1,169 @@
+"""
+Post-extraction text compaction.
+
+Text extracted from lecture PDFs carries a lot of layout noise that costs
+prompt tokens (and skews TF-IDF) without adding content: running headers and
+footers repeated on every page, page numbers, words hyphenated across line
+breaks and runs of whitespace. ``compact_pages`` removes it:
+
+- lines at the top or bottom of a page that recur unchanged on a large share
+  of pages are stripped; pages too short to have a margin apart from their
+  content (a slide with a title and a few bullets) are left alone. Lines that
+  differ only in their numbers count as the same line when they look like
+  page numbers (``Page 3 of 40``, ``Page 4 of 40``), and not otherwise;
+- a word split as ``exam-`` / ``ple`` across a line break is rejoined, unless
+  the document uses the second part as a word of its own or writes the word
+  with a hyphen elsewhere (``well-`` / ``known`` stays ``well-known``);
+- runs of spaces and tabs become one space and blank lines are collapsed, but
+  paragraph breaks are kept (context packing splits on them).
+
+Pages are compacted one by one and joined with ``PAGE_BREAK``, so page
+boundaries survive (see ``ai_common.page_index``).
+
+The result reports token counts before and after, so savings can be tracked
+per document.
+"""
+
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional
+
+from ai_common.context import ApproxTokenCounter
+from ai_common.page_index import PAGE_BREAK
+
+# Bump when the compacted output changes so cached compact text from older code is ignored
+COMPACTION_REVISION = 2
+# Lines this close to the top or bottom of a page are header/footer candidates
+MARGIN_LINES = 3
+# Share of pages a margin line must appear on to count as boilerplate
+MIN_REPEAT_RATIO = 0.4
+# Documents shorter than this have too few pages to tell boilerplate from content
+MIN_PAGES = 3
+
+_DIGITS_RE = re.compile(r"\d+")
+_SPACES_RE = re.compile(r"[ \t\f\v\u00a0]+")
+_HYPHEN_BREAK_RE = re.compile(r"(\w+)([-\u00ad])\n[ \t]*([a-z]\w*)")
+_WORD_RE = re.compile(r"\w+(?:-\w+)*")
+# Normalized lines that are or end in a page number: "#", "# / #", "cs101 - page # of #", "slide #"
+_PAGE_NUMBER_RE = re.compile(r"(?:^|\b(?:page|slide|p\.)\s*)#(?:\s*(?:of|/)\s*#)?$")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+@dataclass
+class CompactionResult:
+    text: str
+    tokens_before: int
+    tokens_after: int
+    boilerplate_lines: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+def _normalize(line: str) -> str:
+    return _SPACES_RE.sub(" ", line.strip().lower())
+
+
+def _line_key(line: str) -> str:
+    """Normalized form used to recognize the same header or footer on different pages"""
+    return _DIGITS_RE.sub("#", _normalize(line))
+
+
+def _margin_indexes(lines: List[str]) -> List[int]:
+    """
+    Indexes of the first and last non-empty lines of a page; none when the
+    page has so few lines that its margins would be all of it
+    """
+    filled = [index for index, line in enumerate(lines) if line.strip()]
+    if len(filled) <= 2 * MARGIN_LINES:
+        return []
+    return sorted(set(filled[:MARGIN_LINES] + filled[-MARGIN_LINES:]))
+
+
+def boilerplate_keys(pages: List[List[str]]) -> set:
+    """
+    Normalized margin lines that recur on at least ``MIN_REPEAT_RATIO`` of
+    the pages, with the same text on each unless they are page numbers
+    """
+    if len(pages) < MIN_PAGES:
+        return set()
+    counts = Counter()
+    variants = {}
+    for lines in pages:
+        margin = {_normalize(lines[index]) for index in _margin_indexes(lines)}
+        for line in margin:
+            variants.setdefault(_line_key(line), set()).add(line)
+        counts.update({_line_key(line) for line in margin})
+    threshold = max(2, MIN_REPEAT_RATIO * len(pages))
+    return {
+        key for key, count in counts.items()
+        if key and count >= threshold and (len(variants[key]) == 1 or _PAGE_NUMBER_RE.search(key))
+    }
+
+
+def collapse_whitespace(text: str) -> str:
+    lines = (_SPACES_RE.sub(" ", line).strip() for line in text.split("\n"))
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def vocabulary(text: str) -> set:
+    """
+    Lowercase words and hyphenated compounds of ``text``, for ``dehyphenate``;
+    the parts of words hyphenated across a line break are left out
+    """
+    return set(_WORD_RE.findall(_HYPHEN_BREAK_RE.sub(" ", text).lower()))
+
+
+def dehyphenate(text: str, words: Optional[set] = None) -> str:
+    """
+    Rejoin words hyphenated across a line break (``exam-\\nple`` ->
+    ``example``), keeping the hyphen of compounds (``well-\\nknown`` ->
+    ``well-known``). A break is a compound when ``words`` (by default the
+    vocabulary of ``text``) has the hyphenated form or the second part as a
+    word of its own, and not the joined word; soft hyphens are always joined.
+    """
+    words = vocabulary(text) if words is None else words
+
+    def rejoin(match) -> str:
+        head, hyphen, tail = match.groups()
+        joined = (head + tail).lower()
+        if hyphen == "-" and joined not in words:
+            if f"{head}-{tail}".lower() in words or (len(tail) > 2 and tail.lower() in words):
+                return f"{head}-{tail}"
+        return head + tail
+
+    return _HYPHEN_BREAK_RE.sub(rejoin, text)
+
+
+def compact_text(text: str, words: Optional[set] = None) -> str:
+    """De-hyphenate and collapse whitespace in text without page boundaries"""
+    return collapse_whitespace(dehyphenate(text, words))
+
+
+def compact_pages(pages: List[str], counter: Optional[ApproxTokenCounter] = None) -> CompactionResult:
+    """Compact the per-page texts of one document into a single text, pages separated by ``PAGE_BREAK``"""
+    counter = counter or ApproxTokenCounter()
+    split_pages = [page.split("\n") for page in pages]
+    boilerplate = boilerplate_keys(split_pages)
+    removed = 0
+    kept_pages = []
+    for lines in split_pages:
+        if boilerplate:
+            margin = set(_margin_indexes(lines))
+            kept = [line for index, line in enumerate(lines)
+                    if index not in margin or _line_key(line) not in boilerplate]
+            removed += len(lines) - len(kept)
+            lines = kept
+        kept_pages.append("\n".join(lines))
+
+    original = "\n".join(pages)
+    words = vocabulary(original)
+    text = PAGE_BREAK.join(compact_text(page, words) for page in kept_pages)
+    return CompactionResult(
+        text=text,
+        tokens_before=counter.count(original),
+        tokens_after=counter.count(text),
+        boilerplate_lines=removed,
+    )
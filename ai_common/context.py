@@ -0,0 +1,295 @@
+"""
+Token-budget-aware context packing for Gemini prompts.
+
+Services used to truncate document text by character count (``text[:4000]``)
+which cuts mid-word and says nothing about the real token cost. ``pack_context``
+splits text at sentence boundaries and fills a token budget instead:
+
+- without a query, sentences are taken in document order (the beginning of
+  the document is the most useful context for plans and quizzes);
+- with a query, sentences are ranked by overlap with the query terms and the
+  best ones are kept, then re-emitted in document order.
+
+``pack_sources`` does the same across several labelled texts (the pages of a
+document) and heads each kept run with its label, so answers can cite pages.
+
+Token counts come from an offline approximate tokenizer by default. Exact
+counting through the Gemini ``count_tokens`` API can be enabled with
+``TOKEN_COUNTER=gemini``; it is only used to verify the final packed text, so
+it costs at most a couple of API calls per prompt.
+"""
+
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_WORD_RE = re.compile(r"[a-z0-9]{3,}")
+_SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+# Average characters per token for Gemini's tokenizer on English prose
+CHARS_PER_TOKEN = 4
+
+STOPWORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has him his how "
+    "its may new now old see two who did get let put say she too use what when where "
+    "which while with this that these those from into about there their they them then "
+    "than been have were will would could should does doing each other some such only "
+    "own same very just also more most over under again further once here why".split()
+)
+
+
+class ApproxTokenCounter:
+    """Offline token estimate: one token per punctuation mark, ~4 characters per word piece"""
+
+    name = "approx"
+
+    def count(self, text: str) -> int:
+        total = 0
+        for match in _TOKEN_RE.finditer(text):
+            piece = match.group()
+            total += max(1, math.ceil(len(piece) / CHARS_PER_TOKEN))
+        return total
+
+
+class GeminiTokenCounter:
+    """Exact token counts from the Gemini API, falling back to the estimate on error"""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str):
+        import google.generativeai as genai
+
+        self._model = genai.GenerativeModel(model_name)
+        self._fallback = ApproxTokenCounter()
+
+    def count(self, text: str) -> int:
+        try:
+            return self._model.count_tokens(text).total_tokens
+        except Exception:
+            return self._fallback.count(text)
+
+
+def counter_from_env(model_name: str):
+    """Return the token counter selected by TOKEN_COUNTER (``approx`` or ``gemini``)"""
+    if os.getenv("TOKEN_COUNTER", "approx").lower() == "gemini":
+        return GeminiTokenCounter(model_name)
+    return ApproxTokenCounter()
+
+
+def budget_from_env(name: str, default: int) -> int:
+    """Read a per-endpoint token budget such as ``MCQ_CONTEXT_TOKENS``"""
+    return int(os.getenv(name, str(default)))
+
+
+def char_budget(tokens: int, slack: float = 2.0) -> int:
+    """
+    Characters of raw document text worth extracting to fill ``tokens``.
+    ``slack`` covers whitespace, short tokens and sentences that do not fit.
+    """
+    return int(tokens * CHARS_PER_TOKEN * slack)
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens: int
+    budget: int
+    truncated: bool
+    sources: List[str] = field(default_factory=list)
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences, keeping trailing whitespace so pieces concatenate back"""
+    segments = []
+    start = 0
+    for match in _SENTENCE_BOUNDARY_RE.finditer(text):
+        if match.end() > start:
+            segments.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        segments.append(text[start:])
+    return [segment for segment in segments if segment.strip()]
+
+
+def _cut_at_word(text: str, budget: int, counter) -> str:
+    """Longest prefix of ``text`` ending on a word boundary that fits in ``budget``"""
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if counter.count(" ".join(words[:mid])) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    if low == 0:
+        # A single unbroken "word" (e.g. a URL or table dump) larger than the budget
+        return text.strip()[:budget * CHARS_PER_TOKEN]
+    return " ".join(words[:low])
+
+
+def terms(text: str) -> List[str]:
+    """Lowercase words of ``text`` without stopwords, as used for relevance scoring"""
+    return [word for word in _WORD_RE.findall(text.lower()) if word not in STOPWORDS]
+
+
+def _rank(segments: List[str], query: str) -> List[int]:
+    """Segment indices ordered by idf-weighted overlap with the query terms"""
+    query_terms = set(terms(query))
+    segment_terms = [set(terms(segment)) for segment in segments]
+    n = len(segments)
+    idf = {
+        term: math.log((n + 1) / (1 + sum(term in words for words in segment_terms))) + 1
+        for term in query_terms
+    }
+    scores = [sum(idf[term] for term in query_terms & words) for words in segment_terms]
+    return sorted(range(n), key=lambda i: (-scores[i], i))
+
+
+def pack_context(text: str, budget: int, query: Optional[str] = None, counter=None) -> PackedContext:
+    """
+    Pack ``text`` into at most ``budget`` tokens, cutting only at sentence boundaries.
+
+    If not even the first sentence fits, it is cut at a word boundary instead.
+    ``counter`` defaults to the offline estimate; pass ``counter_from_env(...)``
+    to honour ``TOKEN_COUNTER``.
+    """
+    segments = split_sentences(text)
+    packed, tokens, chosen, _ = _pack(segments, budget, query, counter, _join)
+    return PackedContext(
+        text=packed,
+        tokens=tokens,
+        budget=budget,
+        truncated=len(chosen) < len(segments),
+    )
+
+
+def pack_sources(sources: List[Tuple[str, str]], budget: int, query: Optional[str] = None,
+                 counter=None) -> PackedContext:
+    """
+    ``pack_context`` over several labelled texts, such as the pages of a
+    document. Sentences are chosen across all sources and each run of kept
+    sentences is headed by its source's label (``[p. 12]``), so the model can
+    cite where an answer came from; sources with an empty label get no
+    heading. ``PackedContext.sources`` lists the labels that made it in.
+    """
+    segments, owners = [], []
+    for position, (_, text) in enumerate(sources):
+        for segment in split_sentences(text):
+            segments.append(segment)
+            owners.append(position)
+
+    def render(pieces: List[Tuple[int, str]]) -> str:
+        return _join_labelled(pieces, owners, [label for label, _ in sources])
+
+    packed, tokens, chosen, shown = _pack(segments, budget, query, counter, render)
+    labels = []
+    for index in shown:
+        label = sources[owners[index]][0]
+        if label and label not in labels:
+            labels.append(label)
+    return PackedContext(
+        text=packed,
+        tokens=tokens,
+        budget=budget,
+        truncated=len(chosen) < len(segments),
+        sources=labels,
+    )
+
+
+def _pack(segments: List[str], budget: int, query: Optional[str], counter,
+          render: Callable[[List[Tuple[int, str]]], str]) -> Tuple[str, int, List[int], List[int]]:
+    """
+    Choose segments within ``budget``. Returns the rendered text, its token
+    count, the indices of the whole segments chosen and of the segments shown
+    (the same, unless the first one had to be cut to fit)
+    """
+    counter = counter or ApproxTokenCounter()
+    estimate = ApproxTokenCounter()
+
+    if query and query.strip():
+        order = _rank(segments, query)
+        in_order = False
+    else:
+        order = list(range(len(segments)))
+        in_order = True
+
+    chosen, used = [], 0
+    for index in order:
+        cost = estimate.count(segments[index])
+        if used + cost > budget:
+            if in_order:
+                break
+            continue
+        chosen.append(index)
+        used += cost
+    chosen.sort()
+
+    packed = render([(index, segments[index]) for index in chosen])
+    shown = chosen
+    if not packed and segments:
+        packed = render([(order[0], _cut_at_word(segments[order[0]], budget, estimate))])
+        shown = [order[0]]
+
+    # Exact counters only verify the result; if the estimate was optimistic,
+    # drop trailing sentences in proportion to the overshoot and re-check,
+    # keeping at least one
+    tokens = counter.count(packed)
+    while tokens > budget and len(chosen) > 1:
+        target = used * budget / tokens
+        while len(chosen) > 1 and used > target:
+            used -= estimate.count(segments[chosen.pop()])
+        packed = render([(index, segments[index]) for index in chosen])
+        tokens = counter.count(packed)
+
+    # A single segment still over budget is cut at a word, shrinking the
+    # estimated budget by the overshoot until the exact count fits
+    if tokens > budget and shown:
+        index = shown[0]
+        segment = segments[index]
+        chosen, shown = [], [index]
+        while tokens > budget and segment:
+            scaled = int(estimate.count(segment) * budget / tokens)
+            if scaled < 1:
+                segment = ""
+                break
+            cut = _cut_at_word(segment, scaled, estimate)
+            segment = cut if len(cut) < len(segment) else segment[:len(segment) * budget // tokens]
+            packed = render([(index, segment)])
+            tokens = counter.count(packed)
+        if not segment:
+            packed, tokens = "", 0
+
+    return packed, tokens, chosen, shown
+
+
+def _join(pieces: List[Tuple[int, str]]) -> str:
+    """Concatenate chosen segments, marking gaps where sentences were skipped"""
+    parts = []
+    previous = None
+    for index, segment in pieces:
+        if previous is not None and index != previous + 1:
+            parts.append("\n...\n")
+        parts.append(segment)
+        previous = index
+    return "".join(parts).strip()
+
+
+def _join_labelled(pieces: List[Tuple[int, str]], owners: List[int], labels: List[str]) -> str:
+    """Like ``_join``, with a ``[label]`` line wherever the source changes"""
+    parts = []
+    previous = None
+    for index, segment in pieces:
+        owner = owners[index]
+        if previous is None or owner != owners[previous]:
+            if parts:
+                parts[-1] = parts[-1].rstrip() + "\n\n"
+            if labels[owner]:
+                parts.append(f"[{labels[owner]}]\n")
+        elif index != previous + 1:
+            parts.append("\n...\n")
+        parts.append(segment)
+        previous = index
+    return "".join(parts).strip()
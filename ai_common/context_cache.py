@@ -0,0 +1,304 @@
+"""
+Context caching for repeatedly queried documents.
+
+When the same large document is sent with every question, the model re-reads
+the same tokens each time. ``ContextCacheManager`` counts requests per context
+key and, once a key gets heavy traffic, asks a backend to create a cached
+context handle. Later requests send only the question against that handle,
+and the handle's TTL is extended shortly before it expires. Handles that
+expire unused, or whose context is invalidated, are deleted from the backend.
+
+Backends are pluggable:
+
+- ``GeminiContextCacheBackend`` uses the Gemini cached-content API;
+- ``LocalContextCacheBackend`` keeps contexts in memory and answers through a
+  plain ``generate(prompt)`` callable, for tests and local development.
+"""
+
+import inspect
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedContext:
+    key: str
+    name: str
+    tokens: int
+    expires_at: float
+    ref: object = field(default=None, repr=False)
+
+
+class ContextCacheBackend:
+    """Interface implemented by context cache backends"""
+
+    name = "base"
+
+    def create(self, key: str, context: str, ttl: float) -> object:
+        """Create a cached context and return a backend-specific reference"""
+        raise NotImplementedError
+
+    def refresh(self, ref: object, ttl: float) -> None:
+        """Extend the lifetime of a cached context"""
+        raise NotImplementedError
+
+    def delete(self, ref: object) -> None:
+        raise NotImplementedError
+
+    async def generate(self, ref: object, prompt: str, timeout: float) -> str:
+        """Generate a response to ``prompt`` with the cached context in front of it"""
+        raise NotImplementedError
+
+
+class GeminiContextCacheBackend(ContextCacheBackend):
+    """Cached contents stored by Gemini; requires an explicit model version"""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        self._models: Dict[str, object] = {}
+
+    def create(self, key: str, context: str, ttl: float) -> object:
+        from google.generativeai import caching
+
+        return caching.CachedContent.create(
+            model=self.model_name,
+            display_name=f"kb-{key[:40]}",
+            contents=[context],
+            ttl=timedelta(seconds=ttl),
+        )
+
+    def refresh(self, ref: object, ttl: float) -> None:
+        ref.update(ttl=timedelta(seconds=ttl))
+
+    def delete(self, ref: object) -> None:
+        self._models.pop(ref.name, None)
+        ref.delete()
+
+    async def generate(self, ref: object, prompt: str, timeout: float) -> str:
+        import google.generativeai as genai
+
+        # Reuse one client per cached content
+        model = self._models.get(ref.name)
+        if model is None:
+            model = self._models[ref.name] = genai.GenerativeModel.from_cached_content(cached_content=ref)
+        response = await model.generate_content_async(prompt, request_options={"timeout": timeout})
+        return response.text
+
+
+class LocalContextCacheBackend(ContextCacheBackend):
+    """
+    In-memory stand-in that prepends the stored context to each prompt;
+    ``generate`` may be a plain function or a coroutine function
+    """
+
+    name = "local"
+
+    def __init__(self, generate: Callable[[str], object]):
+        self._generate = generate
+        self.contexts: Dict[str, str] = {}
+
+    def create(self, key: str, context: str, ttl: float) -> object:
+        self.contexts[key] = context
+        return key
+
+    def refresh(self, ref: object, ttl: float) -> None:
+        pass
+
+    def delete(self, ref: object) -> None:
+        self.contexts.pop(ref, None)
+
+    async def generate(self, ref: object, prompt: str, timeout: float) -> str:
+        result = self._generate(f"{self.contexts[ref]}\n\n{prompt}")
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+
+class ContextCacheManager:
+    """
+    Decides when a context is hot enough to cache and keeps its handle alive.
+
+    A key becomes eligible after ``min_hits`` requests within ``window``
+    seconds. Contexts smaller than ``min_tokens`` are never cached (Gemini
+    rejects small cached contents and they are cheap to resend anyway).
+    Expired handles are dropped, and deleted from the backend, on the next
+    lookup.
+    """
+
+    def __init__(
+        self,
+        backend: ContextCacheBackend,
+        ttl: float = 3600.0,
+        refresh_margin: float = 300.0,
+        min_hits: int = 3,
+        window: float = 600.0,
+        min_tokens: int = 32768,
+        failure_backoff: float = 300.0,
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_hits = min_hits
+        self.window = window
+        self.min_tokens = min_tokens
+        self.failure_backoff = failure_backoff
+        self._handles: Dict[str, CachedContext] = {}
+        self._hits: Dict[str, List[float]] = {}
+        self._skip_until: Dict[str, float] = {}
+        self._creating: set = set()
+        # Keys invalidated while their handle was being created
+        self._invalidated: set = set()
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "refreshed": 0, "hits": 0, "too_small": 0, "expired": 0, "deleted": 0, "errors": 0}
+
+    def _record_hit(self, key: str, now: float) -> int:
+        hits = [t for t in self._hits.get(key, []) if now - t < self.window]
+        hits.append(now)
+        self._hits[key] = hits
+        return len(hits)
+
+    def _drop_expired(self, now: float) -> List[CachedContext]:
+        """Forget expired handles and stale counters; returns the handles to delete"""
+        expired = [handle for handle in self._handles.values() if handle.expires_at <= now]
+        for handle in expired:
+            del self._handles[handle.key]
+        for key in [k for k, hits in self._hits.items() if now - hits[-1] >= self.window]:
+            del self._hits[key]
+        for key in [k for k, until in self._skip_until.items() if until <= now]:
+            del self._skip_until[key]
+        self.stats["expired"] += len(expired)
+        return expired
+
+    def _delete(self, handles: List[CachedContext]) -> None:
+        for handle in handles:
+            try:
+                self.backend.delete(handle.ref)
+                self.stats["deleted"] += 1
+            except Exception as e:
+                # Remote contents may already be gone once their TTL has passed
+                logger.info("Context cache deletion failed for %s: %s", handle.key, e)
+
+    def invalidate(self, key: str) -> None:
+        """Delete the cached context for ``key``, e.g. once its knowledge base is gone"""
+        with self._lock:
+            handle = self._handles.pop(key, None)
+            self._hits.pop(key, None)
+            self._skip_until.pop(key, None)
+            if key in self._creating:
+                self._invalidated.add(key)
+        if handle is not None:
+            self._delete([handle])
+
+    def lookup(self, key: str, load_context: Callable[[], Tuple[str, int]]) -> Optional[CachedContext]:
+        """
+        Count a request for ``key`` and return a live cached context, creating
+        or refreshing it when needed. ``load_context`` returns (text, tokens)
+        and is only called when a new cache entry is about to be created.
+        Returns None when the request should be sent without a cache.
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = self._drop_expired(now)
+            hits = self._record_hit(key, now)
+            handle = self._handles.get(key)
+            creating = (handle is None and hits >= self.min_hits
+                        and self._skip_until.get(key, 0) <= now and key not in self._creating)
+            if creating:
+                # Only one request builds the cache; concurrent ones go uncached
+                self._creating.add(key)
+        self._delete(expired)
+        if handle is None and not creating:
+            return None
+
+        if handle is not None:
+            if handle.expires_at - now < self.refresh_margin:
+                try:
+                    self.backend.refresh(handle.ref, self.ttl)
+                    handle.expires_at = now + self.ttl
+                    self.stats["refreshed"] += 1
+                except Exception as e:
+                    logger.warning("Context cache refresh failed for %s: %s", key, e)
+                    self.stats["errors"] += 1
+            self.stats["hits"] += 1
+            return handle
+
+        try:
+            return self._create(key, load_context, now)
+        finally:
+            with self._lock:
+                self._creating.discard(key)
+
+    def _create(self, key: str, load_context: Callable[[], Tuple[str, int]], now: float) -> Optional[CachedContext]:
+        context, tokens = load_context()
+        if tokens < self.min_tokens:
+            with self._lock:
+                self._skip_until[key] = now + self.window
+            self.stats["too_small"] += 1
+            return None
+
+        try:
+            ref = self.backend.create(key, context, self.ttl)
+        except Exception as e:
+            logger.warning("Context cache creation failed for %s: %s", key, e)
+            with self._lock:
+                self._skip_until[key] = now + self.failure_backoff
+            self.stats["errors"] += 1
+            return None
+
+        handle = CachedContext(key=key, name=str(getattr(ref, "name", ref)), tokens=tokens,
+                               expires_at=now + self.ttl, ref=ref)
+        self.stats["created"] += 1
+        with self._lock:
+            stale = key in self._invalidated
+            self._invalidated.discard(key)
+            if not stale:
+                self._handles[key] = handle
+        if stale:
+            self._delete([handle])
+            return None
+        return handle
+
+    async def generate(self, handle: CachedContext, prompt: str, timeout: float) -> str:
+        return await self.backend.generate(handle.ref, prompt, timeout)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"backend": self.backend.name, "active": len(self._handles), **self.stats}
+
+
+def cache_from_env(generate: Optional[Callable[[str], object]] = None) -> Optional[ContextCacheManager]:
+    """
+    Build a manager from CONTEXT_CACHE_* env vars, or None when
+    CONTEXT_CACHE_BACKEND is ``off`` (the default). The ``local`` backend
+    answers through ``generate``; the ``gemini`` backend caches for
+    CONTEXT_CACHE_MODEL, by default GEMINI_MODEL.
+    """
+    backend_name = os.getenv("CONTEXT_CACHE_BACKEND", "off").lower()
+    if backend_name in ("off", "false", "0"):
+        return None
+    if backend_name == "gemini":
+        model_name = os.getenv("CONTEXT_CACHE_MODEL") or os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+        backend = GeminiContextCacheBackend(model_name)
+    elif backend_name == "local":
+        if generate is None:
+            raise ValueError("CONTEXT_CACHE_BACKEND=local needs a generate function")
+        backend = LocalContextCacheBackend(generate)
+    else:
+        raise ValueError(f"Unsupported CONTEXT_CACHE_BACKEND: {backend_name}")
+    return ContextCacheManager(
+        backend,
+        ttl=float(os.getenv("CONTEXT_CACHE_TTL", "3600")),
+        refresh_margin=float(os.getenv("CONTEXT_CACHE_REFRESH_MARGIN", "300")),
+        min_hits=int(os.getenv("CONTEXT_CACHE_MIN_HITS", "3")),
+        window=float(os.getenv("CONTEXT_CACHE_WINDOW", "600")),
+        min_tokens=int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "32768")),
+    )
@@ -0,0 +1,217 @@
+"""
+One-time document digests: section outline, key terms and a short summary.
+
+Quiz, lecture-plan and "what is this document about" prompts used to send
+thousands of tokens of raw text so the model could work out what a document
+covers. ``build_digest`` condenses a document once, offline and without a
+model call, into:
+
+- an outline of detected section headings (``Chapter 3``, ``2.1 Gradient
+  descent``, all-caps titles), indented by level;
+- key terms: the most frequent content words and two-word phrases;
+- an extractive summary: the sentences that best cover the document's
+  frequent terms, skipping near-duplicates, within ``DIGEST_SUMMARY_TOKENS``
+  and in document order.
+
+Documents shorter than twice the summary budget are kept whole as their own
+summary.
+
+``DigestStore`` keeps digests next to the extraction cache, keyed by the
+content hash of the PDF (and the extractor version), so a digest built when
+rag-server ingests a PDF is reused by question-generator and lecture-planner,
+and vice versa. ``DocumentDigest.to_prompt()`` renders a digest in a few
+hundred tokens.
+"""
+
+import asyncio
+import json
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from ai_common.context import STOPWORDS, ApproxTokenCounter, split_sentences
+from ai_common.extraction_cache import ExtractionCache, extraction_cache_from_env
+from ai_common.page_index import find_headings
+
+# Bump when digest contents change so stored digests from older code are ignored
+DIGEST_REVISION = 1
+
+MAX_OUTLINE = 40
+MAX_KEY_TERMS = 20
+
+_TERM_RE = re.compile(r"[a-z][a-z0-9\-]{2,}")
+
+
+@dataclass
+class DocumentDigest:
+    outline: List[str] = field(default_factory=list)
+    key_terms: List[str] = field(default_factory=list)
+    summary: str = ""
+    source_tokens: int = 0
+
+    @property
+    def empty(self) -> bool:
+        return not (self.outline or self.key_terms or self.summary)
+
+    def to_prompt(self) -> str:
+        parts = []
+        if self.outline:
+            parts.append("Outline:\n" + "\n".join(f"- {entry}" for entry in self.outline))
+        if self.key_terms:
+            parts.append("Key terms: " + ", ".join(self.key_terms))
+        if self.summary:
+            parts.append("Summary:\n" + self.summary)
+        return "\n\n".join(parts)
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DocumentDigest":
+        return cls(**data)
+
+
+def _outline(text: str) -> List[str]:
+    entries, seen = [], set()
+    for heading in find_headings(text):
+        key = heading.title.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        entries.append("  " * (heading.level - 1) + heading.title)
+        if len(entries) >= MAX_OUTLINE:
+            break
+    return entries
+
+
+def _content_words(text: str) -> List[str]:
+    return [word for word in _TERM_RE.findall(text.lower()) if word not in STOPWORDS]
+
+
+def _key_terms(words: List[str], counts: Counter) -> List[str]:
+    phrases = Counter(
+        f"{first} {second}" for first, second in zip(words, words[1:]) if first != second
+    )
+    # Phrases that recur are more telling than their individual words
+    terms = [phrase for phrase, count in phrases.most_common(MAX_KEY_TERMS // 2) if count >= 3]
+    covered = {word for phrase in terms for word in phrase.split()}
+    for word, _ in counts.most_common(MAX_KEY_TERMS * 2):
+        if len(terms) >= MAX_KEY_TERMS:
+            break
+        if word not in covered:
+            terms.append(word)
+    return terms
+
+
+def _summary_candidates(text: str) -> List[str]:
+    """Sentences, with over-long ones (slide bullets without full stops) split into lines"""
+    candidates = []
+    for sentence in split_sentences(text):
+        pieces = sentence.split("\n") if len(sentence) > 400 else [sentence]
+        candidates.extend(" ".join(piece.split()) for piece in pieces)
+    return candidates
+
+
+def _summary(text: str, counts: Counter, budget: int, counter: ApproxTokenCounter) -> str:
+    weights = {word: math.log1p(count) for word, count in counts.most_common(200)}
+    candidates = []
+    for index, sentence in enumerate(_summary_candidates(text)):
+        if not 30 <= len(sentence) <= 400:
+            continue
+        terms = set(_content_words(sentence))
+        score = sum(weights.get(term, 0.0) for term in terms) / math.sqrt(len(terms) + 1)
+        candidates.append((score, index, sentence, terms))
+
+    chosen, used = [], 0
+    for score, index, sentence, terms in sorted(candidates, key=lambda item: (-item[0], item[1])):
+        # Skip sentences that mostly repeat one already chosen
+        if any(len(terms & other) > 0.6 * max(1, len(terms)) for _, _, other in chosen):
+            continue
+        cost = counter.count(sentence)
+        if used + cost > budget:
+            continue
+        chosen.append((index, sentence, terms))
+        used += cost
+        if used >= budget * 0.9:
+            break
+    return " ".join(sentence for _, sentence, _ in sorted(chosen))
+
+
+def build_digest(text: str, summary_tokens: Optional[int] = None) -> DocumentDigest:
+    """Digest of a document's (compacted) text; CPU bound, call it off the event loop"""
+    counter = ApproxTokenCounter()
+    if summary_tokens is None:
+        summary_tokens = int(os.getenv("DIGEST_SUMMARY_TOKENS", "200"))
+    source_tokens = counter.count(text)
+    if source_tokens <= 2 * summary_tokens:
+        # A short document is its own best digest
+        return DocumentDigest(summary=" ".join(text.split()), source_tokens=source_tokens)
+    words = _content_words(text)
+    counts = Counter(words)
+    return DocumentDigest(
+        outline=_outline(text),
+        key_terms=_key_terms(words, counts),
+        summary=_summary(text, counts, summary_tokens, counter),
+        source_tokens=source_tokens,
+    )
+
+
+class DigestStore:
+    """Digests on disk, shared between services; works without a cache directory too"""
+
+    def __init__(self, cache: Optional[ExtractionCache]):
+        self.cache = cache
+        self.stats = {"built": 0, "stored": 0}
+
+    def get(self, content_hash: str) -> Optional[DocumentDigest]:
+        if self.cache is None or not content_hash:
+            return None
+        data = self.cache.get(content_hash)
+        if data is None:
+            return None
+        try:
+            return DocumentDigest.from_dict(json.loads(data))
+        except (ValueError, TypeError):
+            return None
+
+    def put(self, content_hash: str, digest: DocumentDigest) -> None:
+        if self.cache is None or not content_hash:
+            return
+        self.cache.put(content_hash, json.dumps(digest.to_dict()))
+        self.stats["stored"] += 1
+
+    async def lookup(self, content_hash: Optional[str]) -> Optional[DocumentDigest]:
+        return await asyncio.to_thread(self.get, content_hash)
+
+    async def build(self, content_hash: Optional[str], text: str, store: bool = True) -> DocumentDigest:
+        """
+        Build a digest off the event loop and store it under ``content_hash``.
+        Pass ``store=False`` for digests of partially extracted documents.
+        """
+        digest = await asyncio.to_thread(build_digest, text)
+        self.stats["built"] += 1
+        if store and not digest.empty:
+            await asyncio.to_thread(self.put, content_hash, digest)
+        return digest
+
+    def snapshot(self) -> Dict:
+        return {
+            **self.stats,
+            "cache": self.cache.snapshot() if self.cache is not None else None,
+        }
+
+
+def digest_prompts_from_env() -> bool:
+    """Whether prompts use digests instead of raw text (DIGEST_PROMPTS, ``on`` or ``off``, default off)"""
+    return os.getenv("DIGEST_PROMPTS", "off").lower() in ("on", "true", "1")
+
+
+def digest_store_from_env(extractor_version: str) -> DigestStore:
+    """
+    A store in the extraction cache directory (EXTRACT_CACHE_DIR); digests
+    are kept per extractor version since they are built from its output
+    """
+    return DigestStore(extraction_cache_from_env(f"digest-r{DIGEST_REVISION}-{extractor_version}"))
@@ -0,0 +1,308 @@
+"""
+PDF text extraction off the event loop, in isolated child processes.
+
+PDF parsing is CPU bound (and PyPDF2 is pure Python): parsing a textbook
+inside an async handler (or a thread, which still holds the GIL) stalls every
+other request in the worker. ``ExtractionExecutor`` runs each document in its
+own resource-limited child process (see ``ai_common.extraction_sandbox``), so
+the event loop only awaits the result and one bad PDF cannot hang or exhaust
+the service:
+
+- the number of concurrent child processes and of queued + running jobs are
+  bounded; once the queue is full, new jobs are rejected with
+  ``ExtractionQueueFullError``;
+- each job runs under memory, CPU and wall-clock limits; the child is killed
+  when it exceeds them and the failure is classified (timeout, oom,
+  encrypted, malformed, crashed);
+- per-page progress is reported back to the caller, and pages extracted before
+  a failure can be kept as a partial result;
+- a few pages are probed for a text layer first, so scanned, image-only PDFs
+  are rejected in milliseconds (``image_only``) instead of after a full parse;
+- the extracted text is compacted (repeated headers and footers, hyphenated
+  line breaks and whitespace removed, see ``ai_common.compaction``) and the
+  tokens saved are reported per document;
+- the PDF's bookmarks are read too (``ai_common.pdf_outline``), handed to
+  ``on_outline`` and cached next to the text;
+- ``snapshot()`` reports queue depth, how long jobs waited for a slot,
+  failures by kind, the probe's reject rate and compaction savings.
+
+A job's source is either the PDF bytes or the path of a spooled upload (see
+``ai_common.uploads``); a path is parsed through a read-only memory map, so
+large PDFs are neither pickled to the child nor copied into a buffer.
+
+Callers that only need the start of a document (a prompt with a token budget)
+pass ``max_chars``: pages are extracted lazily and the job stops as soon as
+enough text has been collected, so a quiz from a 600-page textbook parses a
+few pages instead of all of them.
+
+The parser itself is pluggable (see ``ai_common.pdf_backends``); the executor
+uses the backend chosen by ``EXTRACT_BACKEND``.
+
+With an ``ExtractionCache`` attached, jobs that pass the content hash are
+served from the shared disk cache when any service has extracted the same
+bytes before, and new results are written back to it.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from ai_common.compaction import COMPACTION_REVISION, CompactionResult
+from ai_common.extraction_cache import ExtractionCache, extraction_cache_from_env
+from ai_common.extraction_sandbox import (
+    FAILURE_KINDS, ExtractionLimits, SandboxResult, compact_from_env, limits_from_env, probe_pages_from_env,
+    run_sandboxed, with_timeout
+)
+from ai_common.pdf_backends import ExtractionBackend, PDFSource, backend_from_env
+from ai_common.pdf_outline import OutlineEntry
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int], None]
+CompactionCallback = Callable[[CompactionResult], None]
+OutlineCallback = Callable[[List[OutlineEntry]], None]
+
+# Bump when the extraction output changes so cached text from older code is ignored
+EXTRACTOR_REVISION = 2
+
+
+class PDFExtractionError(Exception):
+    """
+    The PDF could not be read. ``kind`` is one of the sandbox failure kinds;
+    ``partial_text`` holds whatever was extracted before the failure.
+    """
+
+    def __init__(self, message: str, kind: str = "malformed", partial_text: str = "",
+                 pages_done: int = 0, page_count: Optional[int] = None):
+        super().__init__(message)
+        self.kind = kind
+        self.partial_text = partial_text
+        self.pages_done = pages_done
+        self.page_count = page_count
+
+
+class ExtractionQueueFullError(Exception):
+    """Too many extraction jobs are queued or running"""
+
+
+class ExtractionTimeoutError(PDFExtractionError):
+    """An extraction job ran past its wall-clock or CPU time limit"""
+
+
+def extractor_version(backend: ExtractionBackend, compact: bool = False) -> str:
+    """Identifies the extraction output, e.g. ``pypdf2-3.0.1-r2-compact2``; part of the cache key"""
+    version = f"{backend.name}-{backend.version()}-r{EXTRACTOR_REVISION}"
+    return f"{version}-compact{COMPACTION_REVISION}" if compact else version
+
+
+def _outline_key(content_hash: str) -> str:
+    """Cache key of a document's bookmarks, stored beside its text"""
+    return f"{content_hash}.outline"
+
+
+def _failure_error(result: SandboxResult) -> PDFExtractionError:
+    error_class = ExtractionTimeoutError if result.failure == "timeout" else PDFExtractionError
+    return error_class(result.error, kind=result.failure, partial_text=result.text,
+                       pages_done=len(result.pages), page_count=result.page_count)
+
+
+class ExtractionExecutor:
+    """One per service process; see the module docstring"""
+
+    def __init__(self, backend: ExtractionBackend, workers: int = 2, queue_limit: int = 16,
+                 limits: Optional[ExtractionLimits] = None, cache: Optional[ExtractionCache] = None,
+                 probe_pages: int = 5, compact: bool = True):
+        self.backend = backend
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.limits = limits or ExtractionLimits()
+        self.cache = cache
+        self.probe_pages = probe_pages
+        self.compact = compact
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._job_ids = itertools.count(1)
+        self._jobs: Dict[int, Dict] = {}
+        self._waits = deque(maxlen=100)
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "completed": 0, "partial": 0, "failed": 0, "rejected": 0}
+        self.failures = {kind: 0 for kind in FAILURE_KINDS}
+        self.probed = 0
+        self.compaction = {"documents": 0, "tokens_before": 0, "tokens_after": 0, "boilerplate_lines": 0}
+
+    @property
+    def version(self) -> str:
+        """Extractor version of this executor's output (see ``extractor_version``)"""
+        return extractor_version(self.backend, self.compact)
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        return self._slots
+
+    @property
+    def depth(self) -> int:
+        """Jobs queued or running"""
+        return len(self._jobs)
+
+    def check_capacity(self) -> None:
+        if self.depth >= self.queue_limit:
+            self.stats["rejected"] += 1
+            raise ExtractionQueueFullError("Too many PDFs are being processed, please retry shortly")
+
+    async def extract(self, source: PDFSource, on_progress: Optional[ProgressCallback] = None,
+                      timeout: Optional[float] = None, content_hash: Optional[str] = None,
+                      max_chars: Optional[int] = None, allow_partial: bool = False,
+                      on_compaction: Optional[CompactionCallback] = None,
+                      on_outline: Optional[OutlineCallback] = None) -> str:
+        """
+        Extract the text of a PDF (bytes or a file path) in a sandboxed child.
+        ``on_progress(pages_done, page_count)`` is called from a background
+        thread after each page. ``content_hash`` (SHA-256 of the PDF bytes)
+        enables the extraction cache. With ``max_chars``, extraction stops
+        after the page that reaches it; such partial text is not cached.
+        ``on_compaction`` receives the compaction result of a parsed (not
+        cached) document. ``on_outline`` receives the document's bookmarks,
+        from the cache on a cache hit.
+
+        Raises ``PDFExtractionError`` (``ExtractionTimeoutError`` for time
+        limits) when extraction fails, unless ``allow_partial`` is set and
+        some pages were extracted, in which case their text is returned.
+        """
+        if self.cache is not None and content_hash:
+            text = await asyncio.to_thread(self.cache.get, content_hash)
+            if text is not None:
+                if on_outline:
+                    on_outline(await asyncio.to_thread(self._cached_outline, content_hash))
+                return text
+
+        result = await self._run(source, on_progress, timeout, max_chars)
+        if on_outline:
+            on_outline(result.outline)
+        if result.probed:
+            self.probed += 1
+        if result.compaction is not None:
+            self._record_compaction(result.compaction)
+            if on_compaction:
+                on_compaction(result.compaction)
+        if result.failure:
+            self.stats["failed"] += 1
+            self.failures[result.failure] += 1
+            if allow_partial and result.text:
+                self.stats["partial"] += 1
+                return result.text
+            raise _failure_error(result)
+
+        self.stats["completed"] += 1
+        if not result.complete:
+            self.stats["partial"] += 1
+        elif self.cache is not None and content_hash:
+            await asyncio.to_thread(self.cache.put, content_hash, result.text)
+            outline = json.dumps([entry.to_dict() for entry in result.outline])
+            await asyncio.to_thread(self.cache.put, _outline_key(content_hash), outline)
+        return result.text
+
+    def _cached_outline(self, content_hash: str) -> List[OutlineEntry]:
+        data = self.cache.get(_outline_key(content_hash))
+        if data is None:
+            return []
+        try:
+            return [OutlineEntry.from_dict(entry) for entry in json.loads(data)]
+        except (ValueError, TypeError):
+            return []
+
+    async def _run(self, source: PDFSource, on_progress: Optional[ProgressCallback],
+                   timeout: Optional[float], max_chars: Optional[int]) -> SandboxResult:
+        self.check_capacity()
+        job_id = next(self._job_ids)
+        job = {"submitted_at": time.monotonic(), "started_at": None}
+        with self._lock:
+            self._jobs[job_id] = job
+        self.stats["submitted"] += 1
+        try:
+            async with self._semaphore():
+                job["started_at"] = time.monotonic()
+                self._waits.append(job["started_at"] - job["submitted_at"])
+                # The thread only babysits the child process; limits are enforced there
+                return await asyncio.to_thread(
+                    run_sandboxed, self.backend.name, source, with_timeout(self.limits, timeout),
+                    max_chars, on_progress, self.probe_pages, self.compact, True
+                )
+        finally:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+
+    def _record_compaction(self, compaction: CompactionResult) -> None:
+        self.compaction["documents"] += 1
+        self.compaction["tokens_before"] += compaction.tokens_before
+        self.compaction["tokens_after"] += compaction.tokens_after
+        self.compaction["boilerplate_lines"] += compaction.boilerplate_lines
+        logger.info("Compaction saved %d of %d tokens (%d header/footer lines)",
+                    compaction.tokens_saved, compaction.tokens_before, compaction.boilerplate_lines)
+
+    def shutdown(self) -> None:
+        """Nothing is pooled; running children are killed by their own wall-clock limit"""
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job["started_at"] is not None)
+            queued = len(self._jobs) - running
+            waits = list(self._waits)
+        return {
+            "backend": self.backend.name,
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "limits": {
+                "wall_seconds": self.limits.wall_seconds,
+                "cpu_seconds": self.limits.cpu_seconds,
+                "memory_mb": self.limits.memory_mb,
+            },
+            "queued": queued,
+            "running": running,
+            "wait_ms_avg": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+            "wait_ms_max": round(1000 * max(waits), 1) if waits else 0.0,
+            **self.stats,
+            "failures": dict(self.failures),
+            "probe": {
+                "pages": self.probe_pages,
+                "probed": self.probed,
+                "rejected": self.failures["image_only"],
+                "reject_rate": round(self.failures["image_only"] / self.probed, 4) if self.probed else 0.0,
+            },
+            "compaction": self._compaction_snapshot(),
+            "cache": self.cache.snapshot() if self.cache is not None else None,
+        }
+
+    def _compaction_snapshot(self) -> Dict:
+        before, after = self.compaction["tokens_before"], self.compaction["tokens_after"]
+        return {
+            "enabled": self.compact,
+            **self.compaction,
+            "tokens_saved": before - after,
+            "saved_ratio": round((before - after) / before, 4) if before else 0.0,
+        }
+
+
+def executor_from_env(queue_limit: Optional[int] = None) -> ExtractionExecutor:
+    """
+    Create an executor (with its backend, limits and extraction cache)
+    configured from EXTRACT_* env vars; ``queue_limit`` overrides
+    EXTRACT_QUEUE_LIMIT for services with their own backlog limit.
+    """
+    backend = backend_from_env()
+    compact = compact_from_env()
+    return ExtractionExecutor(
+        backend,
+        workers=int(os.getenv("EXTRACT_WORKERS", "2")),
+        queue_limit=queue_limit or int(os.getenv("EXTRACT_QUEUE_LIMIT", "16")),
+        limits=limits_from_env(),
+        cache=extraction_cache_from_env(extractor_version(backend, compact)),
+        probe_pages=probe_pages_from_env(),
+        compact=compact,
+    )
@@ -0,0 +1,153 @@
+"""
+Benchmark the installed PDF extraction backends on a local corpus.
+
+    python -m ai_common.extraction_benchmark course-pdfs/ [more.pdf ...]
+        [--backends pypdf2,pypdfium2] [--repeat 3] [--reference pypdf2] [--json]
+
+Run from the repository root. Each backend runs in a fresh child process so
+its peak memory (max RSS) is measured on its own. For every backend the report
+shows pages per second, MB per second, peak memory and parity: how closely its
+words match the reference backend's output (1.0 = same words). The last line
+recommends the fastest backend whose parity is at least ``--min-parity``,
+to be set as ``EXTRACT_BACKEND``.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import re
+import resource
+import sys
+import time
+from collections import Counter
+from typing import Dict, List
+
+from ai_common.pdf_backends import BACKENDS, available_backends, get_backend
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def find_pdfs(paths: List[str]) -> List[str]:
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                pdfs.extend(os.path.join(dirpath, name) for name in sorted(filenames) if name.lower().endswith(".pdf"))
+        elif path.lower().endswith(".pdf"):
+            pdfs.append(path)
+    return pdfs
+
+
+def parity(text: str, reference: str) -> float:
+    """Share of words (with multiplicity) the two texts have in common"""
+    words, reference_words = Counter(_WORD_RE.findall(text.lower())), Counter(_WORD_RE.findall(reference.lower()))
+    total = max(sum(words.values()), sum(reference_words.values()))
+    if total == 0:
+        return 1.0
+    return sum((words & reference_words).values()) / total
+
+
+def _run_backend(name: str, pdfs: List[str], repeat: int, results) -> None:
+    """Child process: extract every PDF ``repeat`` times and report timings and texts"""
+    backend = get_backend(name)
+    texts: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    pages = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for path in pdfs:
+            try:
+                with backend.open(path) as (page_count, page_texts):
+                    texts[path] = "\n".join(page_texts)
+                pages += page_count
+            except Exception as e:
+                errors[path] = str(e)
+    seconds = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put({"backend": name, "version": backend.version(), "seconds": seconds, "pages": pages,
+                 "peak_rss_mb": peak_rss_mb, "texts": texts, "errors": errors})
+
+
+def benchmark(pdfs: List[str], backends: List[str], repeat: int = 1, reference: str = "pypdf2") -> List[Dict]:
+    context = multiprocessing.get_context("spawn")
+    corpus_mb = sum(os.path.getsize(path) for path in pdfs) / (1024 * 1024)
+    runs = []
+    for name in backends:
+        results = context.Queue()
+        process = context.Process(target=_run_backend, args=(name, pdfs, repeat, results))
+        process.start()
+        while True:
+            try:
+                runs.append(results.get(timeout=1))
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError(f"Backend {name} crashed (exit code {process.exitcode})")
+        process.join()
+
+    reference_run = next((run for run in runs if run["backend"] == reference), runs[0])
+    report = []
+    for run in runs:
+        shared = [path for path in run["texts"] if path in reference_run["texts"]]
+        scores = [parity(run["texts"][path], reference_run["texts"][path]) for path in shared]
+        report.append({
+            "backend": run["backend"],
+            "version": run["version"],
+            "pages_per_second": round(run["pages"] / run["seconds"], 1) if run["seconds"] else 0.0,
+            "mb_per_second": round(corpus_mb * repeat / run["seconds"], 2) if run["seconds"] else 0.0,
+            "peak_rss_mb": round(run["peak_rss_mb"], 1),
+            "parity": round(sum(scores) / len(scores), 3) if scores else None,
+            "errors": len(run["errors"]),
+        })
+    return report
+
+
+def recommend(report: List[Dict], min_parity: float) -> Dict:
+    candidates = [row for row in report if row["errors"] == 0 and (row["parity"] or 0) >= min_parity]
+    return max(candidates or report, key=lambda row: row["pages_per_second"])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare PDF extraction backends on local PDFs")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories of PDFs")
+    parser.add_argument("--backends", default=",".join(available_backends()),
+                        help=f"Comma-separated backends (known: {', '.join(BACKENDS)}; default: all installed)")
+    parser.add_argument("--reference", default="pypdf2", help="Backend whose output parity is measured against")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the corpus per backend")
+    parser.add_argument("--min-parity", type=float, default=0.9, help="Lowest parity a recommended backend may have")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    pdfs = find_pdfs(args.paths)
+    if not pdfs:
+        print("No PDF files found", file=sys.stderr)
+        return 1
+    backends = [name.strip().lower() for name in args.backends.split(",") if name.strip()]
+    for name in backends:
+        try:
+            get_backend(name)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+
+    report = benchmark(pdfs, backends, repeat=args.repeat, reference=args.reference)
+    best = recommend(report, args.min_parity)
+    if args.json:
+        print(json.dumps({"pdfs": len(pdfs), "report": report, "recommended": best["backend"]}, indent=2))
+        return 0
+
+    print(f"{len(pdfs)} PDFs, {args.repeat} pass(es), parity against {args.reference}")
+    print(f"{'backend':<10} {'version':<10} {'pages/s':>9} {'MB/s':>7} {'peak MB':>8} {'parity':>7} {'errors':>6}")
+    for row in report:
+        parity_text = "-" if row["parity"] is None else f"{row['parity']:.3f}"
+        print(f"{row['backend']:<10} {row['version']:<10} {row['pages_per_second']:>9} "
+              f"{row['mb_per_second']:>7} {row['peak_rss_mb']:>8} {parity_text:>7} {row['errors']:>6}")
+    print(f"Recommended: EXTRACT_BACKEND={best['backend']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
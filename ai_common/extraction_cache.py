@@ -0,0 +1,166 @@
+"""
+Content-addressed disk cache of extracted PDF text.
+
+The same course PDF is typically uploaded to rag-server, question-generator
+and lecture-planner in turn. ``ExtractionCache`` stores extracted text on disk
+under the SHA-256 of the PDF bytes and the extractor version, in a directory
+the services share, so a document parsed by any of them comes back from the
+others without parsing it again.
+
+- entries live under ``<dir>/<extractor version>/<hash[:2]>/<hash>.txt.z``
+  (compressed, see ``ai_common.text_store``) or ``<hash>.txt`` when
+  TEXT_COMPRESSION is off, so a new extractor version never serves text
+  produced by an older one; either form is read back whatever the setting;
+- writes go to a temporary file in the same directory and are moved into
+  place with ``os.replace``, so readers in other processes never see a
+  partial entry;
+- reads bump the entry's modification time and the cache is trimmed, oldest
+  first, once it grows past its size limit.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from typing import Dict, List, Optional
+
+from ai_common.text_store import compress_text, decompress_text, text_codec_from_env
+
+logger = logging.getLogger(__name__)
+
+# Fraction of the size limit the cache is trimmed down to when it overflows
+TRIM_TARGET = 0.9
+
+
+class ExtractionCache:
+    """Disk cache of extracted text keyed by (content hash, extractor version)"""
+
+    def __init__(self, directory: str, version: str, max_bytes: int = 1024 * 1024 * 1024,
+                 codec: Optional[str] = None):
+        self.directory = directory
+        self.version = version
+        self.max_bytes = max_bytes
+        self.codec = codec
+        self.root = os.path.join(directory, version)
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0,
+                      "text_bytes_written": 0, "bytes_written": 0}
+
+    def _paths(self, content_hash: str) -> List[str]:
+        """Where an entry may be, the form this cache writes first"""
+        base = os.path.join(self.root, content_hash[:2], f"{content_hash}.txt")
+        return [base + ".z", base] if self.codec else [base, base + ".z"]
+
+    def get(self, content_hash: str) -> Optional[str]:
+        for path in self._paths(content_hash):
+            try:
+                with open(path, "rb") as file:
+                    data = file.read()
+                text = decompress_text(data) if path.endswith(".z") else data.decode("utf-8")
+                # Modification time doubles as last-access time for LRU eviction
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, zlib.error) as e:
+                logger.warning("Extraction cache read failed for %s: %s", content_hash, e)
+                self.stats["errors"] += 1
+                return None
+            self.stats["hits"] += 1
+            return text
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, content_hash: str, text: str) -> None:
+        path = self._paths(content_hash)[0]
+        data = compress_text(text, self.codec) if self.codec else text.encode("utf-8")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning("Extraction cache write failed for %s: %s", content_hash, e)
+            self.stats["errors"] += 1
+            return
+        self.stats["writes"] += 1
+        self.stats["text_bytes_written"] += len(text.encode("utf-8"))
+        self.stats["bytes_written"] += len(data)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += size
+            overflowing = self._size > self.max_bytes
+        if overflowing:
+            self.trim()
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    continue
+                yield os.path.join(dirpath, filename), stat.st_size, stat.st_mtime
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def trim(self) -> None:
+        """
+        Delete least recently used entries until the cache is under
+        ``TRIM_TARGET`` of its limit. Rescans the directory, since other
+        services write to it too.
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * TRIM_TARGET
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.stats["evictions"] += 1
+            self._size = total
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            size = self._size
+        written = self.stats["bytes_written"]
+        return {
+            "directory": self.directory,
+            "version": self.version,
+            "codec": self.codec,
+            "max_bytes": self.max_bytes,
+            "size_bytes": size,
+            "compression_ratio": round(self.stats["text_bytes_written"] / written, 2) if written else None,
+            **self.stats,
+        }
+
+
+def extraction_cache_from_env(version: str) -> Optional[ExtractionCache]:
+    """
+    Build a cache from EXTRACT_CACHE_* env vars, or None when
+    EXTRACT_CACHE_DIR is ``off``. Entries are compressed with the
+    TEXT_COMPRESSION codec.
+    """
+    directory = os.getenv("EXTRACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "classmate-extraction-cache"))
+    if directory.lower() == "off":
+        return None
+    max_bytes = int(float(os.getenv("EXTRACT_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+    return ExtractionCache(directory, version, max_bytes, codec=text_codec_from_env())
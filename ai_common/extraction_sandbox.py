@@ -0,0 +1,324 @@
+"""
+Isolated, resource-limited PDF extraction.
+
+A malformed or adversarial PDF can make a parser spin or allocate without
+bound. ``run_sandboxed`` parses one document in its own child process:
+
+- the child sets rlimits on its address space (``EXTRACT_MEMORY_MB``) and CPU
+  time (``EXTRACT_CPU_SECONDS``) before touching the PDF, and the parent kills
+  it once the wall-clock limit (``EXTRACT_TIMEOUT``) passes;
+- page texts are sent back one page at a time, so everything extracted before
+  a failure is kept as a partial result; the text is handed back with pages
+  joined by ``PAGE_BREAK`` (see ``ai_common.page_index``);
+- with ``probe_pages``, a few pages are first checked for a text layer (see
+  ``ai_common.text_probe``) and image-only documents are rejected before the
+  full parse;
+- with ``compact``, the child compacts the collected pages (see
+  ``ai_common.compaction``) before handing the text back;
+- with ``outline``, the child also reads the PDF's bookmarks (see
+  ``ai_common.pdf_outline``);
+- failures are classified as ``timeout``, ``oom``, ``encrypted``,
+  ``malformed``, ``image_only`` or ``crashed``.
+
+Children are started as ``python -m ai_common.extraction_sandbox``, a minimal
+entry point: multiprocessing's fork server and spawn both re-import the
+service's ``__main__`` in every child, which cost a second per job for a
+service started with ``python main.py``. The job goes to the child on stdin
+and its messages come back pickled on stdout. rlimits are only applied on
+platforms that have the ``resource`` module.
+"""
+
+import importlib
+import os
+import pickle
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Callable, List, Optional
+
+from ai_common.compaction import CompactionResult, compact_pages
+from ai_common.page_index import PAGE_BREAK
+from ai_common.pdf_backends import BACKENDS, PDFSource, available_backends, backend_from_env, get_backend
+from ai_common.pdf_outline import OutlineEntry, read_outline
+from ai_common.text_probe import probe_text_layer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 * 1024
+
+FAILURE_KINDS = ("timeout", "oom", "encrypted", "malformed", "image_only", "crashed")
+
+# Exit code of a child too short of memory to even report its failure
+_OOM_EXIT_CODE = 75
+
+# Directory containing the ai_common package, so children can import it
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class ExtractionLimits:
+    wall_seconds: float = 120.0
+    cpu_seconds: Optional[int] = 60
+    memory_mb: Optional[int] = 1024
+
+
+@dataclass
+class SandboxResult:
+    pages: List[str] = field(default_factory=list)
+    page_count: Optional[int] = None
+    complete: bool = False
+    probed: bool = False
+    compaction: Optional[CompactionResult] = None
+    outline: List[OutlineEntry] = field(default_factory=list)
+    failure: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        if self.compaction is not None:
+            return self.compaction.text
+        return PAGE_BREAK.join(page.strip() for page in self.pages)
+
+
+def probe_pages_from_env() -> int:
+    """Pages sampled for a text layer before parsing (EXTRACT_PROBE_PAGES, 0 disables the probe)"""
+    return int(os.getenv("EXTRACT_PROBE_PAGES", "5"))
+
+
+def compact_from_env() -> bool:
+    """Whether extracted text is compacted (EXTRACT_COMPACT, ``on`` or ``off``)"""
+    return os.getenv("EXTRACT_COMPACT", "on").lower() not in ("off", "false", "0")
+
+
+def limits_from_env() -> ExtractionLimits:
+    """Limits from EXTRACT_TIMEOUT, EXTRACT_CPU_SECONDS and EXTRACT_MEMORY_MB (0 disables a limit)"""
+    cpu_seconds = int(os.getenv("EXTRACT_CPU_SECONDS", "60"))
+    memory_mb = int(os.getenv("EXTRACT_MEMORY_MB", "1024"))
+    return ExtractionLimits(
+        wall_seconds=float(os.getenv("EXTRACT_TIMEOUT", "120")),
+        cpu_seconds=cpu_seconds or None,
+        memory_mb=memory_mb or None,
+    )
+
+
+def with_timeout(limits: ExtractionLimits, wall_seconds: Optional[float]) -> ExtractionLimits:
+    return replace(limits, wall_seconds=wall_seconds) if wall_seconds else limits
+
+
+def classify(error: BaseException) -> str:
+    """Failure kind for an exception raised while parsing"""
+    if isinstance(error, MemoryError):
+        return "oom"
+    description = f"{type(error).__name__} {error}".lower()
+    if any(word in description for word in ("encrypt", "decrypt", "password")):
+        return "encrypted"
+    return "malformed"
+
+
+def _apply_limits(limits: ExtractionLimits) -> None:
+    if resource is None:
+        return
+    if limits.memory_mb:
+        size = limits.memory_mb * MB
+        resource.setrlimit(resource.RLIMIT_AS, (size, size))
+    if limits.cpu_seconds:
+        # SIGXCPU at the soft limit, SIGKILL one second later
+        resource.setrlimit(resource.RLIMIT_CPU, (limits.cpu_seconds, limits.cpu_seconds + 1))
+
+
+def _child(conn, backend_name: str, source: PDFSource, limits: ExtractionLimits,
+           max_chars: Optional[int], probe_pages: int, compact: bool, outline: bool) -> None:
+    """Runs in the sandboxed process: stream page texts back to the parent"""
+    try:
+        _apply_limits(limits)
+        if probe_pages:
+            probe = probe_text_layer(source, probe_pages)
+            conn.send(("probe", probe.page_count))
+            if not probe.has_text:
+                conn.send(("error", "image_only",
+                           f"PDF has no text layer on any of {len(probe.sampled)} sampled pages "
+                           "(scanned or image-only document)"))
+                return
+        pages = []
+        complete = True
+        with get_backend(backend_name).open(source) as (page_count, page_texts):
+            conn.send(("count", page_count))
+            collected = 0
+            for index, page_text in enumerate(page_texts):
+                conn.send(("page", page_text))
+                pages.append(page_text)
+                collected += len(page_text)
+                if max_chars is not None and collected >= max_chars:
+                    complete = index + 1 == page_count
+                    break
+        if outline:
+            conn.send(("outline", read_outline(source)))
+        if compact:
+            # Compacted here rather than in the service, which would hold its GIL for it
+            conn.send(("compacted", compact_pages(pages)))
+        conn.send(("done", complete))
+    except BaseException as e:
+        kind = classify(e)
+        message = "PDF needs more memory than the extraction limit allows" if kind == "oom" else str(e) or type(e).__name__
+        try:
+            conn.send(("error", kind, message))
+        except Exception:
+            if kind == "oom":
+                os._exit(_OOM_EXIT_CODE)
+    finally:
+        conn.close()
+
+
+class _StreamConnection:
+    """``send``/``close`` over a binary stream, one pickle per message"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def send(self, message) -> None:
+        pickle.dump(message, self.stream, protocol=pickle.HIGHEST_PROTOCOL)
+        self.stream.flush()
+
+    def close(self) -> None:
+        self.stream.close()
+
+
+def _serve() -> None:
+    """Entry point of a child process: run the job read from stdin"""
+    # Messages own the real stdout; stray prints from parser libraries go to stderr
+    output = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    job = pickle.load(sys.stdin.buffer)
+    # Import the parser before the rlimits apply, as the fork server used to preload it
+    importlib.import_module(BACKENDS[job[0]].module)
+    _child(_StreamConnection(output), *job)
+
+
+def _read_messages(stream, messages: queue.Queue) -> None:
+    """Parent side: queue the child's messages, then None at end of stream"""
+    try:
+        while True:
+            messages.put(pickle.load(stream))
+    except (EOFError, pickle.UnpicklingError, OSError):
+        pass
+    finally:
+        messages.put(None)
+
+
+def _start_child(job: tuple) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [_PACKAGE_ROOT, env.get("PYTHONPATH")]))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "ai_common.extraction_sandbox"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, cwd=_PACKAGE_ROOT,
+    )
+    try:
+        pickle.dump(job, process.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+        process.stdin.close()
+    except OSError:
+        # The child died before reading its job; its exit code tells why
+        pass
+    return process
+
+
+def _exit_failure(exitcode: Optional[int], limits: ExtractionLimits):
+    """Classify a child that died without reporting an error"""
+    sigxcpu = getattr(signal, "SIGXCPU", None)
+    if sigxcpu is not None and exitcode == -sigxcpu:
+        return "timeout", f"PDF extraction exceeded the CPU limit of {limits.cpu_seconds}s"
+    if exitcode in (_OOM_EXIT_CODE, -getattr(signal, "SIGKILL", 9)):
+        # Killed from outside (the kernel OOM killer) or too short of memory to report
+        return "oom", "PDF extraction ran out of memory"
+    if limits.memory_mb and resource is not None:
+        # Failed allocations under RLIMIT_AS often take native parsers down
+        # (segfault, abort) before Python sees a MemoryError
+        return "oom", f"PDF extraction died (exit code {exitcode}), most likely at the {limits.memory_mb} MB memory limit"
+    return "crashed", f"PDF extraction process exited unexpectedly (exit code {exitcode})"
+
+
+def run_sandboxed(backend_name: str, source: PDFSource, limits: ExtractionLimits,
+                  max_chars: Optional[int] = None,
+                  on_progress: Optional[Callable[[int, int], None]] = None,
+                  probe_pages: int = 0, compact: bool = False, outline: bool = False) -> SandboxResult:
+    """
+    Extract a PDF in a fresh resource-limited child process. Blocks until the
+    child finishes, fails or is killed at the wall-clock limit; never raises
+    for problems with the PDF itself, see ``SandboxResult.failure``. With
+    ``probe_pages``, image-only PDFs fail with ``image_only`` after sampling
+    that many pages instead of being parsed. With ``compact``, the text
+    (including partial text) is compacted. With ``outline``, the PDF's
+    bookmarks are read too.
+    """
+    result = SandboxResult()
+    deadline = time.monotonic() + limits.wall_seconds
+    process = _start_child((backend_name, source, limits, max_chars, probe_pages, compact, outline))
+    messages: queue.Queue = queue.Queue()
+    reader = threading.Thread(target=_read_messages, args=(process.stdout, messages), daemon=True)
+    reader.start()
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise queue.Empty
+                message = messages.get(timeout=remaining)
+            except queue.Empty:
+                result.failure = "timeout"
+                result.error = f"PDF extraction did not finish within {limits.wall_seconds:g}s"
+                break
+            if message is None:
+                try:
+                    process.wait(1)
+                except subprocess.TimeoutExpired:
+                    pass
+                result.failure, result.error = _exit_failure(process.returncode, limits)
+                break
+            kind = message[0]
+            if kind == "probe":
+                result.probed = True
+                result.page_count = message[1]
+            elif kind == "count":
+                result.page_count = message[1]
+            elif kind == "page":
+                result.pages.append(message[1])
+                if on_progress:
+                    on_progress(len(result.pages), result.page_count)
+            elif kind == "outline":
+                result.outline = message[1]
+            elif kind == "compacted":
+                result.compaction = message[1]
+            elif kind == "done":
+                result.complete = message[1]
+                break
+            else:
+                result.failure, result.error = message[1], message[2]
+                break
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        reader.join()
+        process.stdout.close()
+    if compact and result.compaction is None and result.pages:
+        # The child failed before compacting: compact the partial text here
+        result.compaction = compact_pages(result.pages)
+    return result
+
+
+def extract_text_sandboxed(path: str, limits: Optional[ExtractionLimits] = None,
+                           backend_name: Optional[str] = None) -> SandboxResult:
+    """Synchronous helper for scripts: extract one PDF file with limits from the environment"""
+    name = backend_name or backend_from_env().name
+    return run_sandboxed(name, path, limits or limits_from_env(), probe_pages=probe_pages_from_env(),
+                         compact=compact_from_env())
+
+
+if __name__ == "__main__":
+    _serve()
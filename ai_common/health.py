@@ -0,0 +1,219 @@
+"""
+Cached upstream health monitoring with a circuit breaker.
+
+A background task probes the upstream (Gemini) on its own schedule so that
+``/health`` can answer instantly from cached state instead of sending a real
+generation request on every call. The same circuit breaker guards generation
+calls: after repeated failures it opens and callers fail fast until the
+reset timeout passes or a background probe succeeds.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+
+
+class CircuitBreaker:
+    """Thread-safe closed / open / half-open circuit breaker"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self) -> None:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+
+    def _admit(self) -> Optional[bool]:
+        """None when rejected, otherwise whether the call is the half-open trial"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return False
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return None
+
+    def allow(self) -> bool:
+        """Return True if a call may go through; half-open admits one trial call"""
+        return self._admit() is not None
+
+    def check(self) -> bool:
+        """
+        Raise CircuitOpenError instead of returning False; returns True when
+        the call is the half-open trial, which must end in ``record_success``,
+        ``record_failure`` or ``release_trial``
+        """
+        trial = self._admit()
+        if trial is None:
+            raise CircuitOpenError(self.name, self.retry_after())
+        return trial
+
+    def release_trial(self) -> None:
+        """Give up a half-open trial without a verdict, e.g. when it was cancelled"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            self._maybe_half_open()
+            return {"state": self._state, "consecutive_failures": self._failures}
+
+
+class UpstreamHealthMonitor:
+    """
+    Periodically runs a cheap probe against an upstream and caches the result.
+
+    ``probe`` is a blocking callable that raises on failure; it runs in a
+    worker thread so it never blocks the event loop.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        probe: Callable[[], object],
+        interval: float = 60.0,
+        timeout: float = 10.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.probe = probe
+        self.interval = interval
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker(name)
+        self._status = "unknown"
+        self._last_checked: Optional[datetime] = None
+        self._latency_ms: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def healthy(self) -> bool:
+        return self._status == "healthy" and self.breaker.state != CircuitBreaker.OPEN
+
+    async def refresh(self) -> None:
+        """Run the probe once and update the cached state"""
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.to_thread(self.probe), timeout=self.timeout)
+        except Exception as e:
+            self._status = "unhealthy"
+            self._last_error = "probe timed out" if isinstance(e, asyncio.TimeoutError) else str(e)
+            self.breaker.record_failure()
+        else:
+            self._status = "healthy"
+            self._last_error = None
+            self.breaker.record_success()
+        self._latency_ms = round((time.monotonic() - started) * 1000, 1)
+        self._last_checked = datetime.now()
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Start the background probe loop on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict:
+        """Cached status suitable for returning from a /health endpoint"""
+        breaker = self.breaker.snapshot()
+        return {
+            "status": "unhealthy" if breaker["state"] == CircuitBreaker.OPEN else self._status,
+            "circuit": breaker["state"],
+            "consecutive_failures": breaker["consecutive_failures"],
+            "last_checked": self._last_checked.isoformat() if self._last_checked else None,
+            "probe_latency_ms": self._latency_ms,
+            "error": self._last_error,
+        }
+
+
+def gemini_probe(model_name: str) -> Callable[[], object]:
+    """
+    Build a probe that fetches model metadata instead of generating content,
+    so health checks do not consume generation quota.
+    """
+    import google.generativeai as genai
+
+    def probe():
+        return genai.get_model(f"models/{model_name}")
+
+    return probe
+
+
+def monitor_from_env(name: str, model_name: str) -> UpstreamHealthMonitor:
+    """Create a Gemini monitor configured from HEALTH_PROBE_* / CIRCUIT_* env vars"""
+    breaker = CircuitBreaker(
+        name,
+        failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30")),
+    )
+    return UpstreamHealthMonitor(
+        name,
+        gemini_probe(model_name),
+        interval=float(os.getenv("HEALTH_PROBE_INTERVAL", "60")),
+        timeout=float(os.getenv("HEALTH_PROBE_TIMEOUT", "10")),
+        breaker=breaker,
+    )
@@ -0,0 +1,116 @@
+"""
+Hedged requests: race a duplicate call against a slow one.
+
+Gemini latency has a long tail: most calls return in a couple of seconds, but
+a few take ten times as long for reasons unrelated to the prompt. A call
+still running past the ``percentile`` of recently observed latency on its
+endpoint is likely stuck in that tail, and a duplicate sent at that point
+usually returns first. ``LLMGateway`` then takes whichever response arrives
+first and cancels the other call.
+
+Hedges are extra upstream load, so ``HedgePolicy`` limits them per endpoint
+with a token budget: every call earns ``budget`` tokens (0.1 allows one hedge
+per ten calls), up to ``HEDGE_BURST``, and a hedge spends one. No hedges are
+sent until an endpoint has ``min_samples`` latencies to estimate the
+percentile from.
+"""
+
+import math
+import os
+from collections import deque
+from typing import Deque, Dict, Optional
+
+# Latencies kept per endpoint to estimate the percentile from
+LATENCY_WINDOW = 200
+# Most unused hedge tokens an endpoint can save up
+HEDGE_BURST = 5.0
+
+
+class _EndpointState:
+    def __init__(self):
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.tokens = 0.0
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "over_budget": 0}
+
+
+class HedgePolicy:
+    """When to hedge, per endpoint; see the module docstring"""
+
+    def __init__(self, percentile: float = 95.0, min_samples: int = 20, budget: float = 0.1):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget = budget
+        self._endpoints: Dict[str, _EndpointState] = {}
+
+    def _state(self, endpoint: str) -> _EndpointState:
+        if endpoint not in self._endpoints:
+            self._endpoints[endpoint] = _EndpointState()
+        return self._endpoints[endpoint]
+
+    def _quantile(self, state: _EndpointState) -> Optional[float]:
+        if len(state.latencies) < max(1, self.min_samples):
+            return None
+        ordered = sorted(state.latencies)
+        rank = math.ceil(self.percentile / 100 * len(ordered)) - 1
+        return ordered[min(len(ordered) - 1, max(0, rank))]
+
+    def delay(self, endpoint: str) -> Optional[float]:
+        """
+        Seconds a call on ``endpoint`` may run before it is hedged, or None
+        while too few latencies are known; counts the call towards the budget
+        """
+        state = self._state(endpoint)
+        state.stats["calls"] += 1
+        state.tokens = min(HEDGE_BURST, state.tokens + self.budget)
+        return self._quantile(state)
+
+    def allow(self, endpoint: str) -> bool:
+        """Spend a hedge token for ``endpoint``, if one is left"""
+        state = self._state(endpoint)
+        if state.tokens < 1.0:
+            state.stats["over_budget"] += 1
+            return False
+        state.tokens -= 1.0
+        state.stats["hedged"] += 1
+        return True
+
+    def record(self, endpoint: str, seconds: float, hedge_won: bool = False) -> None:
+        """Latency of a successful call, measured from when it was first sent"""
+        state = self._state(endpoint)
+        state.latencies.append(seconds)
+        if hedge_won:
+            state.stats["hedge_wins"] += 1
+
+    def snapshot(self) -> Dict:
+        endpoints = {}
+        for endpoint, state in self._endpoints.items():
+            delay = self._quantile(state)
+            ordered = sorted(state.latencies)
+            endpoints[endpoint] = {
+                "samples": len(ordered),
+                "p50_ms": round(1000 * ordered[len(ordered) // 2], 1) if ordered else None,
+                "hedge_after_ms": round(1000 * delay, 1) if delay is not None else None,
+                "tokens": round(state.tokens, 2),
+                **state.stats,
+            }
+        return {
+            "percentile": self.percentile,
+            "min_samples": self.min_samples,
+            "budget": self.budget,
+            "endpoints": endpoints,
+        }
+
+
+def hedge_policy_from_env() -> Optional[HedgePolicy]:
+    """
+    A policy from LLM_HEDGING (``on`` or ``off``, default off),
+    LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES and LLM_HEDGE_BUDGET; None
+    when hedging is off
+    """
+    if os.getenv("LLM_HEDGING", "off").lower() not in ("on", "true", "1"):
+        return None
+    return HedgePolicy(
+        percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+        min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")),
+        budget=float(os.getenv("LLM_HEDGE_BUDGET", "0.1")),
+    )
@@ -0,0 +1,330 @@
+"""
+Shared async gateway for Gemini generation calls.
+
+Every service routes its generation requests through one ``LLMGateway`` per
+process, which provides:
+
+- reused ``GenerativeModel`` clients (one per model name, built once);
+- native async calls (``generate_content_async``) so a slow generation never
+  blocks the event loop;
+- a per-process concurrency semaphore;
+- per-attempt timeouts and jittered exponential backoff on 429 / 5xx;
+- deadline propagation: retries and timeouts never run past the caller's deadline;
+- the circuit breaker from ``ai_common.health`` and single-flight coalescing
+  from ``ai_common.singleflight``;
+- optional hedging from ``ai_common.hedging``: an attempt still running past
+  a percentile of its endpoint's recent latency is raced against a duplicate,
+  and the slower of the two is cancelled;
+- optional model routing from ``ai_common.model_router``: calls that do not
+  name a model get one chosen from the prompt size, endpoint and recent
+  latency, and retries after an overload go to a fallback model.
+"""
+
+import asyncio
+import math
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+from ai_common.health import CircuitBreaker
+from ai_common.hedging import HedgePolicy, hedge_policy_from_env
+from ai_common.model_router import ModelRouter, router_from_env
+from ai_common.singleflight import SingleFlight
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Responses after which a routed call's retries switch to the fallback model
+OVERLOAD_STATUS_CODES = {429, 503}
+# Shortest X-Request-Timeout honoured, in seconds
+MIN_REQUEST_TIMEOUT = 1.0
+
+
+class LLMTimeoutError(Exception):
+    """Raised when a generation call runs past its timeout or the caller's deadline"""
+
+
+class LLMQueueTimeoutError(LLMTimeoutError):
+    """Raised when no concurrency slot frees up in time; a local overload, not an upstream failure"""
+
+
+class LLMDeadlineError(LLMTimeoutError):
+    """Raised when the caller's deadline runs out; says nothing about the upstream"""
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """HTTP status of a google.api_core error, if any"""
+    code = getattr(error, "code", None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (LLMQueueTimeoutError, LLMDeadlineError)):
+        return False
+    return isinstance(error, (asyncio.TimeoutError, LLMTimeoutError)) or _status_code(error) in RETRYABLE_STATUS_CODES
+
+
+def deadline_after(seconds: Optional[float]) -> Optional[float]:
+    """Absolute deadline (``time.monotonic()`` based) ``seconds`` from now"""
+    return time.monotonic() + seconds if seconds else None
+
+
+def request_deadline(timeout_header: Optional[str], default: Optional[float] = None) -> Optional[float]:
+    """
+    Deadline for a request: the caller's ``X-Request-Timeout`` (seconds) when
+    given, at least ``MIN_REQUEST_TIMEOUT`` and capped by ``default``
+    (``LLM_REQUEST_DEADLINE``). Raises ``400`` for a header that is not a
+    positive number.
+    """
+    if default is None:
+        default = float(os.getenv("LLM_REQUEST_DEADLINE", "120"))
+    seconds = default
+    if timeout_header:
+        try:
+            seconds = float(timeout_header)
+        except ValueError:
+            seconds = math.nan
+        if not seconds > 0 or math.isinf(seconds):
+            raise HTTPException(status_code=400, detail="X-Request-Timeout must be a positive number of seconds")
+        seconds = max(seconds, MIN_REQUEST_TIMEOUT)
+    return deadline_after(min(seconds, default) if default else seconds)
+
+
+class LLMGateway:
+    """One per process; see the module docstring for what every call goes through"""
+
+    def __init__(
+        self,
+        default_model: str,
+        max_concurrency: int = 8,
+        timeout: float = 60.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        breaker: Optional[CircuitBreaker] = None,
+        flights: Optional[SingleFlight] = None,
+        hedging: Optional[HedgePolicy] = None,
+        router: Optional[ModelRouter] = None,
+    ):
+        self.default_model = default_model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+        self.flights = flights or SingleFlight()
+        self.hedging = hedging
+        self.router = router
+        self._models: Dict[str, Any] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._active = 0
+        self._waiting = 0
+        self.stats = {"calls": 0, "attempts": 0, "retries": 0, "timeouts": 0, "failures": 0}
+
+    def model(self, model_name: Optional[str] = None):
+        """Reused GenerativeModel client for ``model_name``"""
+        import google.generativeai as genai
+
+        name = model_name or self.default_model
+        if name not in self._models:
+            self._models[name] = genai.GenerativeModel(name)
+        return self._models[name]
+
+    def _slots(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def generate(
+        self,
+        prompt: str,
+        *,
+        endpoint: str,
+        model_name: Optional[str] = None,
+        deadline: Optional[float] = None,
+        coalesce: bool = True,
+    ) -> str:
+        """
+        Generate text for ``prompt`` and return ``response.text``. Without
+        ``model_name``, the router (when enabled) picks the model.
+        """
+        router = self.router if model_name is None else None
+        model_name = router.choose(endpoint, prompt) if router is not None else model_name or self.default_model
+        current = [model_name]
+
+        async def attempt(timeout: float) -> str:
+            name = current[0]
+            started = time.monotonic()
+            try:
+                response = await self.model(name).generate_content_async(prompt, request_options={"timeout": timeout})
+            except Exception as error:
+                if router is not None and _status_code(error) in OVERLOAD_STATUS_CODES:
+                    # Later attempts (retries and hedges) go to the fallback model
+                    current[0] = router.fallback_for(name) or name
+                raise
+            if router is not None:
+                router.record(name, time.monotonic() - started)
+            return response.text
+
+        return await self.run(attempt, endpoint=endpoint, key_parts=(model_name, prompt),
+                              deadline=deadline, coalesce=coalesce)
+
+    async def run(
+        self,
+        attempt: Callable[[float], Awaitable[Any]],
+        *,
+        endpoint: str,
+        key_parts: tuple,
+        deadline: Optional[float] = None,
+        coalesce: bool = True,
+    ) -> Any:
+        """
+        Run ``attempt(timeout)`` with the gateway's breaker, coalescing,
+        concurrency limit, timeouts and retries. ``key_parts`` identify the
+        request for coalescing, e.g. (model, prompt).
+        """
+        trial = self.breaker.check() if self.breaker is not None else False
+        call = lambda: self._call_with_retries(attempt, deadline, endpoint)
+        try:
+            if not coalesce:
+                return await call()
+            return await self.flights.do(SingleFlight.key(endpoint, *key_parts), call)
+        finally:
+            # A half-open trial that timed out in the queue or was cancelled
+            # proved nothing either way; let the next call try instead
+            if trial:
+                self.breaker.release_trial()
+
+    def _remaining(self, deadline: Optional[float]) -> float:
+        if deadline is None:
+            return self.timeout
+        return min(self.timeout, deadline - time.monotonic())
+
+    async def _call_with_retries(self, attempt: Callable[[float], Awaitable[Any]], deadline: Optional[float],
+                                 endpoint: str) -> Any:
+        self.stats["calls"] += 1
+        for retry in range(self.max_retries + 1):
+            try:
+                if self.hedging is not None:
+                    result = await self._hedged_attempt(attempt, deadline, endpoint)
+                else:
+                    result = await self._attempt_once(attempt, deadline)
+            except Exception as error:
+                last_try = retry == self.max_retries
+                if not is_retryable(error) or last_try:
+                    self._record_failure(error)
+                    raise
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+                if self._remaining(deadline) <= delay:
+                    self._record_failure(error)
+                    raise
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+            else:
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                return result
+
+    async def _attempt_once(self, attempt: Callable[[float], Awaitable[Any]], deadline: Optional[float]) -> Any:
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._slots().acquire(), timeout=max(0.0, self._remaining(deadline)))
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise LLMQueueTimeoutError("Timed out waiting for a free Gemini slot")
+        finally:
+            self._waiting -= 1
+
+        self._active += 1
+        self.stats["attempts"] += 1
+        try:
+            timeout = self._remaining(deadline)
+            if timeout <= 0:
+                raise LLMDeadlineError("Request deadline exceeded")
+            try:
+                return await asyncio.wait_for(attempt(timeout), timeout=timeout)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                if timeout < self.timeout:
+                    # Cut short by the caller's deadline, not a full upstream timeout
+                    raise LLMDeadlineError("Request deadline exceeded")
+                raise LLMTimeoutError(f"Gemini did not respond within {timeout:.1f}s")
+        finally:
+            self._active -= 1
+            self._slots().release()
+
+    async def _hedged_attempt(self, attempt: Callable[[float], Awaitable[Any]], deadline: Optional[float],
+                              endpoint: str) -> Any:
+        """
+        One attempt, plus a duplicate once it outlives the endpoint's hedge
+        delay; the first success wins and the other attempt is cancelled
+        """
+        started = time.monotonic()
+        delay = self.hedging.delay(endpoint)
+        primary = asyncio.ensure_future(self._attempt_once(attempt, deadline))
+        attempts = [primary]
+        try:
+            if delay is not None:
+                await asyncio.wait(attempts, timeout=delay)
+                # Only hedge with a free slot: a queued duplicate cannot overtake anything
+                if not primary.done() and not self._slots().locked() and self.hedging.allow(endpoint):
+                    attempts.append(asyncio.ensure_future(self._attempt_once(attempt, deadline)))
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.hedging.record(endpoint, time.monotonic() - started, hedge_won=task is not primary)
+                        return task.result()
+            # Both failed: report the original attempt's error
+            return primary.result()
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+                else:
+                    # Mark a losing attempt's exception retrieved
+                    task.cancelled() or task.exception()
+
+    def _record_failure(self, error: Exception) -> None:
+        self.stats["failures"] += 1
+        # Queue and deadline expiry are local: only upstream failures count
+        if self.breaker is None or isinstance(error, (LLMQueueTimeoutError, LLMDeadlineError)):
+            return
+        # Only upstream availability problems count against the breaker; a
+        # 4xx such as a malformed prompt still proves the upstream is reachable
+        if is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def snapshot(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self._active,
+            "waiting": self._waiting,
+            **self.stats,
+            "hedging": self.hedging.snapshot() if self.hedging is not None else None,
+            "routing": self.router.snapshot() if self.router is not None else None,
+        }
+
+
+def gateway_from_env(default_model: str, breaker: Optional[CircuitBreaker] = None) -> LLMGateway:
+    """Create a gateway configured from LLM_* env vars"""
+    return LLMGateway(
+        default_model,
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+        backoff_base=float(os.getenv("LLM_BACKOFF_BASE", "0.5")),
+        backoff_max=float(os.getenv("LLM_BACKOFF_MAX", "8")),
+        breaker=breaker,
+        hedging=hedge_policy_from_env(),
+        router=router_from_env(default_model),
+    )
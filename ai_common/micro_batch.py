@@ -0,0 +1,151 @@
+"""
+Micro-batching of small concurrent generation requests.
+
+At peak, many short independent questions about the same document arrive
+within a few hundred milliseconds, and each would be its own Gemini call with
+its own per-request overhead, rate-limit cost and copy of the document
+context. ``MicroBatcher.submit`` holds requests that share a key (the same
+knowledge base and scope) for up to ``window`` seconds, or until ``max_size``
+have gathered, and hands them to one batch function together:
+
+- ``batch_question`` merges the questions into one numbered multi-question
+  prompt that asks for an ``### Answer N`` marker before each answer;
+- ``split_answers`` splits the reply back into per-question answers, with
+  None for any answer it cannot find, so the caller can ask that one again on
+  its own.
+
+A request that finds no company within the window runs alone, as it would
+without batching. Unlike ``ai_common.singleflight``, which shares one result
+among identical requests, a batch returns a different result to each request.
+"""
+
+import asyncio
+import os
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# "### Answer 2", "**Answer 2:**" or "Answer 2." at the start of a line; the answer may follow on the same line
+_ANSWER_MARKER_RE = re.compile(
+    r"^[ \t]*(?:#{1,4}[ \t]*)?(?:\*\*)?Answer[ \t]+(\d+)(?=[ \t]*(?:[:.)\-]|\*\*|$))"
+    r"[ \t]*(?:\*\*)?[ \t]*[:.)\-]?[ \t]*(?:\*\*)?",
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+class _Batch:
+    def __init__(self, run: Callable[[List[Any]], Awaitable[List[Any]]]):
+        self.run = run
+        self.items: List[Any] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """Groups concurrent requests by key into batches (asyncio, single event loop)"""
+
+    def __init__(self, window: float = 0.05, max_size: int = 8):
+        self.window = window
+        self.max_size = max_size
+        self._pending: Dict[str, _Batch] = {}
+        # Strong references so running batches are not garbage collected
+        self._running: set = set()
+        self.stats = {"submitted": 0, "batches": 0, "batched": 0, "largest": 0}
+
+    async def submit(self, key: str, item: Any, run: Callable[[List[Any]], Awaitable[List[Any]]]) -> Any:
+        """
+        Add ``item`` to the open batch for ``key`` and wait for its result.
+
+        ``run(items)`` is called once per batch (the first request's ``run``
+        is used) and returns one result per item, in order; a result that is
+        an exception is raised to that item's caller. If ``run`` itself
+        raises, every caller in the batch gets the error.
+        """
+        self.stats["submitted"] += 1
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch(run)
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key, batch)
+        future = asyncio.get_running_loop().create_future()
+        batch.items.append(item)
+        batch.futures.append(future)
+        if len(batch.items) >= self.max_size:
+            self._flush(key, batch)
+        return await future
+
+    def _flush(self, key: str, batch: _Batch) -> None:
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        batch.timer.cancel()
+        size = len(batch.items)
+        self.stats["batches"] += 1
+        self.stats["largest"] = max(self.stats["largest"], size)
+        if size > 1:
+            self.stats["batched"] += size
+        task = asyncio.ensure_future(self._execute(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _execute(self, batch: _Batch) -> None:
+        try:
+            results = await batch.run(list(batch.items))
+            if len(results) != len(batch.futures):
+                raise RuntimeError(f"Batch returned {len(results)} results for {len(batch.futures)} requests")
+        except Exception as error:
+            results = [error] * len(batch.futures)
+        for future, result in zip(batch.futures, results):
+            # Callers that gave up (cancelled requests) no longer need a result
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def snapshot(self) -> Dict:
+        return {
+            "window_ms": round(self.window * 1000, 1),
+            "max_size": self.max_size,
+            "open_batches": len(self._pending),
+            **self.stats,
+        }
+
+
+def batch_question(questions: List[str]) -> str:
+    """One prompt question asking for numbered answers to each of ``questions``"""
+    numbered = "\n".join(f"Question {number}: {question}" for number, question in enumerate(questions, 1))
+    return (
+        f"Answer each of the following {len(questions)} questions separately. Start each answer "
+        'on its own line with "### Answer N", where N is the number of the question it answers, '
+        "and answer every question.\n\n" + numbered
+    )
+
+
+def split_answers(text: str, count: int) -> List[Optional[str]]:
+    """
+    The ``count`` answers of a reply to ``batch_question``, in question
+    order; None for each answer without a marker or with an empty body
+    """
+    answers: List[Optional[str]] = [None] * count
+    markers = list(_ANSWER_MARKER_RE.finditer(text))
+    for position, marker in enumerate(markers):
+        number = int(marker.group(1))
+        end = markers[position + 1].start() if position + 1 < len(markers) else len(text)
+        body = text[marker.end():end].strip()
+        if 1 <= number <= count and answers[number - 1] is None and body:
+            answers[number - 1] = body
+    return answers
+
+
+def batcher_from_env(prefix: str) -> Optional[MicroBatcher]:
+    """
+    A batcher configured from ``<prefix>_BATCHING`` (``on`` or ``off``,
+    default off), ``<prefix>_BATCH_WINDOW_MS`` and ``<prefix>_BATCH_MAX``;
+    None when batching is off
+    """
+    if os.getenv(f"{prefix}_BATCHING", "off").lower() not in ("on", "true", "1"):
+        return None
+    return MicroBatcher(
+        window=float(os.getenv(f"{prefix}_BATCH_WINDOW_MS", "50")) / 1000,
+        max_size=max(1, int(os.getenv(f"{prefix}_BATCH_MAX", "8"))),
+    )
@@ -0,0 +1,153 @@
+"""
+Model routing: pick the Gemini model for each generation call.
+
+Small prompts do not need the model large prompts get, and a model that is
+slow or overloaded right now is worth avoiding. With routing on,
+``LLMGateway.generate`` asks ``ModelRouter.choose`` for a model whenever the
+caller does not name one:
+
+- each endpoint has an ordered list of candidate models, cheapest and fastest
+  first, each with an optional prompt-token limit (``gemini-1.5-flash-8b:2000``);
+  the first candidate whose limit fits the prompt is chosen, the last one when
+  none does;
+- a candidate whose recent average latency is above ``max_latency`` is passed
+  over for the next one that fits; latencies older than ``LATENCY_TTL`` are
+  forgotten, so a model is tried again once it has been left alone;
+- after an overload response (429 or 503) the gateway's retries go to the
+  ``fallback_model`` instead of the model that was chosen.
+
+Prompt tokens are estimated from the prompt's length
+(``ai_common.context.CHARS_PER_TOKEN``), which is cheap enough to do on the
+event loop for every call and close enough to pick a model by. Choices,
+fallbacks and per-model latency are reported in the gateway's snapshot.
+"""
+
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from ai_common.context import CHARS_PER_TOKEN
+
+# Weight of the newest latency in a model's running average
+LATENCY_WEIGHT = 0.2
+# Seconds after which a model's average latency no longer counts against it
+LATENCY_TTL = 60.0
+
+
+@dataclass
+class Route:
+    model: str
+    max_tokens: Optional[int] = None
+
+    def __str__(self) -> str:
+        return self.model if self.max_tokens is None else f"{self.model}:{self.max_tokens}"
+
+
+def parse_routes(spec: str) -> List[Route]:
+    """
+    Candidates from a comma-separated list such as
+    ``gemini-1.5-flash-8b:2000,gemini-1.5-flash``; raises ``ValueError`` for
+    a malformed token limit
+    """
+    routes = []
+    for part in spec.split(","):
+        model, _, limit = part.strip().partition(":")
+        if not model:
+            continue
+        try:
+            routes.append(Route(model=model.strip(), max_tokens=int(limit) if limit.strip() else None))
+        except ValueError:
+            raise ValueError(f"Invalid token limit in model route '{part.strip()}'")
+    return routes
+
+
+class ModelRouter:
+    """Chooses models per call; see the module docstring"""
+
+    def __init__(
+        self,
+        routes: List[Route],
+        endpoint_routes: Optional[Dict[str, List[Route]]] = None,
+        fallback_model: Optional[str] = None,
+        max_latency: Optional[float] = None,
+    ):
+        self.routes = routes
+        self.endpoint_routes = endpoint_routes or {}
+        self.fallback_model = fallback_model
+        self.max_latency = max_latency
+        self._latency: Dict[str, Tuple[float, float]] = {}
+        self._choices: Dict[str, Counter] = {}
+        self.stats = {"routed": 0, "slow_skips": 0, "fallbacks": 0}
+
+    def _slow(self, model: str) -> bool:
+        if not self.max_latency or model not in self._latency:
+            return False
+        average, updated = self._latency[model]
+        return average > self.max_latency and time.monotonic() - updated < LATENCY_TTL
+
+    def choose(self, endpoint: str, prompt: str) -> str:
+        """The model for a call on ``endpoint`` with ``prompt``"""
+        routes = self.endpoint_routes.get(endpoint, self.routes)
+        tokens = len(prompt) // CHARS_PER_TOKEN
+        fitting = [route for route in routes if route.max_tokens is None or tokens <= route.max_tokens] or routes[-1:]
+        model = fitting[-1].model
+        for route in fitting[:-1]:
+            if not self._slow(route.model):
+                model = route.model
+                break
+            self.stats["slow_skips"] += 1
+        self.stats["routed"] += 1
+        self._choices.setdefault(endpoint, Counter())[model] += 1
+        return model
+
+    def fallback_for(self, model: str) -> Optional[str]:
+        """The model to retry on after ``model`` reported an overload, if any"""
+        if not self.fallback_model or self.fallback_model == model:
+            return None
+        self.stats["fallbacks"] += 1
+        return self.fallback_model
+
+    def record(self, model: str, seconds: float) -> None:
+        """Latency of a successful call to ``model``"""
+        previous = self._latency.get(model)
+        average = seconds if previous is None else (1 - LATENCY_WEIGHT) * previous[0] + LATENCY_WEIGHT * seconds
+        self._latency[model] = (average, time.monotonic())
+
+    def snapshot(self) -> Dict:
+        return {
+            "routes": {
+                "*": [str(route) for route in self.routes],
+                **{endpoint: [str(route) for route in routes] for endpoint, routes in self.endpoint_routes.items()},
+            },
+            "fallback_model": self.fallback_model,
+            "max_latency_ms": round(1000 * self.max_latency) if self.max_latency else None,
+            "choices": {endpoint: dict(choices) for endpoint, choices in self._choices.items()},
+            "latency_ms": {model: round(1000 * average, 1) for model, (average, _) in self._latency.items()},
+            **self.stats,
+        }
+
+
+def router_from_env(default_model: str) -> Optional[ModelRouter]:
+    """
+    A router from LLM_ROUTING (``on`` or ``off``, default off), LLM_ROUTES,
+    LLM_ROUTES_<ENDPOINT> (e.g. LLM_ROUTES_ASK for the ``ask`` endpoint),
+    LLM_FALLBACK_MODEL and LLM_ROUTE_MAX_LATENCY; None when routing is off.
+    Without LLM_ROUTES every call goes to ``default_model``.
+    """
+    if os.getenv("LLM_ROUTING", "off").lower() not in ("on", "true", "1"):
+        return None
+    routes = parse_routes(os.getenv("LLM_ROUTES", "")) or [Route(default_model)]
+    endpoint_routes = {}
+    for name, value in os.environ.items():
+        if name.startswith("LLM_ROUTES_") and parse_routes(value):
+            endpoint = name[len("LLM_ROUTES_"):].lower().replace("_", "-")
+            endpoint_routes[endpoint] = parse_routes(value)
+    max_latency = float(os.getenv("LLM_ROUTE_MAX_LATENCY", "0"))
+    return ModelRouter(
+        routes,
+        endpoint_routes,
+        fallback_model=os.getenv("LLM_FALLBACK_MODEL") or None,
+        max_latency=max_latency or None,
+    )
@@ -0,0 +1,301 @@
+"""
+Page boundaries and section headings of extracted text.
+
+Extraction joins a document's pages with ``PAGE_BREAK`` (a form feed on a line
+of its own, like ``pdftotext``), so the text kept in the extraction cache and
+in content records still knows where each page starts. ``PageIndex`` turns the
+breaks into page offsets and ``find_sections`` pairs headings with the pages
+they span, so a question can be limited to "pages 40-45" or "Chapter 3" and an
+answer can cite the pages it drew from. Headings come from the PDF's bookmarks
+when it has them (see ``ai_common.pdf_outline``), otherwise from lines that
+look like headings (``Chapter 3``, ``2.1 Gradient descent``, all-caps titles).
+``split_chunks`` cuts text into passages that never cross a page break, the
+unit the retrieval indexes work on.
+
+Page numbers are physical: the first page of the PDF is page 1, whatever its
+printed page label.
+"""
+
+import bisect
+import re
+import sys
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple
+
+from ai_common.pdf_outline import OutlineEntry
+
+# Separates the texts of consecutive pages; whitespace to tokenizers and TF-IDF
+PAGE_BREAK = "\n\f\n"
+
+_KEYWORD_HEADING_RE = re.compile(
+    r"^(chapter|part|unit|lecture|module|week|section|topic)\s+(\d+|[ivxlc]+)\b[\s:.\-–—]*(.{0,80})$", re.IGNORECASE
+)
+_NUMBERED_HEADING_RE = re.compile(r"^(\d{1,2}(?:\.\d{1,2}){0,3})\.?\s+([A-Z][^\n]{1,80})$")
+_CAPS_HEADING_RE = re.compile(r"^[A-Z][A-Z0-9 ,&:'\-]{3,60}$")
+_PAGE_RANGE_RE = re.compile(r"^(\d+)\s*(?:-\s*(\d+))?$")
+_BOUNDARY_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+# Size of the passages retrieval works on
+CHUNK_CHARS = 1200
+
+# Keyword headings that sit below chapters rather than beside them
+_SUBSECTION_KEYWORDS = {"section", "topic"}
+
+
+@dataclass
+class Heading:
+    offset: int
+    level: int
+    title: str
+
+
+def find_headings(text: str) -> List[Heading]:
+    """Lines of ``text`` that look like section headings, with their character offsets"""
+    headings = []
+    offset = 0
+    for line in text.split("\n"):
+        heading = _heading(line.strip())
+        if heading is not None:
+            level, title = heading
+            headings.append(Heading(offset=offset, level=level, title=title))
+        offset += len(line) + 1
+    return headings
+
+
+def _heading(line: str):
+    if not line or len(line) > 90 or line.endswith((".", ",", ";")):
+        return None
+    match = _KEYWORD_HEADING_RE.match(line)
+    if match:
+        level = 2 if match.group(1).lower() in _SUBSECTION_KEYWORDS else 1
+        return level, line
+    match = _NUMBERED_HEADING_RE.match(line)
+    if match and len(match.group(2).split()) <= 10:
+        return match.group(1).count(".") + 1, line
+    if _CAPS_HEADING_RE.match(line) and 1 < len(line.split()) <= 8:
+        return 1, line.title()
+    return None
+
+
+class PageIndex:
+    """Character spans of each page in a text joined with ``PAGE_BREAK``"""
+
+    def __init__(self, spans: List[Tuple[int, int]]):
+        self.spans = spans
+        self._starts = [start for start, _ in spans]
+
+    @classmethod
+    def from_text(cls, text: str) -> "PageIndex":
+        spans = []
+        start = 0
+        while True:
+            end = text.find(PAGE_BREAK, start)
+            if end < 0:
+                spans.append((start, len(text)))
+                return cls(spans)
+            spans.append((start, end))
+            start = end + len(PAGE_BREAK)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.spans)
+
+    def page_at(self, offset: int) -> int:
+        """Page number (1-based) of the character at ``offset``"""
+        return max(1, bisect.bisect_right(self._starts, offset))
+
+    def page_texts(self, text: str, pages: List[int], start: int = 0,
+                   end: Optional[int] = None) -> List[Tuple[int, str]]:
+        """``(page, text)`` of the given pages, clipped to ``text[start:end]``; empty pages are left out"""
+        end = len(text) if end is None else end
+        texts = []
+        for page in pages:
+            page_start, page_end = self.spans[page - 1]
+            page_text = text[max(page_start, start):min(page_end, end)].strip()
+            if page_text:
+                texts.append((page, page_text))
+        return texts
+
+
+@dataclass
+class Chunk:
+    start: int
+    end: int
+    page: int
+
+
+def approx_bytes(obj) -> int:
+    """
+    Approximate memory held by ``obj`` and everything it references through
+    containers and instance attributes, counting shared objects once; walks
+    every object, so call it once per structure and off the event loop
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, "__dict__"):
+            stack.append(vars(item))
+    return total
+
+
+def _cut(text: str, start: int, end: int, size: int) -> List[Tuple[int, int]]:
+    """Spans of ``text[start:end]`` of at most ``size`` characters, cut after sentences where possible"""
+    spans = []
+    while end - start > size:
+        limit = start + size
+        cut = None
+        for match in _BOUNDARY_RE.finditer(text, start + size // 2, limit):
+            cut = match.end()
+        if cut is None:
+            space = text.rfind(" ", start + 1, limit)
+            cut = space + 1 if space > start else limit
+        spans.append((start, cut))
+        start = cut
+    if text[start:end].strip():
+        spans.append((start, end))
+    return spans
+
+
+def split_chunks(text: str, index: PageIndex, start: int = 0, end: Optional[int] = None,
+                 size: int = CHUNK_CHARS) -> List[Chunk]:
+    """Passages of ``text[start:end]`` of at most ``size`` characters that never cross a page break"""
+    end = len(text) if end is None else end
+    chunks = []
+    if start >= end:
+        return chunks
+    for page in range(index.page_at(start), index.page_at(max(start, end - 1)) + 1):
+        page_start, page_end = index.spans[page - 1]
+        for chunk_start, chunk_end in _cut(text, max(start, page_start), min(end, page_end), size):
+            chunks.append(Chunk(start=chunk_start, end=chunk_end, page=page))
+    return chunks
+
+
+def chunk_text(text: str, chunk: Chunk) -> str:
+    return text[chunk.start:chunk.end].strip()
+
+
+@dataclass
+class Section:
+    title: str
+    level: int
+    start: int
+    end: int
+    first_page: int
+    last_page: int
+
+    @property
+    def pages(self) -> List[int]:
+        return list(range(self.first_page, self.last_page + 1))
+
+    def to_dict(self) -> Dict:
+        data = asdict(self)
+        # Character offsets are internal to the stored text
+        del data["start"], data["end"]
+        return data
+
+
+def outline_headings(text: str, index: PageIndex, outline: List[OutlineEntry]) -> List[Heading]:
+    """
+    Bookmarks as headings: each starts at the line of its page that begins
+    with its title, or at the top of the page when no line does
+    """
+    headings = []
+    for entry in outline:
+        if entry.page > index.page_count:
+            continue
+        start, end = index.spans[entry.page - 1]
+        offset = start
+        title = " ".join(entry.title.lower().split())
+        line_start = start
+        for line in text[start:end].split("\n"):
+            if " ".join(line.lower().split()).startswith(title[:40]):
+                offset = line_start
+                break
+            line_start += len(line) + 1
+        headings.append(Heading(offset=offset, level=entry.level, title=entry.title))
+    # Bookmarks are not always in page order
+    return sorted(headings, key=lambda heading: heading.offset)
+
+
+def find_sections(text: str, index: PageIndex, headings: Optional[List[Heading]] = None) -> List[Section]:
+    """
+    Headings (detected in ``text`` unless given) with the text, and pages, up
+    to the next heading of the same or a higher level
+    """
+    if headings is None:
+        headings = find_headings(text)
+    sections, open_sections = [], []
+    for heading in headings + [Heading(offset=len(text), level=0, title="")]:
+        while open_sections and open_sections[-1].level >= heading.level:
+            closed = open_sections.pop()
+            closed.end = heading.offset
+            closed.last_page = index.page_at(max(closed.start, heading.offset - 1))
+        if heading.level:
+            section = Section(title=heading.title, level=heading.level, start=heading.offset, end=len(text),
+                              first_page=index.page_at(heading.offset), last_page=index.page_count)
+            sections.append(section)
+            open_sections.append(section)
+    return sections
+
+
+def index_text(text: str, outline: Optional[List[OutlineEntry]] = None) -> Tuple[PageIndex, List[Section]]:
+    """
+    Page index and sections of an extracted text, from its bookmarks when
+    there are at least two; CPU bound for long documents
+    """
+    index = PageIndex.from_text(text)
+    headings = outline_headings(text, index, outline) if outline and len(outline) >= 2 else None
+    return index, find_sections(text, index, headings)
+
+
+def parse_page_range(spec: str, page_count: int) -> List[int]:
+    """
+    Pages selected by a range such as ``12``, ``40-45`` or ``3, 7-9``.
+    Raises ``ValueError`` for malformed ranges and pages outside the document.
+    """
+    pages = set()
+    for part in spec.split(","):
+        match = _PAGE_RANGE_RE.match(part.strip())
+        if not match:
+            raise ValueError(f"Invalid page range '{spec}'; use e.g. '12', '40-45' or '3, 7-9'")
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if not 1 <= first <= last:
+            raise ValueError(f"Invalid page range '{part.strip()}'")
+        if last > page_count:
+            raise ValueError(f"Page range '{part.strip()}' is outside the document ({page_count} pages)")
+        pages.update(range(first, last + 1))
+    return sorted(pages)
+
+
+def match_section(sections: List[Section], query: str) -> Optional[Section]:
+    """
+    The section whose title best matches ``query``: an exact title first,
+    then a title starting with it (``chapter 3`` matches ``Chapter 3: Trees``
+    but not ``Chapter 30``), then one containing it
+    """
+    query = " ".join(query.lower().split())
+    if not query:
+        return None
+    titles = [" ".join(section.title.lower().split()) for section in sections]
+    prefix = re.compile(re.escape(query) + r"(?!\w)")
+    for matches in (
+        lambda title: title == query,
+        lambda title: prefix.match(title) is not None,
+        lambda title: prefix.search(title) is not None,
+    ):
+        for section, title in zip(sections, titles):
+            if matches(title):
+                return section
+    return None
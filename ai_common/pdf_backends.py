@@ -0,0 +1,185 @@
+"""
+Interchangeable PDF text extraction backends.
+
+Every backend opens a PDF source (bytes, or the path of a spooled upload) and
+yields ``(page_count, page_texts)`` where ``page_texts`` is a lazy iterator,
+so callers can stop after the pages they need. Backends whose library is not
+installed are skipped:
+
+- ``pypdf2``: PyPDF2, the original extractor (pure Python);
+- ``pypdf``: the maintained successor of PyPDF2 (pure Python);
+- ``pdfminer``: pdfminer.six, slow but layout aware;
+- ``pypdfium2``: bindings to Chrome's PDFium (native, usually the fastest).
+
+``EXTRACT_BACKEND`` picks one by name, or ``auto`` (the default) picks the
+first available backend in ``EXTRACT_BACKEND_PREFERENCE``. Run
+``python -m ai_common.extraction_benchmark <pdfs>`` to measure which backend
+is fastest on a deployment's own documents.
+"""
+
+import contextlib
+import importlib.metadata
+import importlib.util
+import io
+import mmap
+import os
+from typing import ContextManager, Dict, Iterator, List, Tuple, Type, Union
+
+PDFSource = Union[bytes, str]
+PageTexts = Tuple[int, Iterator[str]]
+
+DEFAULT_PREFERENCE = "pypdfium2,pypdf,pypdf2,pdfminer"
+
+
+@contextlib.contextmanager
+def open_source(source: PDFSource) -> Iterator:
+    """Seekable stream over PDF bytes, or a read-only memory map of a file path"""
+    if isinstance(source, (bytes, bytearray)):
+        yield io.BytesIO(source)
+        return
+    with open(source, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield mapped
+
+
+class ExtractionBackend:
+    """Interface implemented by extraction backends"""
+
+    name = "base"
+    module = ""
+    distribution = ""
+
+    @classmethod
+    def available(cls) -> bool:
+        return importlib.util.find_spec(cls.module) is not None
+
+    @classmethod
+    def version(cls) -> str:
+        try:
+            return importlib.metadata.version(cls.distribution)
+        except importlib.metadata.PackageNotFoundError:
+            return "unknown"
+
+    def open(self, source: PDFSource) -> ContextManager[PageTexts]:
+        """Context manager yielding (page_count, lazy iterator of page texts)"""
+        raise NotImplementedError
+
+
+class PyPDF2Backend(ExtractionBackend):
+    name = "pypdf2"
+    module = "PyPDF2"
+    distribution = "PyPDF2"
+
+    def _reader(self, stream):
+        import PyPDF2
+
+        return PyPDF2.PdfReader(stream)
+
+    @contextlib.contextmanager
+    def open(self, source: PDFSource) -> Iterator[PageTexts]:
+        with open_source(source) as stream:
+            reader = self._reader(stream)
+            yield len(reader.pages), (page.extract_text() for page in reader.pages)
+
+
+class PypdfBackend(PyPDF2Backend):
+    name = "pypdf"
+    module = "pypdf"
+    distribution = "pypdf"
+
+    def _reader(self, stream):
+        import pypdf
+
+        return pypdf.PdfReader(stream)
+
+
+class PdfminerBackend(ExtractionBackend):
+    name = "pdfminer"
+    module = "pdfminer"
+    distribution = "pdfminer.six"
+
+    @contextlib.contextmanager
+    def open(self, source: PDFSource) -> Iterator[PageTexts]:
+        from pdfminer.converter import TextConverter
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdfparser import PDFParser
+        from pdfminer.pdftypes import resolve1
+
+        with open_source(source) as stream:
+            document = PDFDocument(PDFParser(stream))
+            page_count = resolve1(document.catalog["Pages"])["Count"]
+            resources = PDFResourceManager()
+
+            def page_texts() -> Iterator[str]:
+                for page in PDFPage.create_pages(document):
+                    output = io.StringIO()
+                    device = TextConverter(resources, output, laparams=LAParams())
+                    PDFPageInterpreter(resources, device).process_page(page)
+                    device.close()
+                    yield output.getvalue()
+
+            yield page_count, page_texts()
+
+
+class Pypdfium2Backend(ExtractionBackend):
+    name = "pypdfium2"
+    module = "pypdfium2"
+    distribution = "pypdfium2"
+
+    @contextlib.contextmanager
+    def open(self, source: PDFSource) -> Iterator[PageTexts]:
+        import pypdfium2
+
+        # PDFium reads paths and bytes natively, without a Python stream
+        document = pypdfium2.PdfDocument(source)
+        try:
+            def page_texts() -> Iterator[str]:
+                for index in range(len(document)):
+                    page = document[index]
+                    text_page = page.get_textpage()
+                    try:
+                        yield text_page.get_text_range()
+                    finally:
+                        text_page.close()
+                        page.close()
+
+            yield len(document), page_texts()
+        finally:
+            document.close()
+
+
+BACKENDS: Dict[str, Type[ExtractionBackend]] = {
+    backend.name: backend
+    for backend in (PyPDF2Backend, PypdfBackend, PdfminerBackend, Pypdfium2Backend)
+}
+
+
+def available_backends() -> List[str]:
+    return [name for name, backend in BACKENDS.items() if backend.available()]
+
+
+def get_backend(name: str) -> ExtractionBackend:
+    """Backend by name; raises ValueError for unknown or uninstalled backends"""
+    backend = BACKENDS.get(name.lower())
+    if backend is None:
+        raise ValueError(f"Unknown extraction backend {name!r}; choose from {', '.join(BACKENDS)}")
+    if not backend.available():
+        raise ValueError(f"Extraction backend {name!r} is not installed (pip install {backend.distribution})")
+    return backend()
+
+
+def backend_from_env() -> ExtractionBackend:
+    """
+    The backend named by EXTRACT_BACKEND, or with ``auto`` the first installed
+    one in EXTRACT_BACKEND_PREFERENCE
+    """
+    name = os.getenv("EXTRACT_BACKEND", "auto").lower()
+    if name != "auto":
+        return get_backend(name)
+    preference = os.getenv("EXTRACT_BACKEND_PREFERENCE", DEFAULT_PREFERENCE)
+    for candidate in (item.strip().lower() for item in preference.split(",")):
+        if candidate in BACKENDS and BACKENDS[candidate].available():
+            return BACKENDS[candidate]()
+    raise ValueError(f"None of the extraction backends {preference!r} is installed")
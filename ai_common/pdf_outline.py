@@ -0,0 +1,67 @@
+"""
+PDF bookmarks: the document's own table of contents.
+
+Textbooks usually ship an outline, nested bookmarks pointing at the page each
+part, chapter and section starts on. It is a more reliable map of a long
+document than headings detected in its text, and reading it only touches the
+document catalog and page tree, not page contents. ``read_outline`` runs in
+the extraction sandbox next to the text extraction (see
+``ai_common.extraction_sandbox``).
+"""
+
+from dataclasses import asdict, dataclass
+from typing import Dict, List
+
+from ai_common.pdf_backends import PDFSource, open_source
+from ai_common.text_probe import _reader
+
+# Bookmarks past this many are ignored (generated outlines can list every figure)
+MAX_OUTLINE_ENTRIES = 2000
+MAX_TITLE_CHARS = 200
+
+
+@dataclass
+class OutlineEntry:
+    level: int
+    title: str
+    page: int
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "OutlineEntry":
+        return cls(**data)
+
+
+def _walk(reader, items, level: int, entries: List[OutlineEntry]) -> None:
+    for item in items:
+        if len(entries) >= MAX_OUTLINE_ENTRIES:
+            return
+        # A nested list holds the children of the bookmark before it
+        if isinstance(item, list):
+            _walk(reader, item, level + 1, entries)
+            continue
+        try:
+            page = reader.get_destination_page_number(item)
+        except Exception:
+            continue
+        title = " ".join(str(getattr(item, "title", "") or "").split())[:MAX_TITLE_CHARS]
+        if title and page is not None and page >= 0:
+            entries.append(OutlineEntry(level=level, title=title, page=page + 1))
+
+
+def read_outline(source: PDFSource) -> List[OutlineEntry]:
+    """
+    Bookmarks of a PDF (bytes or a file path) in document order, with
+    1-based physical page numbers; empty when the PDF has none or they
+    cannot be read
+    """
+    try:
+        with open_source(source) as stream:
+            reader = _reader(stream)
+            entries = []
+            _walk(reader, reader.outline, 1, entries)
+            return entries
+    except Exception:
+        return []
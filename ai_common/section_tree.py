@@ -0,0 +1,218 @@
+"""
+Hierarchical section tree for coarse-to-fine retrieval over long documents.
+
+Ranking every sentence of a 1000-page textbook against a question is slow and
+noisy: many passages look alike, and the best-scoring fragments often come
+from the wrong chapter. ``build_section_tree`` organizes a document once, at
+ingestion:
+
+- its sections (from the PDF's bookmarks or detected headings, see
+  ``ai_common.page_index``) are the inner nodes, chapters at the top;
+- text that belongs to a section itself, rather than to one of its
+  subsections, is cut into page-bounded chunks (``split_chunks``) held by leaf
+  nodes;
+- nodes with more than ``MAX_FANOUT`` children or chunks are split into groups
+  of consecutive ones, so documents without headings still get a tree of
+  logarithmic depth;
+- every node keeps a summary vector: the ``SUMMARY_TERMS`` heaviest tf-idf
+  terms of the text beneath it.
+
+``SectionTree.search`` descends level by level: the children of the nodes
+kept so far are scored against the query's vector and only the ``beam`` best
+(and only those within ``PRUNE_RATIO`` of the best) are expanded, so whole
+chapters are pruned at the top. Chunks are only scored under the leaves that
+survive, so the cost grows with depth times beam width instead of with the
+number of chunks. Like ``ai_common.passage_index``, the tree keeps offsets
+rather than the text, which searches are given; ``memory_bytes`` is the
+tree's approximate size.
+"""
+
+import math
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from ai_common.context import terms
+from ai_common.page_index import Chunk, PageIndex, Section, approx_bytes, chunk_text, split_chunks
+
+MAX_FANOUT = 16
+SUMMARY_TERMS = 128
+# Children scoring below this share of the best child's score are pruned
+PRUNE_RATIO = 0.5
+
+@dataclass
+class TreeNode:
+    title: str
+    first_page: int
+    last_page: int
+    children: List["TreeNode"] = field(default_factory=list)
+    chunks: List[Chunk] = field(default_factory=list)
+    vector: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def leaf(self) -> bool:
+        return not self.children
+
+
+@dataclass
+class ScoredChunk:
+    chunk: Chunk
+    score: float
+    path: List[str]
+
+
+@dataclass
+class TreeSearch:
+    chunks: List[ScoredChunk]
+    nodes_scored: int = 0
+    chunks_scored: int = 0
+
+
+def _leaf(title: str, chunks: List[Chunk]) -> TreeNode:
+    return TreeNode(title=title, first_page=chunks[0].page, last_page=chunks[-1].page, chunks=chunks)
+
+
+def _group(title: str, nodes: List[TreeNode]) -> List[TreeNode]:
+    """Nest runs of consecutive nodes until no node has more than ``MAX_FANOUT`` children"""
+    while len(nodes) > MAX_FANOUT:
+        nodes = [
+            TreeNode(title=title, first_page=run[0].first_page, last_page=run[-1].last_page, children=run)
+            for run in (nodes[i:i + MAX_FANOUT] for i in range(0, len(nodes), MAX_FANOUT))
+        ]
+    return nodes
+
+
+def _leaves(title: str, chunks: List[Chunk]) -> List[TreeNode]:
+    leaves = [_leaf(title, chunks[i:i + MAX_FANOUT]) for i in range(0, len(chunks), MAX_FANOUT)]
+    return _group(title, leaves)
+
+
+def _build(text: str, index: PageIndex, title: str, start: int, end: int,
+           sections: List[Section], first_page: int, last_page: int) -> TreeNode:
+    """Node for ``text[start:end]``, with ``sections`` (all inside that span) below it"""
+    children = []
+    position = start
+    remaining = list(sections)
+    while remaining:
+        section = remaining.pop(0)
+        nested = []
+        while remaining and remaining[0].start < section.end:
+            nested.append(remaining.pop(0))
+        # Text before the section belongs to this node itself
+        children.extend(_leaves(title, split_chunks(text, index, position, section.start)))
+        children.append(_build(text, index, section.title, section.start, section.end, nested,
+                               section.first_page, section.last_page))
+        position = section.end
+    children.extend(_leaves(title, split_chunks(text, index, position, end)))
+    children = [child for child in children if child.children or child.chunks]
+    if len(children) == 1 and children[0].leaf:
+        return children[0]
+    return TreeNode(title=title, first_page=first_page, last_page=last_page, children=_group(title, children))
+
+
+def _normalized(weights: Dict[str, float], limit: Optional[int] = None) -> Dict[str, float]:
+    if limit is not None and len(weights) > limit:
+        weights = dict(sorted(weights.items(), key=lambda item: -item[1])[:limit])
+    norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+    return {term: weight / norm for term, weight in weights.items()} if norm else {}
+
+
+def _cosine(query: Dict[str, float], vector: Dict[str, float]) -> float:
+    return sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+
+
+class SectionTree:
+    """See the module docstring; build with ``build_section_tree``"""
+
+    def __init__(self, root: TreeNode, idf: Dict[str, float], chunk_count: int, node_count: int):
+        self.root = root
+        self.idf = idf
+        self.chunk_count = chunk_count
+        self.node_count = node_count
+        self.depth = self._depth(root)
+        # Set by build_section_tree
+        self.memory_bytes = 0
+
+    @staticmethod
+    def _depth(node: TreeNode) -> int:
+        return 1 + max((SectionTree._depth(child) for child in node.children), default=0)
+
+    def _vector(self, counts: Counter) -> Dict[str, float]:
+        return {term: count * self.idf.get(term, 0.0) for term, count in counts.items()}
+
+    def search(self, text: str, query: str, limit: int = 20, beam: Optional[int] = None) -> TreeSearch:
+        """The ``limit`` chunks of ``text`` (the text the tree was built from) that best match ``query``, best first"""
+        if beam is None:
+            beam = int(os.getenv("SECTION_TREE_BEAM", "4"))
+        query_vector = _normalized({term: self.idf[term] for term in set(terms(query)) if term in self.idf})
+        result = TreeSearch(chunks=[])
+        if not query_vector:
+            return result
+
+        frontier, leaves = [(self.root, [])], []
+        while frontier:
+            candidates = []
+            for node, path in frontier:
+                if node.leaf:
+                    leaves.append((node, path))
+                    continue
+                for child in node.children:
+                    # Groups of consecutive nodes carry their parent's title
+                    child_path = path + [child.title] if child.title and child.title not in path[-1:] else path
+                    candidates.append((_cosine(query_vector, child.vector), child, child_path))
+            result.nodes_scored += len(candidates)
+            candidates.sort(key=lambda candidate: -candidate[0])
+            best = candidates[0][0] if candidates else 0.0
+            frontier = [(child, path) for score, child, path in candidates[:beam]
+                        if score > 0 and score >= best * PRUNE_RATIO]
+
+        scored = []
+        for node, path in leaves:
+            for chunk in node.chunks:
+                vector = _normalized(self._vector(Counter(terms(chunk_text(text, chunk)))))
+                score = _cosine(query_vector, vector)
+                if score > 0:
+                    scored.append(ScoredChunk(chunk=chunk, score=score, path=path))
+            result.chunks_scored += len(node.chunks)
+        result.chunks = sorted(scored, key=lambda item: (-item.score, item.chunk.start))[:limit]
+        return result
+
+
+def build_section_tree(text: str, index: PageIndex, sections: List[Section]) -> SectionTree:
+    """Tree of a document's sections, chunks and summary vectors; CPU bound, call it off the event loop"""
+    root = _build(text, index, "", 0, len(text), sections, 1, index.page_count)
+    nodes, chunk_counts = [], {}
+
+    def collect(node: TreeNode) -> None:
+        nodes.append(node)
+        for chunk in node.chunks:
+            chunk_counts[id(chunk)] = Counter(terms(text[chunk.start:chunk.end]))
+        for child in node.children:
+            collect(child)
+
+    collect(root)
+    document_frequency = Counter()
+    for counts in chunk_counts.values():
+        document_frequency.update(counts.keys())
+    total = len(chunk_counts)
+    idf = {term: math.log((total + 1) / (count + 1)) + 1 for term, count in document_frequency.items()}
+    tree = SectionTree(root, idf, chunk_count=total, node_count=len(nodes))
+
+    def summarize(node: TreeNode) -> Counter:
+        counts = Counter()
+        for chunk in node.chunks:
+            counts.update(chunk_counts[id(chunk)])
+        for child in node.children:
+            counts.update(summarize(child))
+        node.vector = _normalized(tree._vector(counts), SUMMARY_TERMS)
+        return counts
+
+    summarize(root)
+    tree.memory_bytes = approx_bytes(tree)
+    return tree
+
+
+def section_tree_from_env() -> bool:
+    """Whether rag-server builds section trees for retrieval (SECTION_TREE, ``on`` or ``off``)"""
+    return os.getenv("SECTION_TREE", "on").lower() not in ("off", "false", "0")
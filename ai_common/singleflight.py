@@ -0,0 +1,52 @@
+"""
+Single-flight coalescing of identical concurrent calls.
+
+When many clients send the same request at the same moment (a class of 200
+asking "what is chapter 3 about", or a double-submitted form), only the first
+call goes upstream. Concurrent callers with the same key wait on that call and
+share its result or its exception. The upstream call runs as its own task, so
+a caller disconnecting does not cancel it for everyone else.
+"""
+
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key (asyncio, single event loop)"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"calls": 0, "executions": 0, "coalesced": 0}
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        """Stable key for e.g. (endpoint, model, prompt)"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x1f")
+        return digest.hexdigest()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run ``fn`` unless a call with ``key`` is already in flight, then share its outcome"""
+        self.stats["calls"] += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["executions"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        # Mark the exception retrieved even if every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def snapshot(self) -> Dict:
+        return {"in_flight": len(self._inflight), **self.stats}
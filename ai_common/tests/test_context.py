@@ -0,0 +1,71 @@
+from ai_common.context import ApproxTokenCounter, pack_context, pack_sources, split_sentences
+
+
+class StrictCounter:
+    """Counts three times what the offline estimate does, like a tokenizer it underestimates"""
+
+    def count(self, text: str) -> int:
+        return 3 * ApproxTokenCounter().count(text)
+
+
+TEXT = " ".join(f"Sentence number {i} is about topic {i}." for i in range(200))
+
+
+def test_text_within_budget_is_kept_whole():
+    packed = pack_context("One sentence. Another one.", 1000)
+    assert packed.text == "One sentence. Another one."
+    assert not packed.truncated
+
+
+def test_packing_cuts_at_sentence_boundaries():
+    packed = pack_context(TEXT, 100)
+    assert packed.truncated
+    assert 0 < packed.tokens <= 100
+    assert packed.text.endswith(".")
+    assert packed.text.startswith("Sentence number 0 ")
+
+
+def test_query_picks_matching_sentences():
+    packed = pack_context(TEXT, 30, query="topic 150")
+    assert "topic 150." in packed.text
+
+
+def test_first_sentence_longer_than_budget_is_cut_at_a_word():
+    packed = pack_context("word " * 2000, 50)
+    assert 0 < packed.tokens <= 50
+    assert packed.text.split() == ["word"] * len(packed.text.split())
+
+
+def test_overshooting_counter_keeps_the_first_sentences():
+    packed = pack_context(TEXT, 100, counter=StrictCounter())
+    assert 0 < packed.tokens <= 100
+    assert packed.text.startswith("Sentence number 0 ")
+
+
+def test_overshooting_counter_still_cuts_a_single_segment():
+    packed = pack_context("word " * 2000, 50, counter=StrictCounter())
+    assert 0 < packed.tokens <= 50
+    assert packed.truncated
+
+
+def test_overshooting_counter_with_a_query():
+    packed = pack_context(TEXT, 60, query="topic 150", counter=StrictCounter())
+    assert 0 < packed.tokens <= 60
+
+
+def test_sources_are_labelled():
+    sources = [("p. 1", "Graphs have vertices."), ("p. 2", "Trees are graphs."), ("", "Unlabelled text.")]
+    packed = pack_sources(sources, 1000)
+    assert "[p. 1]" in packed.text and "[p. 2]" in packed.text
+    assert packed.sources == ["p. 1", "p. 2"]
+
+
+def test_sources_left_out_are_not_listed():
+    sources = [("p. 1", TEXT), ("p. 2", "Trees are graphs.")]
+    packed = pack_sources(sources, 50, counter=StrictCounter())
+    assert packed.sources == ["p. 1"]
+    assert packed.tokens <= 50
+
+
+def test_split_sentences_keeps_all_text():
+    assert "".join(split_sentences(TEXT)).split() == TEXT.split()
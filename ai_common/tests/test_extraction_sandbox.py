@@ -0,0 +1,51 @@
+import io
+
+import pytest
+
+from ai_common.extraction_sandbox import ExtractionLimits, resource, run_sandboxed
+
+canvas = pytest.importorskip("reportlab.pdfgen.canvas")
+
+BACKEND = "pypdf2"
+
+
+def pdf(pages: int, lines: int = 1) -> bytes:
+    buffer = io.BytesIO()
+    document = canvas.Canvas(buffer)
+    for page in range(pages):
+        for line in range(lines):
+            document.drawString(50, 800 - 15 * line, f"Page {page} of the test document.")
+        document.showPage()
+    document.save()
+    return buffer.getvalue()
+
+
+def test_pages_come_back_from_the_child():
+    result = run_sandboxed(BACKEND, pdf(3), ExtractionLimits(wall_seconds=60))
+    assert result.failure is None
+    assert result.complete
+    assert result.page_count == 3
+    assert "Page 2 of the test document." in result.text
+
+
+def test_max_chars_stops_early():
+    result = run_sandboxed(BACKEND, pdf(50), ExtractionLimits(wall_seconds=60), max_chars=100)
+    assert result.failure is None
+    assert not result.complete
+    assert len(result.pages) < 50
+
+
+def test_malformed_pdf_is_classified():
+    result = run_sandboxed(BACKEND, b"%PDF-1.4 not really a pdf", ExtractionLimits(wall_seconds=60))
+    assert result.failure == "malformed"
+
+
+def test_wall_clock_limit():
+    result = run_sandboxed(BACKEND, pdf(3), ExtractionLimits(wall_seconds=0.001))
+    assert result.failure == "timeout"
+
+
+@pytest.mark.skipif(resource is None, reason="rlimits are only applied on POSIX")
+def test_memory_limit_is_reported_as_oom():
+    result = run_sandboxed(BACKEND, pdf(300, lines=40), ExtractionLimits(wall_seconds=60, memory_mb=20))
+    assert result.failure == "oom"
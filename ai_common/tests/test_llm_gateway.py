@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from ai_common.health import CircuitBreaker, CircuitOpenError
+from ai_common.llm_gateway import (
+    LLMDeadlineError,
+    LLMGateway,
+    LLMQueueTimeoutError,
+    LLMTimeoutError,
+    MIN_REQUEST_TIMEOUT,
+    deadline_after,
+    is_retryable,
+    request_deadline,
+)
+
+
+class UpstreamError(Exception):
+    def __init__(self, code: int):
+        super().__init__(f"upstream returned {code}")
+        self.code = code
+
+
+def gateway(breaker=None, **options) -> LLMGateway:
+    options.setdefault("max_retries", 0)
+    options.setdefault("backoff_base", 0.001)
+    return LLMGateway("test-model", breaker=breaker, **options)
+
+
+def run(gw: LLMGateway, attempt, **options):
+    return asyncio.run(gw.run(attempt, endpoint="test", key_parts=("prompt",), **options))
+
+
+def sleeping(seconds: float, result: str = "ok"):
+    async def attempt(timeout: float) -> str:
+        await asyncio.sleep(seconds)
+        return result
+    return attempt
+
+
+def failing(code: int):
+    async def attempt(timeout: float) -> str:
+        raise UpstreamError(code)
+    return attempt
+
+
+def test_upstream_timeout_counts_against_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    with pytest.raises(LLMTimeoutError) as raised:
+        run(gateway(breaker, timeout=0.05), sleeping(1))
+    assert not isinstance(raised.value, LLMDeadlineError)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_deadline_expiry_does_not_count_against_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    with pytest.raises(LLMDeadlineError):
+        run(gateway(breaker, timeout=10), sleeping(1), deadline=deadline_after(0.05))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_spent_deadline_fails_without_calling_upstream():
+    calls = []
+
+    async def attempt(timeout: float) -> str:
+        calls.append(timeout)
+        return "ok"
+
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    with pytest.raises(LLMTimeoutError):
+        run(gateway(breaker), attempt, deadline=time.monotonic() - 1)
+    assert calls == []
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_queue_timeout_does_not_count_against_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    gw = gateway(breaker, max_concurrency=1, timeout=10)
+
+    async def scenario():
+        slow = asyncio.ensure_future(gw.run(sleeping(0.3), endpoint="test", key_parts=("slow",)))
+        await asyncio.sleep(0.05)
+        try:
+            with pytest.raises(LLMQueueTimeoutError):
+                await gw.run(sleeping(0), endpoint="test", key_parts=("queued",), deadline=deadline_after(0.05))
+        finally:
+            await slow
+
+    asyncio.run(scenario())
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_client_errors_are_not_retried_and_close_the_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    gw = gateway(breaker, max_retries=3)
+    with pytest.raises(UpstreamError):
+        run(gw, failing(400))
+    assert gw.stats["attempts"] == 1
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_overload_is_retried_until_success():
+    responses = [UpstreamError(503), UpstreamError(429), "ok"]
+
+    async def attempt(timeout: float) -> str:
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    gw = gateway(CircuitBreaker("test"), max_retries=3)
+    assert run(gw, attempt) == "ok"
+    assert gw.stats["retries"] == 2
+
+
+def test_half_open_trial_is_released_after_deadline_expiry():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    gw = gateway(breaker, timeout=10)
+    with pytest.raises(LLMDeadlineError):
+        run(gw, sleeping(1), deadline=deadline_after(0.05))
+    # The trial proved nothing, so the next call is admitted as a new trial
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert run(gw, sleeping(0)) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_breaker_rejects_without_calling_upstream():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        run(gateway(breaker), failing(500))
+
+
+def test_only_upstream_errors_are_retryable():
+    assert is_retryable(UpstreamError(503))
+    assert is_retryable(LLMTimeoutError("slow"))
+    assert not is_retryable(UpstreamError(400))
+    assert not is_retryable(LLMDeadlineError("late"))
+    assert not is_retryable(LLMQueueTimeoutError("busy"))
+
+
+@pytest.mark.parametrize("header", ["0", "-1", "abc", "nan", "inf"])
+def test_request_deadline_rejects_invalid_timeouts(header):
+    with pytest.raises(HTTPException) as raised:
+        request_deadline(header, default=120)
+    assert raised.value.status_code == 400
+
+
+def test_request_deadline_is_clamped():
+    now = time.monotonic()
+    assert request_deadline("0.01", default=120) - now == pytest.approx(MIN_REQUEST_TIMEOUT, abs=0.5)
+    assert request_deadline("600", default=120) - now == pytest.approx(120, abs=0.5)
+    assert request_deadline(None, default=30) - now == pytest.approx(30, abs=0.5)
@@ -0,0 +1,111 @@
+import sys
+
+import pytest
+
+from ai_common.text_store import TextStore, available_codecs, compress_text, decompress_text
+
+
+def text(size: int, seed: str = "a") -> str:
+    return (seed + " lorem ipsum dolor sit amet\n") * (size // 28)
+
+
+def test_texts_round_trip_compressed():
+    store = TextStore(hot_ratio=0)
+    store.put("doc", text(10000))
+    assert store.get("doc") == text(10000)
+    assert store.length("doc") == len(text(10000))
+    snapshot = store.snapshot()
+    assert snapshot["stored_bytes"] < snapshot["raw_bytes"]
+    assert snapshot["hot_entries"] == 0
+    assert snapshot["resident_bytes"] == snapshot["stored_bytes"]
+
+
+def test_uncompressed_store_keeps_texts_as_is():
+    store = TextStore(codec=None)
+    store.put("doc", "plain")
+    assert store.get("doc") == "plain"
+    assert store.snapshot()["hot_entries"] == 0
+
+
+def test_hot_bytes_follow_reads_and_evictions():
+    store = TextStore(hot_ratio=0.5, hot_min_bytes=0)
+    for key in "abcd":
+        store.put(key, text(10000, key))
+    size = sys.getsizeof(text(10000, "a"))
+
+    for key in "ab":
+        store.get(key)
+    snapshot = store.snapshot()
+    assert snapshot["hot_entries"] == 2
+    assert snapshot["hot_bytes"] == 2 * size
+    assert snapshot["hot_bytes"] <= snapshot["hot_limit_bytes"]
+
+    # A third text does not fit in half of four: the least recently read goes
+    store.get("c")
+    snapshot = store.snapshot()
+    assert snapshot["hot_entries"] == 2
+    assert snapshot["hot_bytes"] == 2 * size
+    assert store.stats["misses"] == 3
+
+    store.get("b")
+    assert store.stats["hits"] == 1
+
+
+def test_discard_shrinks_the_hot_budget():
+    store = TextStore(hot_ratio=0.5, hot_min_bytes=0)
+    for key in "abcd":
+        store.put(key, text(10000, key))
+    store.get("a")
+    store.get("b")
+    store.discard("c")
+    store.discard("d")
+    snapshot = store.snapshot()
+    assert "c" not in store
+    assert snapshot["entries"] == 2
+    assert snapshot["hot_entries"] == 1
+    assert snapshot["hot_bytes"] <= snapshot["hot_limit_bytes"]
+
+
+def test_replacing_a_text_drops_its_hot_copy():
+    store = TextStore(hot_ratio=1, hot_min_bytes=0)
+    store.put("doc", text(1000, "a"))
+    store.get("doc")
+    store.put("doc", text(1000, "b"))
+    assert store.snapshot()["hot_bytes"] == 0
+    assert store.get("doc") == text(1000, "b")
+
+
+def test_hot_floor_keeps_a_single_large_text_hot():
+    store = TextStore(hot_ratio=0.25, hot_min_bytes=1024 * 1024)
+    store.put("doc", text(200000))
+    store.get("doc")
+    store.get("doc")
+    snapshot = store.snapshot()
+    assert snapshot["hot_limit_bytes"] == 1024 * 1024
+    assert snapshot["hot_entries"] == 1
+    assert store.stats == {"hits": 1, "misses": 1, "decompressed_bytes": snapshot["stored_bytes"]}
+
+
+def test_text_over_the_budget_is_never_hot():
+    store = TextStore(hot_ratio=0.25, hot_min_bytes=1024)
+    store.put("doc", text(200000))
+    store.get("doc")
+    assert store.snapshot()["hot_bytes"] == 0
+
+
+def test_zero_ratio_disables_the_hot_cache_despite_the_floor():
+    store = TextStore(hot_ratio=0, hot_min_bytes=1024 * 1024)
+    store.put("doc", text(1000))
+    store.get("doc")
+    assert store.snapshot()["hot_limit_bytes"] == 0
+    assert store.snapshot()["hot_entries"] == 0
+
+
+def test_missing_key_raises():
+    with pytest.raises(KeyError):
+        TextStore().get("missing")
+
+
+@pytest.mark.parametrize("codec", available_codecs())
+def test_compressed_bytes_name_their_codec(codec):
+    assert decompress_text(compress_text("héllo", codec)) == "héllo"
@@ -0,0 +1,109 @@
+"""
+Fast check for a text layer before a full PDF parse.
+
+Scanned lecture notes are image-only: every page is a picture, so a full
+parse walks every page only to come back empty. ``probe_text_layer`` opens the
+document, samples a few pages spread across it (first, last and evenly in
+between) and looks for text-showing operators (``Tj``, ``TJ``, ``'``, ``"``
+inside a ``BT``/``ET`` block) in their content streams, including form
+XObjects the page draws. Only the sampled streams are decoded, so the check
+takes milliseconds regardless of document size.
+
+A document is treated as image-only when none of the sampled pages shows
+text; PDFs with an OCR text layer pass, since OCR text is drawn with the same
+operators (in invisible render mode).
+"""
+
+import importlib.util
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from ai_common.pdf_backends import PDFSource, open_source
+
+# BT starts a text object; a string or array operand followed by a show operator draws text
+_BEGIN_TEXT_RE = re.compile(rb"(?<![\w/])BT(?!\w)")
+_SHOW_TEXT_RE = re.compile(rb"[)>\]]\s*(?:Tj|TJ|'|\")(?!\w)")
+
+# Form XObjects nested deeper than this are not inspected
+MAX_FORM_DEPTH = 2
+
+
+@dataclass
+class ProbeResult:
+    page_count: int
+    sampled: List[int] = field(default_factory=list)
+    text_page: Optional[int] = None
+
+    @property
+    def has_text(self) -> bool:
+        return self.text_page is not None or self.page_count == 0
+
+
+def sample_pages(page_count: int, samples: int) -> List[int]:
+    """Up to ``samples`` page indexes spread evenly from the first to the last page"""
+    if samples <= 0 or page_count <= 0:
+        return []
+    if page_count <= samples:
+        return list(range(page_count))
+    if samples == 1:
+        return [0]
+    step = (page_count - 1) / (samples - 1)
+    return sorted({round(i * step) for i in range(samples)})
+
+
+def shows_text(data: bytes) -> bool:
+    """True when a content stream contains a text object that draws a string"""
+    return bool(_BEGIN_TEXT_RE.search(data) and _SHOW_TEXT_RE.search(data))
+
+
+def _forms_show_text(resources, depth: int) -> bool:
+    if resources is None or depth > MAX_FORM_DEPTH:
+        return False
+    resources = resources.get_object()
+    xobjects = resources.get("/XObject")
+    if xobjects is None:
+        return False
+    for xobject in xobjects.get_object().values():
+        xobject = xobject.get_object()
+        if xobject.get("/Subtype") != "/Form":
+            continue
+        if shows_text(xobject.get_data()) or _forms_show_text(xobject.get("/Resources"), depth + 1):
+            return True
+    return False
+
+
+def page_shows_text(page) -> bool:
+    contents = page.get_contents()
+    if contents is not None and shows_text(contents.get_data()):
+        return True
+    return _forms_show_text(page.get("/Resources"), 1)
+
+
+def _reader(stream):
+    # Content streams are read with the pypdf family whatever the extraction
+    # backend; PyPDF2 is always installed
+    if importlib.util.find_spec("pypdf") is not None:
+        import pypdf
+
+        return pypdf.PdfReader(stream)
+    import PyPDF2
+
+    return PyPDF2.PdfReader(stream)
+
+
+def probe_text_layer(source: PDFSource, samples: int = 5) -> ProbeResult:
+    """
+    Sample ``samples`` pages of a PDF (bytes or a file path) for a text layer.
+    Raises the reader's own errors for encrypted or malformed PDFs.
+    """
+    with open_source(source) as stream:
+        reader = _reader(stream)
+        page_count = len(reader.pages)
+        result = ProbeResult(page_count=page_count, sampled=sample_pages(page_count, samples))
+        for index in result.sampled:
+            # One page with text is enough to go ahead with the full parse
+            if page_shows_text(reader.pages[index]):
+                result.text_page = index
+                break
+        return result
@@ -0,0 +1,194 @@
+"""
+Compressed at-rest storage for extracted text.
+
+A textbook's extracted text is several megabytes as a Python ``str`` (up to
+four bytes per character once it holds non-Latin text), and most knowledge
+bases sit idle between questions. ``TextStore`` keeps each text compressed
+(zstd when the ``zstandard`` package is installed, zlib otherwise) and
+decompresses it on demand into a small LRU of hot entries, so only the
+knowledge bases being queried hold their text in the clear. The LRU is
+bounded by bytes: ``hot_ratio`` of the stored texts' total size in the clear,
+so it cannot undo the compression of many texts, but at least
+``hot_min_bytes``, so a deployment with a few large knowledge bases still
+keeps the one being queried hot. A text larger than the budget is
+decompressed for each read. Extracted text typically compresses 3-5x.
+
+``compress_text`` and ``decompress_text`` are also used by the extraction
+cache, so text is compressed on disk as well; ``decompress_text`` recognizes
+the codec from the data, so entries written by a service with a different
+codec still read back.
+"""
+
+import os
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+# Smallest hot LRU budget, so a single large text can stay decompressed
+HOT_MIN_BYTES = 16 * 1024 * 1024
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def available_codecs():
+    return ["zstd", "zlib"] if zstandard is not None else ["zlib"]
+
+
+def compress_text(text: str, codec: str = "zlib") -> bytes:
+    data = text.encode("utf-8")
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress_text(data: bytes) -> str:
+    """Text from ``compress_text``, whichever codec wrote it"""
+    if data.startswith(_ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError("zstd-compressed text, but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+class TextStore:
+    """
+    Texts by key, compressed unless ``codec`` is None; the most recently
+    read are kept decompressed, up to ``hot_ratio`` of the total size of all
+    texts in the clear or ``hot_min_bytes``, whichever is larger (nothing
+    when ``hot_ratio`` is 0). Thread safe.
+    """
+
+    def __init__(self, codec: Optional[str] = "zlib", hot_ratio: float = 0.25, hot_min_bytes: int = HOT_MIN_BYTES):
+        self.codec = codec
+        self.hot_ratio = hot_ratio
+        self.hot_min_bytes = hot_min_bytes
+        self._entries: Dict[str, Union[bytes, str]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._raw_bytes: Dict[str, int] = {}
+        self._raw_total = 0
+        self._hot: "OrderedDict[str, str]" = OrderedDict()
+        self._hot_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "decompressed_bytes": 0}
+
+    def put(self, key: str, text: str) -> None:
+        """Store ``text``; CPU bound for long texts, call it off the event loop"""
+        entry = compress_text(text, self.codec) if self.codec else text
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = entry
+            self._lengths[key] = len(text)
+            self._raw_bytes[key] = sys.getsizeof(text)
+            self._raw_total += self._raw_bytes[key]
+
+    def _hot_limit(self) -> int:
+        if self.hot_ratio <= 0:
+            return 0
+        return max(int(self.hot_ratio * self._raw_total), self.hot_min_bytes)
+
+    def _drop_hot(self, key: str) -> None:
+        if self._hot.pop(key, None) is not None:
+            self._hot_bytes -= self._raw_bytes[key]
+
+    def _forget(self, key: str) -> None:
+        """Remove ``key`` and shrink the hot LRU to the smaller budget; call with the lock held"""
+        self._drop_hot(key)
+        self._entries.pop(key, None)
+        self._lengths.pop(key, None)
+        self._raw_total -= self._raw_bytes.pop(key, 0)
+        while self._hot and self._hot_bytes > self._hot_limit():
+            self._drop_hot(next(iter(self._hot)))
+
+    def get(self, key: str) -> str:
+        """The text stored under ``key``; raises ``KeyError`` when there is none"""
+        with self._lock:
+            entry = self._entries[key]
+            if isinstance(entry, str):
+                return entry
+            text = self._hot.get(key)
+            if text is not None:
+                self._hot.move_to_end(key)
+                self.stats["hits"] += 1
+                return text
+            self.stats["misses"] += 1
+        text = decompress_text(entry)
+        with self._lock:
+            self.stats["decompressed_bytes"] += len(entry)
+            size = self._raw_bytes.get(key, 0)
+            # Dropped while decompressing: do not resurrect it
+            if self._entries.get(key) is entry and key not in self._hot and size <= self._hot_limit():
+                while self._hot and self._hot_bytes + size > self._hot_limit():
+                    self._drop_hot(next(iter(self._hot)))
+                self._hot[key] = text
+                self._hot_bytes += size
+        return text
+
+    def length(self, key: str) -> int:
+        """Characters in the text under ``key``, without decompressing it"""
+        return self._lengths.get(key, 0)
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._forget(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            raw = sum(self._raw_bytes.values())
+            stored = sum(
+                len(entry) if isinstance(entry, bytes) else sys.getsizeof(entry)
+                for entry in self._entries.values()
+            )
+            hot, hot_limit = self._hot_bytes, self._hot_limit()
+            entries, hot_count = len(self._entries), len(self._hot)
+            stats = dict(self.stats)
+        return {
+            "codec": self.codec,
+            "entries": entries,
+            "hot_entries": hot_count,
+            "hot_bytes": hot,
+            "hot_limit_bytes": hot_limit,
+            "raw_bytes": raw,
+            "stored_bytes": stored,
+            "resident_bytes": stored + hot,
+            "compression_ratio": round(raw / stored, 2) if stored else None,
+            "resident_ratio": round(raw / (stored + hot), 2) if stored else None,
+            **stats
+        }
+
+
+def text_codec_from_env() -> Optional[str]:
+    """
+    Codec for text at rest (TEXT_COMPRESSION: ``auto``, ``zstd``, ``zlib`` or
+    ``off``); ``auto`` prefers zstd when installed, None means uncompressed
+    """
+    codec = os.getenv("TEXT_COMPRESSION", "auto").lower()
+    if codec in ("off", "false", "0", "none"):
+        return None
+    if codec == "auto" or codec not in available_codecs():
+        return available_codecs()[0]
+    return codec
+
+
+def text_store_from_env() -> TextStore:
+    """
+    A store using TEXT_COMPRESSION that keeps recently read texts
+    decompressed up to TEXT_HOT_RATIO of their total size (``0`` disables),
+    but at least TEXT_HOT_MIN_BYTES
+    """
+    return TextStore(
+        text_codec_from_env(),
+        max(0.0, float(os.getenv("TEXT_HOT_RATIO", "0.25"))),
+        max(0, int(os.getenv("TEXT_HOT_MIN_BYTES", str(HOT_MIN_BYTES)))),
+    )
@@ -0,0 +1,188 @@
+"""
+Streaming, size-limited PDF uploads.
+
+Upload endpoints used to ``await file.read()`` the whole PDF into memory and
+then copy it again into a ``BytesIO`` for parsing, with no size cap. The
+multipart parser has already spooled the upload (in memory up to 1 MB, then
+in a temporary file), so ``spool_upload`` works on that file in place:
+
+- the SHA-256 is computed in chunks, so deduplication needs no second pass,
+  and uploads over the size limit are rejected with ``413`` as soon as the
+  limit is crossed; ``UploadSizeLimitMiddleware`` rejects requests whose
+  declared or streamed body is too large before the multipart parser reads it;
+- the spooled file is wrapped rather than copied, and taken over from the
+  ``UploadFile``, so it stays open for background ingestion after the request.
+
+``SpooledUpload.source()`` is what the extraction pool accepts: bytes for an
+in-memory upload, or a path to the spooled file, which the worker parses
+through a memory map rather than a copied buffer.
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Optional, Union
+
+from fastapi import HTTPException, UploadFile
+
+MB = 1024 * 1024
+UPLOAD_READ_CHUNK = 1024 * 1024
+# Room for multipart boundaries and the other form fields next to the file
+FORM_OVERHEAD = 64 * 1024
+
+
+def max_upload_bytes() -> int:
+    return int(float(os.getenv("UPLOAD_MAX_MB", "50")) * MB)
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File too large; the limit is {limit / MB:g} MB")
+
+
+def _in_memory(file: BinaryIO) -> bool:
+    # SpooledTemporaryFile._rolled is False until the file moves to disk
+    return isinstance(file, io.BytesIO) or getattr(file, "_rolled", True) is False
+
+
+def _file_path(file: BinaryIO) -> Optional[str]:
+    """A path another process can open the on-disk ``file`` by, if there is one"""
+    name = getattr(file, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return name
+    try:
+        # Unnamed temporary files are still reachable through /proc on Linux
+        path = f"/proc/{os.getpid()}/fd/{file.fileno()}"
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    return path if os.path.exists(path) else None
+
+
+class SpooledUpload:
+    """
+    An uploaded file, hashed and size-checked; closes it on ``close``. A
+    file without a path another process can open is copied into a named
+    temporary file by ``spool_upload``.
+    """
+
+    def __init__(self, file: BinaryIO, size: int, sha256: str):
+        self.file = file
+        self.size = size
+        self.sha256 = sha256
+        self._copy = None
+
+    @property
+    def in_memory(self) -> bool:
+        return self._copy is None and _in_memory(self.file)
+
+    @property
+    def path(self) -> Optional[str]:
+        if self._copy is not None:
+            return self._copy.name
+        return None if _in_memory(self.file) else _file_path(self.file)
+
+    def _copy_to_named_file(self) -> None:
+        self._copy = tempfile.NamedTemporaryFile(prefix="upload-", suffix=".pdf", delete=False)
+        self.file.seek(0)
+        shutil.copyfileobj(self.file, self._copy, UPLOAD_READ_CHUNK)
+        self._copy.close()
+
+    def source(self) -> Union[bytes, str]:
+        """Bytes for an in-memory upload, otherwise the spooled file's path"""
+        path = self.path
+        if path is not None:
+            return path
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self) -> None:
+        self.file.close()
+        if self._copy is not None:
+            try:
+                os.unlink(self._copy.name)
+            except FileNotFoundError:
+                pass
+            self._copy = None
+
+    def __enter__(self) -> "SpooledUpload":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _hash_file(file: BinaryIO, max_bytes: int) -> SpooledUpload:
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    while True:
+        chunk = file.read(UPLOAD_READ_CHUNK)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise _too_large(max_bytes)
+        digest.update(chunk)
+    file.seek(0)
+    return SpooledUpload(file, size, digest.hexdigest())
+
+
+async def spool_upload(file: UploadFile, max_bytes: Optional[int] = None) -> SpooledUpload:
+    """
+    Hash ``file``'s spooled data in place and take it over as a
+    ``SpooledUpload``. Raises ``413`` as soon as more than ``max_bytes``
+    (UPLOAD_MAX_MB) are read.
+    """
+    max_bytes = max_bytes or max_upload_bytes()
+    spooled = file.file
+    if _in_memory(spooled):
+        upload = _hash_file(spooled, max_bytes)
+    else:
+        upload = await asyncio.to_thread(_hash_file, spooled, max_bytes)
+        if upload.path is None:
+            try:
+                await asyncio.to_thread(upload._copy_to_named_file)
+            except BaseException:
+                upload.close()
+                raise
+    # The request closes its UploadFile when it ends; the upload may be
+    # ingested in the background after that
+    file.file = io.BytesIO()
+    return upload
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware that rejects oversized request bodies with ``413`` before
+    they are parsed: first by ``Content-Length``, then by counting streamed
+    bytes for chunked requests. The error is raised as an ``HTTPException`` from
+    the body stream, so each service's own error format applies.
+    """
+
+    def __init__(self, app, max_bytes: Optional[int] = None):
+        self.app = app
+        self.max_bytes = max_bytes or max_upload_bytes()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.max_bytes + FORM_OVERHEAD
+        declared = dict(scope.get("headers") or []).get(b"content-length")
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            if declared is not None and declared.isdigit() and int(declared) > limit:
+                raise _too_large(self.max_bytes)
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _too_large(self.max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -1,5 +1,10 @@
 import PyPDF2
 import os
+import sys
+
+# Shared text compaction lives in ai_common at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from ai_common.compaction import compact_pages
 
 def extract_text_from_pdf(file_path):
     """Extract text from a PDF file.
@@ -29,14 +34,14 @@ def extract_text_from_pdf(file_path):
                 print(f"Error: PDF file {file_path} has no pages")
                 return ""
                 
-            text = ""
+            pages = []
             total_text_length = 0
             for page_num, page in enumerate(reader.pages):
                 try:
                     page_text = page.extract_text()
                     if not page_text.strip():
                         print(f"Warning: Page {page_num + 1} appears to be empty or unreadable")
-                    text += page_text + "\n"
+                    pages.append(page_text)
                     total_text_length += len(page_text)
                     print(f"Extracted {len(page_text)} characters from page {page_num + 1}")
                 except Exception as e:
@@ -46,7 +51,11 @@ def extract_text_from_pdf(file_path):
             print(f"Total extracted text length: {total_text_length} characters")
             if total_text_length == 0:
                 print("Warning: No text was extracted from the PDF")
-            return text
+            
+            # Strip repeated headers/footers, hyphenation and extra whitespace
+            compaction = compact_pages(pages)
+            print(f"Compaction removed {compaction.tokens_saved} of {compaction.tokens_before} tokens")
+            return compaction.text
             
     except PyPDF2.PdfReadError as e:
         print(f"Error reading PDF file {file_path}: {str(e)}")
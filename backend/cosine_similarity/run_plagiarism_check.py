@@ -1,21 +1,18 @@
 import sys
 import os
 import re
-import PyPDF2
 import nltk
 import ssl
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 
-# Configure SSL for NLTK downloads
-ssl._create_default_https_context = ssl._create_unverified_context
-
-# Download required NLTK data
-nltk.download('punkt')
-nltk.download('stopwords')
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 
+# Shared extraction code lives in ai_common at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from ai_common.extraction_sandbox import extract_text_sandboxed
+
 def extract_text_from_pdf(file_path):
     """Extract text from a PDF file.
     
@@ -34,27 +31,26 @@ def extract_text_from_pdf(file_path):
             print(f"Error: File {file_path} is not a PDF file")
             return ""
             
-        with open(file_path, "rb") as file:
-            reader = PyPDF2.PdfReader(file)
-            
-            if len(reader.pages) == 0:
-                print(f"Error: PDF file {file_path} has no pages")
-                return ""
-                
-            text = ""
-            for page_num, page in enumerate(reader.pages):
-                try:
-                    page_text = page.extract_text()
-                    text += page_text + "\n"
-                except Exception as e:
-                    print(f"Error extracting text from page {page_num + 1}: {str(e)}")
-                    continue
-            
-            return text
+        # Parsed in a resource-limited child process, so a malicious or broken
+        # submission cannot hang or exhaust the plagiarism check
+        result = extract_text_sandboxed(file_path)
+        
+        if result.failure:
+            print(f"Error reading PDF file {file_path} ({result.failure}): {result.error}")
+            if result.pages:
+                print(f"Using partial text from {len(result.pages)} of {result.page_count or '?'} pages")
+            return result.text
+        
+        if result.page_count == 0:
+            print(f"Error: PDF file {file_path} has no pages")
+            return ""
+        
+        if result.compaction is not None:
+            print(f"Compaction removed {result.compaction.tokens_saved} of "
+                  f"{result.compaction.tokens_before} tokens from {file_path}")
+        
+        return result.text
             
-    except PyPDF2.PdfReadError as e:
-        print(f"Error reading PDF file {file_path}: {str(e)}")
-        return ""
     except Exception as e:
         print(f"Unexpected error processing PDF file {file_path}: {str(e)}")
         return ""
@@ -207,4 +203,10 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    # Configure SSL for NLTK downloads
+    ssl._create_default_https_context = ssl._create_unverified_context
+
+    # Download required NLTK data (only when run as a script, not on import)
+    nltk.download('punkt')
+    nltk.download('stopwords')
     main()
\ No newline at end of file
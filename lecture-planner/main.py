@@ -1,27 +1,69 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import google.generativeai as genai
 from dotenv import load_dotenv
+import asyncio
+from contextlib import asynccontextmanager
 import os
-import PyPDF2
-import io
+import sys
 from datetime import datetime, timedelta
 import json
 from typing import Optional
 
+# Make the shared ai_common package importable from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ai_common.context import budget_from_env, char_budget, counter_from_env, pack_context
+from ai_common.digest import digest_prompts_from_env, digest_store_from_env
+from ai_common.extraction import (
+    ExtractionQueueFullError, PDFExtractionError, PDFSource, executor_from_env
+)
+from ai_common.health import CircuitOpenError, monitor_from_env
+from ai_common.llm_gateway import LLMTimeoutError, gateway_from_env, request_deadline
+from ai_common.uploads import SpooledUpload, UploadSizeLimitMiddleware, spool_upload
+
 # Load environment variables
 load_dotenv()
 
 # Configure Gemini AI
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel('gemini-1.5-flash')
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+# Background upstream probe shared with /health and the generation circuit breaker
+gemini_monitor = monitor_from_env("gemini", GEMINI_MODEL)
+
+# Token budget for PDF content sent with each lecture plan prompt
+LECTURE_PLAN_CONTEXT_TOKENS = budget_from_env("LECTURE_PLAN_CONTEXT_TOKENS", 2000)
+token_counter = counter_from_env(GEMINI_MODEL)
+
+# All generation goes through one async gateway: reused client, concurrency
+# limit, timeouts, retries, circuit breaker and single-flight coalescing
+llm_gateway = gateway_from_env(GEMINI_MODEL, breaker=gemini_monitor.breaker)
+
+# PDF parsing runs in sandboxed child processes so it never blocks the event loop
+extraction_executor = executor_from_env()
+
+# Documents are condensed once into a digest (outline, key terms, summary)
+# shared with the other services; prompts use it instead of raw text
+DIGEST_PROMPTS = digest_prompts_from_env()
+digest_store = digest_store_from_env(extraction_executor.version)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the background services with the app and stop them on shutdown"""
+    gemini_monitor.start()
+    try:
+        yield
+    finally:
+        await gemini_monitor.stop()
+        extraction_executor.shutdown()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Lecture Plan Generator",
     description="An AI-powered lecture plan generator that creates comprehensive lecture plans from PDF knowledge bases",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -33,20 +75,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def extract_text_from_pdf(pdf_file) -> str:
-    """Extract text content from uploaded PDF file"""
+# Reject oversized uploads (UPLOAD_MAX_MB) before the multipart body is parsed
+app.add_middleware(UploadSizeLimitMiddleware)
+
+async def extract_text_from_pdf(source: PDFSource, content_hash: Optional[str] = None,
+                                max_chars: Optional[int] = None) -> str:
+    """Extract text content from an uploaded PDF in a sandboxed extraction process (or the shared cache)"""
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
+        # Keep the pages read before a parse failure
+        return await extraction_executor.extract(
+            source, content_hash=content_hash, allow_partial=True, max_chars=max_chars
+        )
+    except ExtractionQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except PDFExtractionError as e:
+        # Documents that exhaust the sandbox limits are unprocessable rather than malformed
+        status_code = 422 if e.kind in ("timeout", "oom") else 400
+        raise HTTPException(status_code=status_code, detail=f"Error reading PDF ({e.kind}): {str(e)}")
+
+async def document_context(upload: SpooledUpload) -> str:
+    """
+    Text the lecture plan is generated from: the opening text of the document, or,
+    when DIGEST_PROMPTS is on, its digest if another service (rag-server
+    ingestion) has already built one. Digests are never built here, since
+    that would mean parsing the whole PDF within the request.
+    """
+    if DIGEST_PROMPTS:
+        digest = await digest_store.lookup(upload.sha256)
+        if digest is not None and not digest.empty:
+            return digest.to_prompt()
+    # Only the start of the document fits in the prompt, so stop parsing pages
+    # once enough text has been collected to fill the budget
+    return await extract_text_from_pdf(upload.source(), upload.sha256, max_chars=char_budget(LECTURE_PLAN_CONTEXT_TOKENS))
 
 def generate_lecture_plan_prompt(pdf_content: str, course_name: str, instructor: str, 
                                 lecture_date: str, lecture_time: str) -> str:
     """Generate the prompt for Gemini AI"""
+    # Fit the PDF content into the token budget, cutting at sentence boundaries
+    context = pack_context(pdf_content, LECTURE_PLAN_CONTEXT_TOKENS, counter=token_counter).text
     return f"""
     Based on the following PDF content, generate a comprehensive lecture plan in JSON format.
     
@@ -57,7 +123,7 @@ def generate_lecture_plan_prompt(pdf_content: str, course_name: str, instructor:
     - Lecture Time: {lecture_time}
     
     PDF Content:
-    {pdf_content[:8000]}  # Limit content to avoid token limits
+    {context}
     
     Please generate a lecture plan in the following JSON format:
     {{
@@ -124,14 +190,32 @@ async def root():
         "endpoints": {
             "/generate-lecture-plan": "POST - Generate lecture plan from PDF",
             "/health": "GET - Health check",
+            "/metrics": "GET - Runtime counters",
             "/docs": "GET - API documentation"
         }
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Runtime counters, including generation requests coalesced onto an in-flight call"""
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "llm_gateway": llm_gateway.snapshot(),
+        "pdf_extraction": extraction_executor.snapshot(),
+        "digests": digest_store.snapshot(),
+        "llm_single_flight": llm_gateway.flights.snapshot()
+    }
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    """Health check endpoint, answered from the cached background Gemini probe"""
+    gemini = gemini_monitor.snapshot()
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "gemini_ai_status": gemini["status"],
+        "gemini_ai": gemini
+    }
 
 @app.post("/generate-lecture-plan")
 async def generate_lecture_plan(
@@ -139,7 +223,8 @@ async def generate_lecture_plan(
     course_name: str = Form(..., description="Name of the course"),
     instructor: str = Form(..., description="Name of the instructor"),
     lecture_date: str = Form(..., description="Date of the lecture (YYYY-MM-DD)"),
-    lecture_time: str = Form(..., description="Time of the lecture (e.g., '10:00 AM - 12:00 PM')")
+    lecture_time: str = Form(..., description="Time of the lecture (e.g., '10:00 AM - 12:00 PM')"),
+    x_request_timeout: Optional[str] = Header(None, description="Optional deadline for generation, in seconds")
 ):
     """
     Generate a comprehensive lecture plan from uploaded PDF content.
@@ -154,25 +239,32 @@ async def generate_lecture_plan(
     
     try:
         # Read and extract text from PDF
-        pdf_content = await pdf_file.read()
-        pdf_file_obj = io.BytesIO(pdf_content)
-        extracted_text = extract_text_from_pdf(pdf_file_obj)
+        with await spool_upload(pdf_file) as upload:
+            extracted_text = await document_context(upload)
         
         if not extracted_text.strip():
             raise HTTPException(status_code=400, detail="No text content found in PDF")
         
-        # Generate prompt for AI
-        prompt = generate_lecture_plan_prompt(
-            extracted_text, course_name, instructor, lecture_date, lecture_time
+        # Generate prompt for AI; packing may call the token counting API, so
+        # it runs off the event loop
+        prompt = await asyncio.to_thread(
+            generate_lecture_plan_prompt, extracted_text, course_name, instructor, lecture_date, lecture_time
         )
         
         # Generate lecture plan using Gemini AI
-        response = model.generate_content(prompt)
+        try:
+            raw_response = await llm_gateway.generate(
+                prompt, endpoint="generate-lecture-plan", deadline=request_deadline(x_request_timeout)
+            )
+        except CircuitOpenError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except LLMTimeoutError as e:
+            raise HTTPException(status_code=504, detail=str(e))
         
         # Parse the response
         try:
             # Clean the response text
-            response_text = response.text.strip()
+            response_text = raw_response.strip()
             if response_text.startswith('```json'):
                 response_text = response_text[7:]
             if response_text.endswith('```'):
@@ -193,9 +285,11 @@ async def generate_lecture_plan(
         except json.JSONDecodeError as e:
             raise HTTPException(
                 status_code=500, 
-                detail=f"Error parsing AI response: {str(e)}. Response: {response.text[:200]}..."
+                detail=f"Error parsing AI response: {str(e)}. Response: {raw_response[:200]}..."
             )
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating lecture plan: {str(e)}")
 
@@ -1,32 +1,75 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Request
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Header, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import asyncio
+from contextlib import asynccontextmanager
 import os
+import sys
 import tempfile
 import json
 from typing import Optional
 from dotenv import load_dotenv
 import google.generativeai as genai
-import PyPDF2
-from io import BytesIO
 from pydantic import BaseModel
 from typing import List, Dict
 import jwt
 from datetime import datetime
 
+# Make the shared ai_common package importable from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ai_common.context import budget_from_env, char_budget, counter_from_env, pack_context
+from ai_common.digest import digest_prompts_from_env, digest_store_from_env
+from ai_common.extraction import (
+    ExtractionQueueFullError, PDFExtractionError, PDFSource, executor_from_env
+)
+from ai_common.health import CircuitOpenError, monitor_from_env
+from ai_common.llm_gateway import LLMTimeoutError, gateway_from_env, request_deadline
+from ai_common.uploads import SpooledUpload, UploadSizeLimitMiddleware, spool_upload
+
 # Load environment variables
 load_dotenv()
 
 # Configure Gemini AI
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+# Background upstream probe shared with /health and the generation circuit breaker
+gemini_monitor = monitor_from_env("gemini", GEMINI_MODEL)
+
+# Token budget for PDF text sent with each question generation prompt
+MCQ_CONTEXT_TOKENS = budget_from_env("MCQ_CONTEXT_TOKENS", 1000)
+token_counter = counter_from_env(GEMINI_MODEL)
+
+# All generation goes through one async gateway: reused client, concurrency
+# limit, timeouts, retries, circuit breaker and single-flight coalescing
+llm_gateway = gateway_from_env(GEMINI_MODEL, breaker=gemini_monitor.breaker)
+
+# PDF parsing runs in sandboxed child processes so it never blocks the event loop
+extraction_executor = executor_from_env()
+
+# Documents are condensed once into a digest (outline, key terms, summary)
+# shared with the other services; prompts use it instead of raw text
+DIGEST_PROMPTS = digest_prompts_from_env()
+digest_store = digest_store_from_env(extraction_executor.version)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the background services with the app and stop them on shutdown"""
+    gemini_monitor.start()
+    try:
+        yield
+    finally:
+        await gemini_monitor.stop()
+        extraction_executor.shutdown()
 
 app = FastAPI(
     title="Question Generator Agent",
     description="An AI-powered agent that generates MCQ questions from PDF documents using Google's Gemini AI",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Security scheme for JWT
@@ -41,6 +84,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized uploads (UPLOAD_MAX_MB) before the multipart body is parsed
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # Authentication middleware
 def authenticate_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """
@@ -102,31 +148,55 @@ class GenerateQuestionsRequest(BaseModel):
     test_title: Optional[str] = "Generated MCQ Test"
 
 # Helper function to extract text from PDF
-def extract_text_from_pdf(pdf_file: bytes) -> str:
+async def extract_text_from_pdf(source: PDFSource, content_hash: Optional[str] = None,
+                                max_chars: Optional[int] = None) -> str:
     """
-    Extract text content from PDF file
+    Extract text content from PDF bytes or a spooled upload path in a
+    sandboxed extraction process, or from the shared extraction cache when any
+    service has parsed the same bytes before
     """
     try:
-        pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_file))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
+        # Keep the pages read before a parse failure
+        return await extraction_executor.extract(
+            source, content_hash=content_hash, allow_partial=True, max_chars=max_chars
+        )
+    except ExtractionQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except PDFExtractionError as e:
+        # Documents that exhaust the sandbox limits are unprocessable rather than malformed
+        status_code = 422 if e.kind in ("timeout", "oom") else 400
+        raise HTTPException(status_code=status_code, detail=f"Error reading PDF ({e.kind}): {str(e)}")
+
+async def document_context(upload: SpooledUpload) -> str:
+    """
+    Text the questions are generated from: the opening text of the document, or,
+    when DIGEST_PROMPTS is on, its digest if another service (rag-server
+    ingestion) has already built one. Digests are never built here, since
+    that would mean parsing the whole PDF within the request.
+    """
+    if DIGEST_PROMPTS:
+        digest = await digest_store.lookup(upload.sha256)
+        if digest is not None and not digest.empty:
+            return digest.to_prompt()
+    # Only the start of the document fits in the prompt, so stop parsing pages
+    # once enough text has been collected to fill the budget
+    return await extract_text_from_pdf(upload.source(), upload.sha256, max_chars=char_budget(MCQ_CONTEXT_TOKENS))
 
 # Helper function to generate questions using Gemini AI
-def generate_mcq_questions(text: str, num_questions: int = 5, difficulty: str = "medium", test_title: str = "Generated MCQ Test") -> dict:
+async def generate_mcq_questions(text: str, num_questions: int = 5, difficulty: str = "medium", test_title: str = "Generated MCQ Test",
+                                 deadline: Optional[float] = None) -> dict:
     """
     Generate MCQ questions from text using Gemini AI
     """
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        # Fit the text into the token budget, cutting at sentence boundaries;
+        # the counter may call the token counting API, so pack off the event loop
+        context = (await asyncio.to_thread(pack_context, text, MCQ_CONTEXT_TOKENS, counter=token_counter)).text
         
         prompt = f"""
         Based on the following text, generate {num_questions} multiple choice questions with {difficulty} difficulty level.
         
-        Text: {text[:4000]}  # Limit text to avoid token limits
+        Text: {context}
         
         Please generate questions that test understanding of the key concepts in the text.
         
@@ -156,10 +226,10 @@ def generate_mcq_questions(text: str, num_questions: int = 5, difficulty: str =
         5. Return valid JSON only, no additional text
         """
         
-        response = model.generate_content(prompt)
+        response_text = await llm_gateway.generate(prompt, endpoint="generate-questions", deadline=deadline)
         
         # Clean the response text
-        response_text = response.text.strip()
+        response_text = response_text.strip()
         
         # Remove markdown code blocks if present
         if response_text.startswith('```json'):
@@ -183,6 +253,12 @@ def generate_mcq_questions(text: str, num_questions: int = 5, difficulty: str =
             else:
                 raise HTTPException(status_code=500, detail=f"Failed to parse AI response as JSON: {str(e)}")
                 
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except LLMTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating questions: {str(e)}")
 
@@ -199,16 +275,39 @@ async def root():
             "/docs": "Interactive API documentation",
             "/redoc": "Alternative API documentation",
             "/generate-questions": "POST - Upload PDF and generate MCQ questions",
-            "/health": "GET - Health check endpoint"
+            "/health": "GET - Health check endpoint",
+            "/metrics": "GET - Runtime counters"
         }
     }
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Runtime counters for monitoring, including generation requests coalesced
+    onto an identical in-flight call
+    """
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "llm_gateway": llm_gateway.snapshot(),
+        "pdf_extraction": extraction_executor.snapshot(),
+        "digests": digest_store.snapshot(),
+        "llm_single_flight": llm_gateway.flights.snapshot()
+    }
+
 @app.get("/health")
 async def health_check():
     """
     Health check endpoint
+    
+    Answers from the cached background probe, so it never calls the model.
     """
-    return {"status": "healthy", "service": "Question Generator Agent"}
+    gemini = gemini_monitor.snapshot()
+    return {
+        "status": "healthy",
+        "service": "Question Generator Agent",
+        "gemini_ai_status": gemini["status"],
+        "gemini_ai": gemini
+    }
 
 @app.post("/generate-questions", response_model=MCQResponse)
 async def generate_questions(
@@ -216,7 +315,8 @@ async def generate_questions(
     num_questions: int = Form(5, description="Number of questions to generate (1-20)"),
     difficulty: str = Form("medium", description="Difficulty level: easy, medium, hard"),
     test_title: str = Form("Generated MCQ Test", description="Title for the test"),
-    current_user: dict = Depends(authenticate_token)
+    current_user: dict = Depends(authenticate_token),
+    x_request_timeout: Optional[str] = Header(None, description="Optional deadline for generation, in seconds")
 ):
     """
     Generate MCQ questions from uploaded PDF file (Teacher access only)
@@ -233,14 +333,16 @@ async def generate_questions(
     **Authorization**: Requires valid JWT token with 'teacher' role in Authorization header:
     `Authorization: Bearer <your_jwt_token>`
     """
-    return await _generate_questions_internal(file, num_questions, difficulty, test_title, current_user.get("user_id"))
+    return await _generate_questions_internal(file, num_questions, difficulty, test_title, current_user.get("user_id"),
+                                              deadline=request_deadline(x_request_timeout))
 
 @app.post("/generate-questions-public", response_model=MCQResponse)
 async def generate_questions_public(
     file: UploadFile = File(..., description="PDF file to extract content from"),
     num_questions: int = Form(5, description="Number of questions to generate (1-20)"),
     difficulty: str = Form("medium", description="Difficulty level: easy, medium, hard"),
-    test_title: str = Form("Generated MCQ Test", description="Title for the test")
+    test_title: str = Form("Generated MCQ Test", description="Title for the test"),
+    x_request_timeout: Optional[str] = Header(None, description="Optional deadline for generation, in seconds")
 ):
     """
     Generate MCQ questions from uploaded PDF file (Public endpoint for Streamlit)
@@ -254,14 +356,16 @@ async def generate_questions_public(
     
     Returns a JSON object with the test title and list of MCQ questions.
     """
-    return await _generate_questions_internal(file, num_questions, difficulty, test_title, "streamlit_user")
+    return await _generate_questions_internal(file, num_questions, difficulty, test_title, "streamlit_user",
+                                              deadline=request_deadline(x_request_timeout))
 
 async def _generate_questions_internal(
     file: UploadFile,
     num_questions: int,
     difficulty: str,
     test_title: str,
-    user_id: str = None
+    user_id: str = None,
+    deadline: Optional[float] = None
 ):
     """
     Internal function to generate questions (shared by both authenticated and public endpoints).
@@ -279,21 +383,20 @@ async def _generate_questions_internal(
         raise HTTPException(status_code=400, detail="Difficulty must be 'easy', 'medium', or 'hard'")
     
     try:
-        # Read PDF file
-        pdf_content = await file.read()
-        
-        # Extract text from PDF
-        extracted_text = extract_text_from_pdf(pdf_content)
+        # Stream the PDF to a spooled upload and extract its text
+        with await spool_upload(file) as upload:
+            extracted_text = await document_context(upload)
         
         if not extracted_text.strip():
             raise HTTPException(status_code=400, detail="No text content found in the PDF file")
         
         # Generate questions using AI
-        questions_data = generate_mcq_questions(
+        questions_data = await generate_mcq_questions(
             text=extracted_text,
             num_questions=num_questions,
             difficulty=difficulty.lower(),
-            test_title=test_title
+            test_title=test_title,
+            deadline=deadline
         )
         
         return JSONResponse(content=questions_data)
@@ -0,0 +1,65 @@
+"""
+Secondary indexes over knowledge bases for cursor-paginated listing.
+
+Each bucket (an owner or a course) keeps its knowledge base keys sorted by
+upload time, so a page is found with a binary search and costs O(page size)
+instead of a scan over every knowledge base in the process.
+"""
+
+import base64
+import bisect
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+Key = Tuple[float, str]
+
+
+def encode_cursor(key: Key) -> str:
+    raw = f"{key[0]!r}|{key[1]}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Key:
+    """Raises ValueError for a malformed cursor"""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    timestamp, kb_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+    return float(timestamp), kb_id
+
+
+class KnowledgeBaseIndex:
+    """Knowledge base ids per bucket, ordered by (upload_time, id)"""
+
+    def __init__(self):
+        self._buckets: Dict[str, List[Key]] = {}
+
+    @staticmethod
+    def key(kb_id: str, upload_time: datetime) -> Key:
+        return upload_time.timestamp(), kb_id
+
+    def add(self, bucket: str, key: Key) -> None:
+        bisect.insort(self._buckets.setdefault(bucket, []), key)
+
+    def remove(self, bucket: str, key: Key) -> None:
+        keys = self._buckets.get(bucket)
+        if not keys:
+            return
+        position = bisect.bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+        if not keys:
+            del self._buckets[bucket]
+
+    def count(self, bucket: str) -> int:
+        return len(self._buckets.get(bucket, ()))
+
+    def page(self, bucket: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[str], Optional[str]]:
+        """
+        Return up to ``limit`` ids, newest first, starting after ``cursor``,
+        plus the cursor for the next page (None on the last page).
+        """
+        keys = self._buckets.get(bucket, [])
+        end = bisect.bisect_left(keys, decode_cursor(cursor)) if cursor else len(keys)
+        start = max(0, end - limit)
+        page = keys[start:end][::-1]
+        next_cursor = encode_cursor(page[-1]) if start > 0 and page else None
+        return [kb_id for _, kb_id in page], next_cursor
@@ -1,18 +1,40 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Depends, Header, Query, Request, Response
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-import PyPDF2
 import google.generativeai as genai
 import uuid
-import io
-from typing import Dict, List, Optional
+import asyncio
+from contextlib import asynccontextmanager
+import hashlib
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 import os
+import sys
 import jwt
 from dotenv import load_dotenv
 
+# Make the shared ai_common package importable from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ai_common.compaction import CompactionResult
+from ai_common.context import CHARS_PER_TOKEN, budget_from_env, counter_from_env, pack_sources, terms
+from ai_common.context_cache import cache_from_env
+from ai_common.digest import digest_prompts_from_env, digest_store_from_env
+from ai_common.extraction import PDFExtractionError, executor_from_env
+from ai_common.health import CircuitOpenError, monitor_from_env
+from ai_common.llm_gateway import LLMTimeoutError, gateway_from_env, request_deadline
+from ai_common.micro_batch import batch_question, batcher_from_env, split_answers
+from ai_common.passage_index import PassageHit, build_passage_index
+from ai_common.page_index import CHUNK_CHARS, PAGE_BREAK, chunk_text, index_text, match_section, parse_page_range
+from ai_common.section_tree import build_section_tree, section_tree_from_env
+from ai_common.text_store import text_store_from_env
+from ai_common.uploads import SpooledUpload, UploadSizeLimitMiddleware, spool_upload
+from kb_index import KnowledgeBaseIndex
+
 # Load environment variables
 load_dotenv()
 
@@ -21,6 +43,30 @@ api_key = os.getenv("GEMINI_API_KEY")
 if not api_key:
     raise ValueError("GEMINI_API_KEY environment variable is required")
 genai.configure(api_key=api_key)
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+# Background upstream probe; /health reads its cached state and generation
+# calls fail fast through its circuit breaker while Gemini is down
+gemini_monitor = monitor_from_env("gemini", GEMINI_MODEL)
+
+# Token budget for document context sent with each /ask prompt
+ASK_CONTEXT_TOKENS = budget_from_env("ASK_CONTEXT_TOKENS", 32000)
+token_counter = counter_from_env(GEMINI_MODEL)
+
+# All generation goes through one async gateway: reused client, concurrency
+# limit, timeouts, retries, circuit breaker and single-flight coalescing
+llm_gateway = gateway_from_env(GEMINI_MODEL, breaker=gemini_monitor.breaker)
+
+async def generate_with_context(prompt: str) -> str:
+    """Plain model call for the local context cache backend (already inside a gateway call)"""
+    response = await llm_gateway.model().generate_content_async(prompt)
+    return response.text
+
+# Cached-content handles for heavily queried knowledge bases (off unless
+# CONTEXT_CACHE_BACKEND is set); the whole document (up to
+# CONTEXT_CACHE_MAX_TOKENS) is cached and only questions are sent
+context_cache = cache_from_env(generate_with_context)
+CONTEXT_CACHE_MAX_TOKENS = budget_from_env("CONTEXT_CACHE_MAX_TOKENS", 200000)
 
 # Configure JWT
 access_token_secret = os.getenv("ACCESS_TOKEN_SECRET")
@@ -30,12 +76,23 @@ if not access_token_secret:
 # Security scheme
 security = HTTPBearer()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the background services with the app and stop them on shutdown"""
+    gemini_monitor.start()
+    try:
+        yield
+    finally:
+        await gemini_monitor.stop()
+        extraction_executor.shutdown()
+
 app = FastAPI(
     title="PDF Knowledge Base AI Agent",
     description="A FastAPI-based AI agent for PDF document analysis and question answering using Google Gemini AI",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -47,6 +104,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized uploads (UPLOAD_MAX_MB) before the multipart body is parsed
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # Authentication middleware
 def authenticate_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Authenticate JWT token from Authorization header"""
@@ -74,23 +134,127 @@ def authenticate_token(credentials: HTTPAuthorizationCredentials = Depends(secur
 # In-memory storage for knowledge bases
 knowledge_bases: Dict[str, Dict] = {}
 
+# Secondary indexes for listing a caller's or a course's knowledge bases
+owner_index = KnowledgeBaseIndex()
+course_index = KnowledgeBaseIndex()
+# Knowledge bases per (course, owner): a course's list is shown to those who upload to it
+course_uploads: Counter = Counter()
+# JWT roles that may list any course's knowledge bases
+COURSE_STAFF_ROLES = ("teacher", "admin")
+
+# Background ingestion: PDFs are parsed in sandboxed child processes so uploads
+# return immediately and parsing never blocks the event loop
+INGEST_QUEUE_LIMIT = int(os.getenv("INGEST_QUEUE_LIMIT", "16"))
+extraction_executor = executor_from_env(queue_limit=INGEST_QUEUE_LIMIT)
+pending_ingestions = 0
+# Strong references so running ingestion tasks are not garbage collected
+ingest_tasks: set = set()
+
+# Extracted text shared by content hash: identical PDFs are parsed and stored
+# once and reference-counted by the documents that point at them
+extracted_contents: Dict[str, Dict] = {}
+# The text itself is kept compressed by content hash; only the most recently
+# queried texts are held decompressed (TEXT_COMPRESSION, TEXT_HOT_RATIO)
+text_store = text_store_from_env()
+
+# Each document is condensed at ingestion into a digest (outline, key terms,
+# summary), shared with question-generator and lecture-planner by content hash;
+# overview questions ("what is this about?") are answered from the digests
+DIGEST_PROMPTS = digest_prompts_from_env()
+digest_store = digest_store_from_env(extraction_executor.version)
+# Questions about a whole document, e.g. "What is this document about?",
+# "Summarize the book", "Give an overview of this PDF"; nothing more specific
+_WHOLE_DOCUMENT = r"(?:this|the|these)\s+(?:documents?|pdfs?|books?|files?|notes|lectures?|slides|materials?)"
+OVERVIEW_QUESTION_RE = re.compile(
+    r"^\s*(?:please\s+)?(?:"
+    rf"what\s+(?:is|are)\s+{_WHOLE_DOCUMENT}\s+(?:about|covering)"
+    r"|(?:summari[sz]e|give\s+(?:me\s+)?(?:an?\s+)?(?:overview|summary|outline)\s+of"
+    rf"|what\s+are\s+the\s+main\s+(?:topics|points|ideas)\s+(?:of|in))\s+{_WHOLE_DOCUMENT}"
+    r")\s*[?.!]*\s*$",
+    re.IGNORECASE
+)
+# Words of overview questions that are not about the document's content
+OVERVIEW_WORDS = frozenset(
+    "summarize summarise give overview summary outline main topics points ideas "
+    "document documents pdf pdfs book books file files notes lecture lectures slides material materials "
+    "please about covering".split()
+)
+
+# Documents too long for the /ask context budget are searched through a
+# section tree built at ingestion (chapters, then sections, then chunks)
+SECTION_TREE = section_tree_from_env()
+tree_stats = {"searches": 0, "nodes_scored": 0, "chunks_scored": 0, "chunks_total": 0}
+
+# Every document also gets a passage index for /search, which answers
+# lookups without a model call; with ASK_EXTRACTIVE_FALLBACK on, /ask returns
+# the best passages instead of an error while Gemini is down or too slow
+ASK_EXTRACTIVE_FALLBACK = os.getenv("ASK_EXTRACTIVE_FALLBACK", "off").lower() in ("on", "true", "1")
+EXTRACTIVE_PASSAGES = int(os.getenv("EXTRACTIVE_PASSAGES", "3"))
+search_stats = {"searches": 0, "ms_total": 0.0, "ms_max": 0.0, "extractive_answers": 0}
+
+# With ASK_BATCHING on, questions about the same content and scope that
+# arrive within ASK_BATCH_WINDOW_MS are answered by one multi-question call
+ask_batcher = batcher_from_env("ASK")
+batch_stats = {"split_fallbacks": 0}
+
+# Page citations such as [p. 12] or [notes.pdf, p. 12] in an answer
+CITATION_RE = re.compile(r"[\[(]([^\[\]()]{1,160})[\])]")
+
 # Pydantic models
 class QuestionRequest(BaseModel):
     question: str
     knowledge_base_id: str
+    pages: Optional[str] = None
+    section: Optional[str] = None
+    document_id: Optional[str] = None
+
+class Citation(BaseModel):
+    document_id: str
+    filename: str
+    page: int
 
 class QuestionResponse(BaseModel):
     answer: str
     knowledge_base_id: str
     question: str
     timestamp: datetime
+    citations: List[Citation] = []
+    extractive: bool = False
+
+class DocumentInfo(BaseModel):
+    id: str
+    filename: str
+    upload_time: datetime
+    text_length: int
+    status: str
+    progress: float = 0.0
+    page_count: Optional[int] = None
+    pages_processed: int = 0
+    tokens_saved: Optional[int] = None
+    error: Optional[str] = None
 
 class KnowledgeBaseInfo(BaseModel):
     id: str
     filename: str
+    owner_id: Optional[str] = None
+    course_id: Optional[str] = None
     upload_time: datetime
     text_length: int
     status: str
+    progress: float = 0.0
+    page_count: Optional[int] = None
+    pages_processed: int = 0
+    error: Optional[str] = None
+    documents: List[DocumentInfo] = []
+
+class DocumentResponse(BaseModel):
+    id: str
+    knowledge_base_id: str
+    filename: str
+    upload_time: datetime
+    status: str
+    message: str
+    deduplicated: bool = False
 
 class KnowledgeBaseResponse(BaseModel):
     id: str
@@ -99,6 +263,7 @@ class KnowledgeBaseResponse(BaseModel):
     text_length: int
     status: str
     message: str
+    deduplicated: bool = False
 
 class ErrorResponse(BaseModel):
     error: str
@@ -106,39 +271,576 @@ class ErrorResponse(BaseModel):
     timestamp: datetime
 
 # Helper functions
-def extract_text_from_pdf(pdf_content: bytes) -> str:
-    """Extract text from PDF bytes"""
+def owner_of(user: dict) -> str:
+    """Owner id from the JWT payload (the auth server signs `uid`)"""
+    return str(user.get("uid") or user.get("user_id") or user.get("sub") or "anonymous")
+
+def index_knowledge_base(kb: Dict) -> None:
+    key = KnowledgeBaseIndex.key(kb["id"], kb["upload_time"])
+    owner_index.add(kb["owner_id"], key)
+    if kb["course_id"]:
+        course_index.add(kb["course_id"], key)
+        course_uploads[(kb["course_id"], kb["owner_id"])] += 1
+
+def unindex_knowledge_base(kb: Dict) -> None:
+    key = KnowledgeBaseIndex.key(kb["id"], kb["upload_time"])
+    owner_index.remove(kb["owner_id"], key)
+    if kb["course_id"]:
+        course_index.remove(kb["course_id"], key)
+        course_uploads[(kb["course_id"], kb["owner_id"])] -= 1
+        if course_uploads[(kb["course_id"], kb["owner_id"])] <= 0:
+            del course_uploads[(kb["course_id"], kb["owner_id"])]
+
+def can_list_course(user: dict, course_id: str) -> bool:
+    """Course staff, and callers who uploaded to the course, may list its knowledge bases"""
+    return user.get("role") in COURSE_STAFF_ROLES or course_uploads[(course_id, owner_of(user))] > 0
+
+def acquire_content(upload: SpooledUpload) -> Tuple[Dict, bool]:
+    """
+    Take a reference on the extracted content for a spooled PDF upload.
+    
+    Returns (record, deduplicated). Identical bytes seen before reuse the
+    existing record, whether it is ready or still processing; new content, and
+    content whose earlier ingestion failed, is queued for ingestion, which
+    takes ownership of the upload. Otherwise the upload is closed here.
+    """
+    content_hash = upload.sha256
+    record = extracted_contents.get(content_hash)
+    retry = record is not None and record["status"] == "failed"
+    deduplicated = record is not None and not retry
+    if record is None or retry:
+        try:
+            check_ingestion_capacity()
+        except HTTPException:
+            upload.close()
+            raise
+        if retry:
+            # Documents already pointing at the failed record follow the retry
+            record.update(status="processing", progress=0.0, page_count=None, pages_processed=0,
+                          tokens_saved=None, error=None)
+        else:
+            record = {
+                "hash": content_hash,
+                "text_length": 0,
+                "status": "processing",
+                "progress": 0.0,
+                "page_count": None,
+                "pages_processed": 0,
+                "tokens_saved": None,
+                "digest": None,
+                "pages": None,
+                "sections": [],
+                "tree": None,
+                "passages": None,
+                "error": None,
+                "refs": 0
+            }
+            extracted_contents[content_hash] = record
+        queue_ingestion(content_hash, upload)
+    else:
+        upload.close()
+    record["refs"] += 1
+    return record, deduplicated
+
+def release_content(content_hash: str) -> None:
+    """Drop a reference, freeing the extracted text once nothing points at it"""
+    record = extracted_contents.get(content_hash)
+    if record is None:
+        return
+    record["refs"] -= 1
+    if record["refs"] <= 0:
+        del extracted_contents[content_hash]
+        text_store.discard(content_hash)
+
+def new_document(filename: str, content_hash: str) -> Dict:
+    """Create the stored record for a PDF added to a knowledge base"""
+    return {
+        "id": str(uuid.uuid4()),
+        "filename": filename,
+        "upload_time": datetime.now(),
+        "content_hash": content_hash
+    }
+
+def doc_content(doc: Dict) -> Dict:
+    return extracted_contents[doc["content_hash"]]
+
+def content_text(content: Dict) -> str:
+    """Extracted text of a ready content record, decompressed on demand"""
+    return text_store.get(content["hash"])
+
+def kb_status(kb: Dict) -> str:
+    """
+    Derive a knowledge base's status from its documents.
+    
+    A knowledge base stays queryable while new documents are appended: it is
+    `ready` as soon as any document is ready, `processing` while its only
+    documents are still being ingested, `failed` when none succeeded and
+    `empty` once every document has been removed.
+    """
+    statuses = {doc_content(doc)["status"] for doc in kb["documents"].values()}
+    if not statuses:
+        return "empty"
+    if "ready" in statuses:
+        return "ready"
+    if "processing" in statuses:
+        return "processing"
+    return "failed"
+
+def ready_contents(kb: Dict) -> List[Dict]:
+    """Extracted content of all ready documents, in the order they were added"""
+    contents = {doc["content_hash"]: doc_content(doc) for doc in kb["documents"].values()}
+    return [content for content in contents.values() if content["status"] == "ready"]
+
+def kb_text(kb: Dict) -> str:
+    return "\n\n".join(content_text(content).replace(PAGE_BREAK, "\n\n") for content in ready_contents(kb))
+
+def ready_documents(kb: Dict) -> List[Tuple[Dict, Dict]]:
+    """(document, content) of each ready document, skipping repeated uploads of the same PDF"""
+    documents = {}
+    for doc in kb["documents"].values():
+        content = doc_content(doc)
+        if content["status"] == "ready" and content["hash"] not in documents:
+            documents[content["hash"]] = (doc, content)
+    return list(documents.values())
+
+def scoped_documents(kb: Dict, document_id: Optional[str] = None) -> List[Tuple[Dict, Dict]]:
+    """Ready documents of a knowledge base, or just `document_id`"""
+    documents = ready_documents(kb)
+    if document_id:
+        if document_id not in kb["documents"]:
+            raise HTTPException(status_code=404, detail="Document not found")
+        documents = [(doc, content) for doc, content in documents if doc["id"] == document_id]
+        if not documents:
+            raise HTTPException(status_code=400, detail="Document is not ready")
+    return documents
+
+def scoped_pages(kb: Dict, document_id: Optional[str] = None, pages: Optional[str] = None,
+                 section: Optional[str] = None) -> List[Tuple[Dict, List[Tuple[int, str]]]]:
+    """
+    Page texts a request is limited to, per document.
+    
+    Without `pages` or `section` every page of every ready document (or of
+    `document_id`) is in scope. `pages` is a range such as `40-45`; `section`
+    matches a detected heading (`Chapter 3`) and limits the text to that
+    section. Both need a single document, so `document_id` is required once a
+    knowledge base has several.
+    """
+    documents = scoped_documents(kb, document_id)
+    if not pages and not section:
+        return [
+            (doc, content["pages"].page_texts(content_text(content), range(1, content["pages"].page_count + 1)))
+            for doc, content in documents
+        ]
+    if len(documents) != 1:
+        raise HTTPException(status_code=400, detail="Set document_id to limit a knowledge base with several documents to pages or a section")
+    
+    doc, content = documents[0]
+    index = content["pages"]
+    start, end = 0, None
+    numbers = list(range(1, index.page_count + 1))
+    if pages:
+        try:
+            numbers = parse_page_range(pages, index.page_count)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if section:
+        match = match_section(content["sections"], section)
+        if match is None:
+            raise HTTPException(status_code=404, detail=f"No section matching '{section}'")
+        start, end = match.start, match.end
+        numbers = [number for number in numbers if match.first_page <= number <= match.last_page]
+    texts = index.page_texts(content_text(content), numbers, start, end)
+    if not texts:
+        raise HTTPException(status_code=400, detail="The selected pages contain no text")
+    return [(doc, texts)]
+
+def page_sources(scope: List[Tuple[Dict, List[Tuple[int, str]]]]) -> Tuple[List[Tuple[str, str]], Dict[str, Citation]]:
+    """
+    Labelled page texts for `pack_sources` (`p. 12`, or `notes.pdf, p. 12`
+    when several documents are in scope), with the citation each label stands for
+    """
+    sources, citations = [], {}
+    for doc, texts in scope:
+        for page, text in texts:
+            label = page_label(doc, page, len(scope) > 1)
+            sources.append((label, text))
+            citations[label.lower()] = Citation(document_id=doc["id"], filename=doc["filename"], page=page)
+    return sources, citations
+
+def page_label(doc: Dict, page: int, several: bool) -> str:
+    return f"{doc['filename']}, p. {page}" if several else f"p. {page}"
+
+def tree_passages(documents: List[Tuple[Dict, Dict]], question: str) -> Optional[List[Tuple[str, str]]]:
+    """
+    Passages for a question, found by descending each document's section
+    tree, as labelled sources in document order. None when the documents fit
+    the context budget whole or no passage matches; the prompt is then packed
+    from every page.
+    """
+    budget = ASK_CONTEXT_TOKENS * CHARS_PER_TOKEN
+    if sum(content["text_length"] for _, content in documents) <= budget:
+        return None
+    trees = [(doc, content["tree"], content_text(content)) for doc, content in documents if content["tree"] is not None]
+    if not trees:
+        return None
+    
+    found = []
+    for position, (doc, tree, text) in enumerate(trees):
+        search = tree.search(text, question, limit=budget // CHUNK_CHARS + 1)
+        tree_stats["searches"] += 1
+        tree_stats["nodes_scored"] += search.nodes_scored
+        tree_stats["chunks_scored"] += search.chunks_scored
+        tree_stats["chunks_total"] += tree.chunk_count
+        found.extend((hit.score, position, hit.chunk) for hit in search.chunks)
+    if not found:
+        return None
+    
+    kept, used = [], 0
+    for score, position, chunk in sorted(found, key=lambda hit: -hit[0]):
+        if used >= budget:
+            break
+        kept.append((position, chunk))
+        used += chunk.end - chunk.start
+    
+    sources = []
+    for position, chunk in sorted(kept, key=lambda hit: (hit[0], hit[1].start)):
+        doc, _, document_text = trees[position]
+        label = page_label(doc, chunk.page, len(documents) > 1)
+        text = chunk_text(document_text, chunk)
+        if sources and sources[-1][0] == label:
+            sources[-1] = (label, sources[-1][1] + "\n" + text)
+        else:
+            sources.append((label, text))
+    return sources
+
+def search_passages(documents: List[Tuple[Dict, Dict]], query: str, limit: int,
+                    pages: Optional[Dict[str, set]] = None) -> List[Tuple[Dict, PassageHit]]:
+    """
+    Best passages for `query` across documents, from their passage indexes;
+    `pages` optionally limits a document (by id) to a set of pages
+    """
+    started = time.monotonic()
+    hits = []
+    for doc, content in documents:
+        if content["passages"] is None:
+            continue
+        doc_pages = pages.get(doc["id"]) if pages else None
+        hits.extend((doc, hit) for hit in content["passages"].search(content_text(content), query, limit, doc_pages))
+    hits.sort(key=lambda item: -item[1].score)
+    elapsed = 1000 * (time.monotonic() - started)
+    search_stats["searches"] += 1
+    search_stats["ms_total"] += elapsed
+    search_stats["ms_max"] = max(search_stats["ms_max"], elapsed)
+    return hits[:limit]
+
+def extractive_response(request: QuestionRequest, scope: List[Tuple[Dict, List[Tuple[int, str]]]]) -> Optional[QuestionResponse]:
+    """Answer with the passages that best match the question, for when Gemini cannot answer"""
+    documents = [(doc, doc_content(doc)) for doc, _ in scope]
+    pages = None
+    if request.pages or request.section:
+        pages = {doc["id"]: {page for page, _ in texts} for doc, texts in scope}
+    hits = search_passages(documents, request.question, EXTRACTIVE_PASSAGES, pages)
+    if not hits:
+        return None
+    search_stats["extractive_answers"] += 1
+    
+    parts = ["The AI model is unavailable right now; these passages best match the question:"]
+    citations = []
+    for doc, hit in hits:
+        parts.append(f"[{page_label(doc, hit.page, len(documents) > 1)}] {hit.text}")
+        citation = Citation(document_id=doc["id"], filename=doc["filename"], page=hit.page)
+        if citation not in citations:
+            citations.append(citation)
+    return QuestionResponse(
+        answer="\n\n".join(parts),
+        knowledge_base_id=request.knowledge_base_id,
+        question=request.question,
+        timestamp=datetime.now(),
+        citations=citations,
+        extractive=True
+    )
+
+def text_storage_snapshot() -> Dict:
+    """
+    Memory held by extracted text and by the indexes built over it (sizes
+    measured at ingestion), and the extraction cache on disk
+    """
+    memory = text_store.snapshot()
+    contents = list(extracted_contents.values())
+    passage_bytes = sum(content["passages"].memory_bytes for content in contents if content.get("passages") is not None)
+    tree_bytes = sum(content["tree"].memory_bytes for content in contents if content.get("tree") is not None)
+    return {
+        "memory": memory,
+        "indexes": {
+            "passage_index_bytes": passage_bytes,
+            "section_tree_bytes": tree_bytes,
+            "resident_bytes": memory["resident_bytes"] + passage_bytes + tree_bytes
+        },
+        "disk": extraction_executor.cache.snapshot() if extraction_executor.cache is not None else None
+    }
+
+def search_snapshot() -> Dict:
+    searches = search_stats["searches"]
+    return {
+        "fallback_enabled": ASK_EXTRACTIVE_FALLBACK,
+        "searches": searches,
+        "ms_avg": round(search_stats["ms_total"] / searches, 2) if searches else 0.0,
+        "ms_max": round(search_stats["ms_max"], 2),
+        "extractive_answers": search_stats["extractive_answers"]
+    }
+
+def tree_snapshot() -> Dict:
+    trees = [content["tree"] for content in extracted_contents.values() if content["tree"] is not None]
+    searches = tree_stats["searches"]
+    return {
+        "enabled": SECTION_TREE,
+        "documents": len(trees),
+        "nodes": sum(tree.node_count for tree in trees),
+        "chunks": sum(tree.chunk_count for tree in trees),
+        "searches": searches,
+        "avg_nodes_scored": round(tree_stats["nodes_scored"] / searches, 1) if searches else 0.0,
+        "avg_chunks_scored": round(tree_stats["chunks_scored"] / searches, 1) if searches else 0.0,
+        "avg_chunks_total": round(tree_stats["chunks_total"] / searches, 1) if searches else 0.0
+    }
+
+def cited_pages(answer: str, citations: Dict[str, Citation]) -> List[Citation]:
+    """Pages the answer cites, in the order it first cites them"""
+    cited = []
+    for match in CITATION_RE.finditer(answer):
+        for label in match.group(1).split(";"):
+            citation = citations.get(" ".join(label.lower().split()))
+            if citation is not None and citation not in cited:
+                cited.append(citation)
+    return cited
+
+def digest_covers(question: str, digest_text: str) -> bool:
+    """Whether every content term of `question` appears in `digest_text`"""
+    return set(terms(question)) - OVERVIEW_WORDS <= set(terms(digest_text))
+
+def kb_digest_text(kb: Dict) -> str:
+    """Digests of the knowledge base's ready documents, headed by their filenames"""
+    parts = []
+    for doc in kb["documents"].values():
+        content = doc_content(doc)
+        if content["status"] == "ready" and content["digest"] is not None:
+            parts.append(f"Document: {doc['filename']}\n{content['digest'].to_prompt()}")
+    return "\n\n".join(parts)
+
+def kb_context_key(kb: Dict) -> str:
+    """Identifies a knowledge base's combined content; identical uploads share it"""
+    hashes = "|".join(["paged"] + [content["hash"] for content in ready_contents(kb)])
+    return hashlib.sha256(hashes.encode()).hexdigest()
+
+async def release_context_cache(key: str) -> None:
+    """Delete the cached context for `key` unless another knowledge base still has the same content"""
+    if context_cache is None or any(kb_context_key(kb) == key for kb in knowledge_bases.values()):
+        return
+    await asyncio.to_thread(context_cache.invalidate, key)
+
+def document_info(doc: Dict) -> DocumentInfo:
+    content = doc_content(doc)
+    return DocumentInfo(
+        id=doc["id"],
+        filename=doc["filename"],
+        upload_time=doc["upload_time"],
+        text_length=content["text_length"],
+        status=content["status"],
+        progress=content["progress"],
+        page_count=content["page_count"],
+        pages_processed=content["pages_processed"],
+        tokens_saved=content["tokens_saved"],
+        error=content["error"]
+    )
+
+def kb_info(kb: Dict) -> KnowledgeBaseInfo:
+    """Build the public view of a stored knowledge base"""
+    status = kb_status(kb)
+    documents = [document_info(doc) for doc in kb["documents"].values()]
+    page_count = sum(doc.page_count or 0 for doc in documents)
+    pages_processed = sum(doc.pages_processed for doc in documents)
+    failed = [doc.error for doc in documents if doc.status == "failed"]
+    return KnowledgeBaseInfo(
+        id=kb["id"],
+        filename=kb["filename"],
+        owner_id=kb["owner_id"],
+        course_id=kb["course_id"],
+        upload_time=kb["upload_time"],
+        text_length=sum(doc.text_length for doc in documents if doc.status == "ready"),
+        status=status,
+        progress=round(pages_processed / page_count, 4) if page_count else float(status == "ready"),
+        page_count=page_count or None,
+        pages_processed=pages_processed,
+        error=failed[0] if failed and status == "failed" else None,
+        documents=documents
+    )
+
+def _record_progress(record: Dict, pages_done: int, page_count: int) -> None:
+    """Progress callback invoked from the extraction progress thread"""
+    record["page_count"] = page_count
+    record["pages_processed"] = pages_done
+    record["progress"] = round(pages_done / page_count, 4) if page_count else 1.0
+
+def _record_compaction(record: Dict, compaction: CompactionResult) -> None:
+    """Tokens removed from the document's text by the compaction stage"""
+    record["tokens_saved"] = compaction.tokens_saved
+
+async def ingest_pdf(content_hash: str, upload: SpooledUpload) -> None:
+    """Extract text for one PDF in a sandboxed process and publish it to its content record"""
+    global pending_ingestions
+    record = extracted_contents.get(content_hash)
     try:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        if record is None:
+            return
+        outline = []
+        try:
+            text = await extraction_executor.extract(
+                upload.source(),
+                on_progress=lambda done, total: _record_progress(record, done, total),
+                content_hash=content_hash,
+                on_compaction=lambda compaction: _record_compaction(record, compaction),
+                on_outline=outline.extend
+            )
+        except PDFExtractionError as e:
+            # Keep the pages extracted before the sandbox gave up on the PDF
+            if not e.partial_text.strip():
+                raise
+            text = e.partial_text
+            record["error"] = f"Only {e.pages_done} of {e.page_count or '?'} pages extracted ({e.kind}): {e}"
+        if not text.strip():
+            raise ValueError("No text could be extracted from the PDF")
+        # Page offsets and sections (from the PDF's bookmarks, or detected
+        # headings) for page- and section-scoped questions
+        record["pages"], record["sections"] = await asyncio.to_thread(index_text, text, outline)
+        record["passages"] = await asyncio.to_thread(build_passage_index, text, record["pages"])
+        if SECTION_TREE:
+            record["tree"] = await asyncio.to_thread(build_section_tree, text, record["pages"], record["sections"])
+        if record["page_count"] is None:
+            # Served from the extraction cache, so no progress was reported
+            record["page_count"] = record["pages_processed"] = record["pages"].page_count
+        # Digests of partially extracted PDFs are kept with the record but not shared
+        record["digest"] = await digest_store.lookup(content_hash) or await digest_store.build(
+            content_hash, text, store=record["error"] is None
+        )
+        await asyncio.to_thread(text_store.put, content_hash, text)
+        if content_hash not in extracted_contents:
+            # Every document using it was removed while it was being ingested
+            text_store.discard(content_hash)
+        record["text_length"] = len(text)
+        record["progress"] = 1.0
+        record["status"] = "ready"
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
+        if record is not None:
+            record["status"] = "failed"
+            record["error"] = f"Error reading PDF ({e.kind}): {e}" if isinstance(e, PDFExtractionError) else str(e)
+    finally:
+        upload.close()
+        pending_ingestions -= 1
+
+def queue_ingestion(content_hash: str, upload: SpooledUpload) -> None:
+    """Hand a PDF to the background ingestion pool"""
+    global pending_ingestions
+    pending_ingestions += 1
+    task = asyncio.create_task(ingest_pdf(content_hash, upload))
+    ingest_tasks.add(task)
+    task.add_done_callback(ingest_tasks.discard)
 
-def get_ai_response(question: str, context: str) -> str:
-    """Get response from Gemini AI based on the question and PDF context"""
+def check_ingestion_capacity() -> None:
+    """Shed load once the ingestion backlog is full"""
+    if pending_ingestions >= INGEST_QUEUE_LIMIT:
+        raise HTTPException(status_code=503, detail="Too many PDFs are being processed, please retry shortly")
+
+async def get_ai_response(question: str, sources: List[Tuple[str, str]], cache_key: Optional[str] = None,
+                          deadline: Optional[float] = None,
+                          passages: Optional[List[Tuple[str, str]]] = None) -> str:
+    """
+    Get response from Gemini AI based on the question and PDF context.
+    
+    `sources` are labelled page texts (see `page_sources`); the model is asked
+    to cite the labels it relies on. The prompt is packed from `passages`
+    (see `tree_passages`) when given, or from `sources`. Without passages,
+    when `cache_key` identifies a knowledge base that is queried often
+    enough, the document is served from a cached-content handle instead and
+    only the question is sent. Identical concurrent prompts are coalesced
+    into one call.
+    """
+    cite = ""
+    if any(label for label, _ in sources):
+        cite = "The content is split into pages marked like [p. 12]; cite the pages your answer relies on in the same form."
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        handle = None
+        # Passages picked for this question beat the whole document
+        if context_cache is not None and cache_key and passages is None:
+            def load_cached_context():
+                packed = pack_sources(sources, CONTEXT_CACHE_MAX_TOKENS, counter=token_counter)
+                return packed.text, packed.tokens
+            handle = await asyncio.to_thread(context_cache.lookup, cache_key, load_cached_context)
+        
+        if handle is not None:
+            prompt = f"""
+        Based on the document content provided above, please answer the question.
+        If the answer is not found in the document, please say so clearly.
+        {cite}
+        
+        Question: {question}
+        
+        Answer:
+        """
+            return await llm_gateway.run(
+                lambda timeout: context_cache.generate(handle, prompt, timeout),
+                endpoint="ask",
+                key_parts=(handle.name, prompt),
+                deadline=deadline
+            )
+        
+        # Keep the sentences most relevant to the question within the token budget
+        packed = await asyncio.to_thread(
+            pack_sources, passages or sources, ASK_CONTEXT_TOKENS, query=question, counter=token_counter
+        )
         
         prompt = f"""
         Based on the following document content, please answer the question.
         If the answer is not found in the document, please say so clearly.
+        {cite}
         
         Document Content:
-        {context}
+        {packed.text}
         
         Question: {question}
         
         Answer:
         """
-        
-        response = model.generate_content(prompt)
-        return response.text
+        return await llm_gateway.generate(prompt, endpoint="ask", deadline=deadline)
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except LLMTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting AI response: {str(e)}")
 
+async def answer_batch(batch: List[Tuple[str, Optional[float]]], sources: List[Tuple[str, str]],
+                       cache_key: Optional[str]) -> List:
+    """
+    Answers to a batch of `(question, deadline)` from `ask_batcher`: one call
+    for the whole batch, bounded by its earliest deadline, then a call of its
+    own for each answer missing from the reply
+    """
+    deadlines = [deadline for _, deadline in batch if deadline is not None]
+    deadline = min(deadlines) if deadlines else None
+    if len(batch) == 1:
+        return [await get_ai_response(batch[0][0], sources, cache_key, deadline)]
+    
+    reply = await get_ai_response(batch_question([question for question, _ in batch]), sources, cache_key, deadline)
+    answers = split_answers(reply, len(batch))
+    missing = [position for position, answer in enumerate(answers) if answer is None]
+    batch_stats["split_fallbacks"] += len(missing)
+    retried = await asyncio.gather(
+        *(get_ai_response(batch[position][0], sources, cache_key, batch[position][1]) for position in missing),
+        return_exceptions=True
+    )
+    for position, answer in zip(missing, retried):
+        answers[position] = answer
+    return answers
+
 # API Endpoints
 
 @app.get("/", tags=["Root"])
@@ -155,59 +857,77 @@ async def root():
             "ask_question": "/ask",
             "list_knowledge_bases": "/knowledge-bases",
             "get_knowledge_base": "/knowledge-bases/{kb_id}",
-            "delete_knowledge_base": "/knowledge-bases/{kb_id}"
+            "delete_knowledge_base": "/knowledge-bases/{kb_id}",
+            "add_document": "/knowledge-bases/{kb_id}/documents",
+            "delete_document": "/knowledge-bases/{kb_id}/documents/{doc_id}",
+            "get_digest": "/knowledge-bases/{kb_id}/digest",
+            "get_sections": "/knowledge-bases/{kb_id}/sections",
+            "search": "/knowledge-bases/{kb_id}/search",
+            "metrics": "/metrics"
         }
     }
 
-@app.post("/upload-pdf", response_model=KnowledgeBaseResponse, tags=["Knowledge Base"])
-async def upload_pdf(file: UploadFile = File(...), user: dict = Depends(authenticate_token)):
+@app.post("/upload-pdf", response_model=KnowledgeBaseResponse, status_code=202, tags=["Knowledge Base"])
+async def upload_pdf(
+    file: UploadFile = File(...),
+    course_id: Optional[str] = Form(None),
+    user: dict = Depends(authenticate_token)
+):
     """
     Upload a PDF file and create a knowledge base.
     
+    The PDF is accepted immediately and processed in the background. Poll
+    `GET /knowledge-bases/{kb_id}` until `status` becomes `ready` or `failed`.
+    
     - **file**: PDF file to upload (multipart/form-data)
+    - **course_id**: Optional course the knowledge base belongs to
+    
+    The knowledge base is owned by the caller (`uid` in the JWT).
     
     Returns:
     - **id**: Unique identifier for the knowledge base
     - **filename**: Original filename of the uploaded PDF
     - **upload_time**: Timestamp of upload
-    - **text_length**: Number of characters extracted from PDF
-    - **status**: Processing status
+    - **text_length**: Number of characters extracted so far (0 while processing)
+    - **status**: Processing status (`processing`, or `ready` for a known PDF)
     - **message**: Success message
+    - **deduplicated**: True when identical bytes were uploaded before and
+      their extracted text is reused instead of parsing the PDF again
     """
     # Validate file type
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
     
     try:
-        # Read file content
-        content = await file.read()
-        
-        # Extract text from PDF
-        text = extract_text_from_pdf(content)
-        
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="No text could be extracted from the PDF")
+        # Stream the file to a spooled upload, hashing it as it arrives
+        upload = await spool_upload(file)
+        content_hash = upload.sha256
+        content, deduplicated = acquire_content(upload)
         
-        # Generate unique ID
+        # Generate unique ID; every upload owns its own knowledge base even
+        # when the extracted content is shared
         kb_id = str(uuid.uuid4())
+        doc = new_document(file.filename, content_hash)
         
-        # Store knowledge base
         knowledge_bases[kb_id] = {
             "id": kb_id,
             "filename": file.filename,
-            "text": text,
-            "upload_time": datetime.now(),
-            "text_length": len(text),
-            "status": "ready"
+            "owner_id": owner_of(user),
+            "course_id": course_id,
+            "upload_time": doc["upload_time"],
+            "documents": {doc["id"]: doc}
         }
+        index_knowledge_base(knowledge_bases[kb_id])
         
         return KnowledgeBaseResponse(
             id=kb_id,
             filename=file.filename,
-            upload_time=datetime.now(),
-            text_length=len(text),
-            status="ready",
-            message="PDF uploaded and processed successfully"
+            upload_time=doc["upload_time"],
+            text_length=content["text_length"],
+            status=content["status"],
+            message="Identical PDF already uploaded; reusing its extracted text" if deduplicated
+                else "PDF accepted and queued for processing",
+            deduplicated=deduplicated
         )
         
     except HTTPException:
@@ -216,18 +936,34 @@ async def upload_pdf(file: UploadFile = File(...), user: dict = Depends(authenti
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.post("/ask", response_model=QuestionResponse, tags=["Question Answering"])
-async def ask_question(request: QuestionRequest, user: dict = Depends(authenticate_token)):
+async def ask_question(
+    request: QuestionRequest,
+    user: dict = Depends(authenticate_token),
+    x_request_timeout: Optional[str] = Header(None)
+):
     """
     Ask a question about a specific knowledge base.
     
     - **question**: The question to ask about the document
     - **knowledge_base_id**: ID of the knowledge base to query
+    - **pages**: Optional page range (`12`, `40-45`, `3, 7-9`) to limit the
+      question to
+    - **section**: Optional section heading (`Chapter 3`, `2.1`) to limit the
+      question to; see `GET /knowledge-bases/{kb_id}/sections`
+    - **document_id**: Document to query; required with `pages` or `section`
+      when the knowledge base has several documents
+    
+    An optional `X-Request-Timeout` header (seconds) bounds how long the model
+    call, including retries, may take.
     
     Returns:
     - **answer**: AI-generated answer based on the document
     - **knowledge_base_id**: ID of the queried knowledge base
     - **question**: The original question
     - **timestamp**: When the question was answered
+    - **citations**: Pages the answer cites
+    - **extractive**: True when Gemini could not answer and, with
+      `ASK_EXTRACTIVE_FALLBACK` on, the answer quotes the best matching passages
     """
     # Check if knowledge base exists
     if request.knowledge_base_id not in knowledge_bases:
@@ -236,42 +972,103 @@ async def ask_question(request: QuestionRequest, user: dict = Depends(authentica
     kb = knowledge_bases[request.knowledge_base_id]
     
     # Check if knowledge base is ready
-    if kb["status"] != "ready":
+    if kb_status(kb) != "ready":
         raise HTTPException(status_code=400, detail="Knowledge base is not ready")
     
+    scoped = bool(request.pages or request.section or request.document_id)
+    # Slicing pages out of the (decompressed) text is CPU bound on long documents
+    scope = await asyncio.to_thread(scoped_pages, kb, request.document_id, request.pages, request.section)
+    sources, citations = page_sources(scope)
+    
     try:
-        # Get AI response
-        answer = get_ai_response(request.question, kb["text"])
-        
-        return QuestionResponse(
-            answer=answer,
-            knowledge_base_id=request.knowledge_base_id,
-            question=request.question,
-            timestamp=datetime.now()
-        )
-        
-    except HTTPException:
-        raise
+        # Overview questions only need the digests, not the documents themselves
+        digest_text = ""
+        if DIGEST_PROMPTS and not scoped and OVERVIEW_QUESTION_RE.search(request.question):
+            digest_text = kb_digest_text(kb)
+            # A question naming something the digests do not mention needs the text itself
+            if not digest_covers(request.question, digest_text):
+                digest_text = ""
+        if digest_text:
+            answer = await get_ai_response(
+                request.question,
+                [("", digest_text)],
+                deadline=request_deadline(x_request_timeout)
+            )
+        else:
+            passages = None
+            if not (request.pages or request.section):
+                passages = await asyncio.to_thread(
+                    tree_passages, scoped_documents(kb, request.document_id), request.question
+                )
+            # Only whole knowledge bases are worth a cached-content handle;
+            # page and section scopes are answered from their own pages
+            cache_key = None if scoped else kb_context_key(kb)
+            deadline = request_deadline(x_request_timeout)
+            if ask_batcher is not None and passages is None:
+                # Every question in scope gets the same context, so concurrent ones can share a call
+                answer = await ask_batcher.submit(
+                    "|".join([kb_context_key(kb), request.document_id or "", request.pages or "", request.section or ""]),
+                    (request.question, deadline),
+                    lambda batch: answer_batch(batch, sources, cache_key)
+                )
+            else:
+                answer = await get_ai_response(
+                    request.question,
+                    sources,
+                    cache_key=cache_key,
+                    deadline=deadline,
+                    passages=passages
+                )
+    except HTTPException as e:
+        # Gemini failed, is unreachable (circuit open) or ran out of time
+        fallback = None
+        if ASK_EXTRACTIVE_FALLBACK and e.status_code in (500, 503, 504):
+            fallback = extractive_response(request, scope)
+        if fallback is None:
+            raise
+        return fallback
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
+    
+    return QuestionResponse(
+        answer=answer,
+        knowledge_base_id=request.knowledge_base_id,
+        question=request.question,
+        timestamp=datetime.now(),
+        citations=cited_pages(answer, citations)
+    )
 
 @app.get("/knowledge-bases", response_model=List[KnowledgeBaseInfo], tags=["Knowledge Base"])
-async def list_knowledge_bases(user: dict = Depends(authenticate_token)):
+async def list_knowledge_bases(
+    response: Response,
+    course_id: Optional[str] = Query(None, description="List a course's knowledge bases instead of your own"),
+    limit: int = Query(20, ge=1, le=100, description="Page size"),
+    cursor: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+    user: dict = Depends(authenticate_token)
+):
     """
-    List all available knowledge bases.
+    List knowledge bases, newest first.
     
-    Returns a list of all uploaded knowledge bases with their metadata.
+    - **course_id**: When set, list knowledge bases uploaded for that course;
+      otherwise list the caller's own knowledge bases
+    - **limit**: Page size (1-100, default: 20)
+    - **cursor**: Opaque cursor for the next page
+    
+    When more results exist, the `X-Next-Cursor` response header carries the
+    cursor for the next page. Listing a course requires a teacher or admin
+    role, or a knowledge base of your own in that course.
     """
-    return [
-        KnowledgeBaseInfo(
-            id=kb["id"],
-            filename=kb["filename"],
-            upload_time=kb["upload_time"],
-            text_length=kb["text_length"],
-            status=kb["status"]
-        )
-        for kb in knowledge_bases.values()
-    ]
+    if course_id and not can_list_course(user, course_id):
+        raise HTTPException(status_code=403, detail="Not allowed to list this course's knowledge bases")
+    index, bucket = (course_index, course_id) if course_id else (owner_index, owner_of(user))
+    try:
+        kb_ids, next_cursor = index.page(bucket, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [kb_info(knowledge_bases[kb_id]) for kb_id in kb_ids]
 
 @app.get("/knowledge-bases/{kb_id}", response_model=KnowledgeBaseInfo, tags=["Knowledge Base"])
 async def get_knowledge_base(kb_id: str, user: dict = Depends(authenticate_token)):
@@ -280,35 +1077,44 @@ async def get_knowledge_base(kb_id: str, user: dict = Depends(authenticate_token
     
     - **kb_id**: ID of the knowledge base
     
-    Returns detailed information about the knowledge base.
+    Returns detailed information about the knowledge base, including
+    ingestion progress while it is `processing` and the error once `failed`.
     """
     if kb_id not in knowledge_bases:
         raise HTTPException(status_code=404, detail="Knowledge base not found")
     
-    kb = knowledge_bases[kb_id]
-    return KnowledgeBaseInfo(
-        id=kb["id"],
-        filename=kb["filename"],
-        upload_time=kb["upload_time"],
-        text_length=kb["text_length"],
-        status=kb["status"]
-    )
+    return kb_info(knowledge_bases[kb_id])
 
 @app.get("/knowledge-bases/{kb_id}/preview", tags=["Knowledge Base"])
-async def get_knowledge_base_preview(kb_id: str, chars: int = 1000, user: dict = Depends(authenticate_token)):
+async def get_knowledge_base_preview(
+    kb_id: str,
+    chars: int = 1000,
+    pages: Optional[str] = Query(None, description="Page range such as 40-45"),
+    section: Optional[str] = Query(None, description="Section heading such as Chapter 3"),
+    document_id: Optional[str] = Query(None, description="Document to preview"),
+    user: dict = Depends(authenticate_token)
+):
     """
     Get a preview of the knowledge base content.
     
     - **kb_id**: ID of the knowledge base
     - **chars**: Number of characters to preview (default: 1000)
+    - **pages**, **section**, **document_id**: Limit the preview to a page
+      range or section, as for `/ask`
     
-    Returns a preview of the extracted text content.
+    Returns a preview of the extracted text content and the pages it covers.
     """
     if kb_id not in knowledge_bases:
         raise HTTPException(status_code=404, detail="Knowledge base not found")
     
     kb = knowledge_bases[kb_id]
-    text = kb["text"]
+    scope_pages = []
+    if pages or section or document_id:
+        scope = await asyncio.to_thread(scoped_pages, kb, document_id, pages, section)
+        text = "\n\n".join(page_text for _, texts in scope for _, page_text in texts)
+        scope_pages = [page for _, texts in scope for page, _ in texts]
+    else:
+        text = kb_text(kb)
     
     preview = text[:chars]
     if len(text) > chars:
@@ -318,10 +1124,113 @@ async def get_knowledge_base_preview(kb_id: str, chars: int = 1000, user: dict =
         "knowledge_base_id": kb_id,
         "filename": kb["filename"],
         "preview": preview,
+        "pages": scope_pages,
         "total_length": len(text),
         "preview_length": len(preview)
     }
 
+@app.get("/knowledge-bases/{kb_id}/search", tags=["Knowledge Base"])
+async def search_knowledge_base(
+    kb_id: str,
+    q: str = Query(..., min_length=1, description="Words or phrase to look for"),
+    limit: int = Query(10, ge=1, le=50, description="Maximum passages to return"),
+    document_id: Optional[str] = Query(None, description="Search only this document"),
+    user: dict = Depends(authenticate_token)
+):
+    """
+    Find the passages of a knowledge base that best match a query, without a model call.
+    
+    - **kb_id**: ID of the knowledge base
+    - **q**: Words or phrase to look for
+    - **limit**: Maximum passages to return (1-50, default: 10)
+    - **document_id**: Search only this document
+    
+    Passages are ranked with BM25 over a local index built at ingestion;
+    passages containing the query verbatim rank higher. Each passage has its
+    page and its `start`/`end` character offsets in the extracted text.
+    """
+    if kb_id not in knowledge_bases:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+    
+    kb = knowledge_bases[kb_id]
+    if kb_status(kb) != "ready":
+        raise HTTPException(status_code=400, detail="Knowledge base is not ready")
+    
+    started = time.monotonic()
+    hits = search_passages(scoped_documents(kb, document_id), q, limit)
+    
+    return {
+        "knowledge_base_id": kb_id,
+        "query": q,
+        "passages": [
+            {
+                "document_id": doc["id"],
+                "filename": doc["filename"],
+                "page": hit.page,
+                "start": hit.start,
+                "end": hit.end,
+                "score": hit.score,
+                "text": hit.text
+            }
+            for doc, hit in hits
+        ],
+        "took_ms": round(1000 * (time.monotonic() - started), 2)
+    }
+
+@app.get("/knowledge-bases/{kb_id}/sections", tags=["Knowledge Base"])
+async def get_knowledge_base_sections(kb_id: str, user: dict = Depends(authenticate_token)):
+    """
+    Get the page count and detected section headings of each ready document.
+    
+    - **kb_id**: ID of the knowledge base
+    
+    Each section has its `title`, heading `level` and the `first_page` and
+    `last_page` it spans; pass a title as `section` to `/ask` or `/preview`.
+    """
+    if kb_id not in knowledge_bases:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+    
+    kb = knowledge_bases[kb_id]
+    documents = [
+        {
+            "id": doc["id"],
+            "filename": doc["filename"],
+            "page_count": content["pages"].page_count,
+            "sections": [section.to_dict() for section in content["sections"]]
+        }
+        for doc, content in ready_documents(kb)
+    ]
+    
+    return {
+        "knowledge_base_id": kb_id,
+        "documents": documents
+    }
+
+@app.get("/knowledge-bases/{kb_id}/digest", tags=["Knowledge Base"])
+async def get_knowledge_base_digest(kb_id: str, user: dict = Depends(authenticate_token)):
+    """
+    Get the digest of each ready document in a knowledge base.
+    
+    - **kb_id**: ID of the knowledge base
+    
+    Digests are built once at ingestion without a model call: an outline of
+    detected section headings, key terms and a short extractive summary.
+    """
+    if kb_id not in knowledge_bases:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+    
+    kb = knowledge_bases[kb_id]
+    documents = []
+    for doc in kb["documents"].values():
+        content = doc_content(doc)
+        if content["status"] == "ready" and content["digest"] is not None:
+            documents.append({"id": doc["id"], "filename": doc["filename"], **content["digest"].to_dict()})
+    
+    return {
+        "knowledge_base_id": kb_id,
+        "documents": documents
+    }
+
 @app.delete("/knowledge-bases/{kb_id}", tags=["Knowledge Base"])
 async def delete_knowledge_base(kb_id: str, user: dict = Depends(authenticate_token)):
     """
@@ -334,34 +1243,147 @@ async def delete_knowledge_base(kb_id: str, user: dict = Depends(authenticate_to
     if kb_id not in knowledge_bases:
         raise HTTPException(status_code=404, detail="Knowledge base not found")
     
-    filename = knowledge_bases[kb_id]["filename"]
-    del knowledge_bases[kb_id]
+    kb = knowledge_bases.pop(kb_id)
+    await release_context_cache(kb_context_key(kb))
+    unindex_knowledge_base(kb)
+    filename = kb["filename"]
+    for doc in kb["documents"].values():
+        release_content(doc["content_hash"])
     
     return {
         "message": f"Knowledge base '{filename}' deleted successfully",
         "deleted_id": kb_id
     }
 
+@app.post("/knowledge-bases/{kb_id}/documents", response_model=DocumentResponse, status_code=202, tags=["Knowledge Base"])
+async def add_document(kb_id: str, file: UploadFile = File(...), user: dict = Depends(authenticate_token)):
+    """
+    Append another PDF to an existing knowledge base.
+    
+    Only the new file is extracted; documents already in the knowledge base are
+    left untouched and it stays queryable while the new one is processed.
+    
+    - **kb_id**: ID of the knowledge base
+    - **file**: PDF file to add (multipart/form-data)
+    
+    Returns the new document's ID with `status: processing`, or `ready` when
+    identical bytes were uploaded before (`deduplicated: true`).
+    """
+    if kb_id not in knowledge_bases:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+    
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    
+    upload = await spool_upload(file)
+    content_hash = upload.sha256
+    content, deduplicated = acquire_content(upload)
+    
+    # The knowledge base may have been deleted while the upload streamed in
+    kb = knowledge_bases.get(kb_id)
+    if kb is None:
+        release_content(content_hash)
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+    
+    doc = new_document(file.filename, content_hash)
+    kb["documents"][doc["id"]] = doc
+    
+    return DocumentResponse(
+        id=doc["id"],
+        knowledge_base_id=kb_id,
+        filename=file.filename,
+        upload_time=doc["upload_time"],
+        status=content["status"],
+        message="Identical PDF already uploaded; reusing its extracted text" if deduplicated
+            else "PDF accepted and queued for processing",
+        deduplicated=deduplicated
+    )
+
+@app.delete("/knowledge-bases/{kb_id}/documents/{doc_id}", tags=["Knowledge Base"])
+async def delete_document(kb_id: str, doc_id: str, user: dict = Depends(authenticate_token)):
+    """
+    Remove a single document from a knowledge base.
+    
+    - **kb_id**: ID of the knowledge base
+    - **doc_id**: ID of the document to remove
+    
+    The knowledge base itself is kept, even when its last document is removed.
+    """
+    if kb_id not in knowledge_bases:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+    
+    kb = knowledge_bases[kb_id]
+    if doc_id not in kb["documents"]:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    context_key = kb_context_key(kb)
+    doc = kb["documents"].pop(doc_id)
+    await release_context_cache(context_key)
+    release_content(doc["content_hash"])
+    filename = doc["filename"]
+    
+    return {
+        "message": f"Document '{filename}' removed from knowledge base",
+        "deleted_id": doc_id,
+        "knowledge_base_id": kb_id
+    }
+
+@app.get("/metrics", tags=["Health"])
+async def metrics():
+    """
+    Runtime counters for monitoring.
+    
+    - **llm_gateway**: concurrency, attempts, retries, timeouts and failures of
+      Gemini calls, hedged calls per endpoint when `LLM_HEDGING` is on and
+      the models chosen per endpoint when `LLM_ROUTING` is on
+    - **llm_single_flight**: generation calls, upstream executions and requests
+      coalesced onto an identical in-flight call
+    - **pdf_extraction**: queue depth of PDF extraction, how long jobs waited
+      for a slot, failures by kind, probe rejections and compaction savings
+    - **digests**: document digests built at ingestion and stored for the
+      other services
+    - **section_trees**: section trees of long documents, and how many nodes
+      and chunks an `/ask` search scored against the chunks in the document
+    - **passage_search**: local passage searches (`/search` and extractive
+      `/ask` answers) and how long they took
+    - **ask_batching**: `/ask` questions submitted, batches sent, questions
+      answered in shared batches and answers asked again because a batched
+      reply lacked them (null when `ASK_BATCHING` is off)
+    """
+    return {
+        "timestamp": datetime.now(),
+        "llm_gateway": llm_gateway.snapshot(),
+        "pdf_extraction": extraction_executor.snapshot(),
+        "digests": digest_store.snapshot(),
+        "section_trees": tree_snapshot(),
+        "passage_search": search_snapshot(),
+        "ask_batching": {**ask_batcher.snapshot(), **batch_stats} if ask_batcher is not None else None,
+        "llm_single_flight": llm_gateway.flights.snapshot()
+    }
+
 @app.get("/health", tags=["Health"])
 async def health_check():
     """
     Health check endpoint.
     
-    Returns the current status of the API and its dependencies.
+    Returns the current status of the API and its dependencies. Gemini status
+    comes from the cached background probe, so this never calls the model.
+    `text_storage` reports how well extracted text compresses in memory and
+    in the extraction cache on disk, and the memory held by the passage
+    indexes and section trees built over it.
     """
-    try:
-        # Test Gemini AI connection
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        test_response = model.generate_content("Hello")
-        gemini_status = "healthy" if test_response else "unhealthy"
-    except:
-        gemini_status = "unhealthy"
+    gemini = gemini_monitor.snapshot()
     
     return {
         "status": "healthy",
         "timestamp": datetime.now(),
         "knowledge_bases_count": len(knowledge_bases),
-        "gemini_ai_status": gemini_status,
+        "pending_ingestions": pending_ingestions,
+        "unique_documents": len(extracted_contents),
+        "gemini_ai_status": gemini["status"],
+        "gemini_ai": gemini,
+        "context_cache": context_cache.snapshot() if context_cache else None,
+        "text_storage": text_storage_snapshot(),
         "version": "1.0.0"
     }
 
@@ -79,14 +79,13 @@ def test_upload_pdf():
         files = {"file": ("sample_document.pdf", pdf_buffer, "application/pdf")}
         response = requests.post(f"{BASE_URL}/upload-pdf", files=files)
         
-        if response.status_code == 200:
+        if response.status_code == 202:
             data = response.json()
-            print(f"✅ PDF uploaded successfully")
+            print(f"✅ PDF accepted for processing")
             print(f"   ID: {data['id']}")
             print(f"   Filename: {data['filename']}")
-            print(f"   Text length: {data['text_length']} characters")
             print(f"   Status: {data['status']}")
-            return data['id']
+            return wait_until_ready(data['id'])
         else:
             print(f"❌ PDF upload failed: {response.status_code}")
             print(f"   Error: {response.text}")
@@ -95,6 +94,26 @@ def test_upload_pdf():
         print(f"❌ PDF upload error: {e}")
         return None
 
+def wait_until_ready(kb_id, timeout=60):
+    """Poll the knowledge base until background ingestion finishes"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = requests.get(f"{BASE_URL}/knowledge-bases/{kb_id}")
+        if response.status_code != 200:
+            print(f"❌ Status poll failed: {response.status_code}")
+            return None
+        data = response.json()
+        if data['status'] == "ready":
+            print(f"✅ PDF processed ({data['text_length']} characters)")
+            return kb_id
+        if data['status'] == "failed":
+            print(f"❌ PDF processing failed: {data['error']}")
+            return None
+        print(f"   Processing... {data['progress'] * 100:.0f}%")
+        time.sleep(0.5)
+    print(f"❌ PDF processing timed out")
+    return None
+
 def test_ask_question(kb_id, question):
     """Test question asking endpoint"""
     print(f"\n=== Testing Question: '{question}' ===")
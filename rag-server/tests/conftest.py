@@ -0,0 +1,12 @@
+import os
+import sys
+
+# rag-server is not a package: make its modules and the repository's ai_common importable
+RAG_SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAG_SERVER)
+sys.path.insert(0, os.path.dirname(RAG_SERVER))
+
+# main.py refuses to start without these; the tests never call Gemini
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("ACCESS_TOKEN_SECRET", "test")
+os.environ.setdefault("HEALTH_PROBE_INTERVAL", "3600")
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from kb_index import KnowledgeBaseIndex, decode_cursor, encode_cursor
+
+START = datetime(2024, 1, 15, 10, 0, 0)
+
+
+def filled(count: int, bucket: str = "owner") -> KnowledgeBaseIndex:
+    index = KnowledgeBaseIndex()
+    for number in range(count):
+        index.add(bucket, KnowledgeBaseIndex.key(f"kb-{number:02d}", START + timedelta(seconds=number)))
+    return index
+
+
+def all_pages(index: KnowledgeBaseIndex, bucket: str, limit: int):
+    pages, cursor = [], None
+    while True:
+        ids, cursor = index.page(bucket, limit, cursor)
+        pages.append(ids)
+        if cursor is None:
+            return pages
+
+
+def test_pages_are_newest_first_and_cover_every_id():
+    pages = all_pages(filled(7), "owner", 3)
+    assert pages == [["kb-06", "kb-05", "kb-04"], ["kb-03", "kb-02", "kb-01"], ["kb-00"]]
+
+
+def test_exact_multiple_of_the_page_size_has_no_empty_last_page():
+    pages = all_pages(filled(6), "owner", 3)
+    assert [len(page) for page in pages] == [3, 3]
+
+
+def test_unknown_bucket_is_empty():
+    assert filled(3).page("someone-else", 10) == ([], None)
+
+
+def test_cursor_is_stable_when_newer_ids_arrive():
+    index = filled(5)
+    first, cursor = index.page("owner", 2)
+    index.add("owner", KnowledgeBaseIndex.key("kb-new", START + timedelta(hours=1)))
+    second, _ = index.page("owner", 2, cursor)
+    assert first == ["kb-04", "kb-03"]
+    assert second == ["kb-02", "kb-01"]
+
+
+def test_cursor_survives_removal_of_its_own_id():
+    index = filled(5)
+    _, cursor = index.page("owner", 2)
+    index.remove("owner", KnowledgeBaseIndex.key("kb-03", START + timedelta(seconds=3)))
+    assert index.page("owner", 2, cursor)[0] == ["kb-02", "kb-01"]
+
+
+def test_same_upload_time_is_ordered_by_id():
+    index = KnowledgeBaseIndex()
+    for kb_id in ("b", "a", "c"):
+        index.add("owner", KnowledgeBaseIndex.key(kb_id, START))
+    assert all_pages(index, "owner", 1) == [["c"], ["b"], ["a"]]
+
+
+def test_remove_drops_empty_buckets():
+    index = filled(1)
+    index.remove("owner", KnowledgeBaseIndex.key("kb-00", START))
+    index.remove("owner", KnowledgeBaseIndex.key("kb-00", START))
+    assert index.count("owner") == 0
+
+
+def test_cursor_round_trip():
+    key = KnowledgeBaseIndex.key("123e4567-e89b-12d3-a456-426614174000", START)
+    assert decode_cursor(encode_cursor(key)) == key
+
+
+@pytest.mark.parametrize("cursor", ["zzz", "bm90IGEgY3Vyc29y", "!"])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        filled(3).page("owner", 2, cursor)
@@ -0,0 +1,33 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("question", [
+    "What is this document about?",
+    "Summarize the book",
+    "please summarise these slides.",
+    "Give me an overview of this PDF",
+    "What are the main topics of the lecture?",
+])
+def test_whole_document_questions_are_overview_questions(question):
+    assert main.OVERVIEW_QUESTION_RE.search(question)
+
+
+@pytest.mark.parametrize("question", [
+    "Summarize the proof of Theorem 3",
+    "What is this document's definition of a heap?",
+    "Give an overview of Dijkstra's algorithm",
+    "What are the main topics of chapter 2 in the book?",
+    "Explain what this document says about recursion",
+    "Summarize the book and list every exercise",
+])
+def test_specific_questions_are_not_overview_questions(question):
+    assert not main.OVERVIEW_QUESTION_RE.search(question)
+
+
+def test_digest_covers_only_terms_it_contains():
+    digest = "Outline: Graphs, Trees. Key terms: vertex, edge, heap."
+    assert main.digest_covers("Summarize the book", digest)
+    assert main.digest_covers("What are the main topics of the graphs notes?", digest)
+    assert not main.digest_covers("Summarize the book on recursion", digest)